@@ -1,61 +1,81 @@
-from flask import Flask, jsonify
+from typing import Any, Mapping, Optional
+from dotenv import load_dotenv
+from flask import Flask
 from flask_cors import CORS
-from google.cloud.sql.connector import Connector, IPTypes
-import sqlalchemy
-import os
 from controllers.ChatController import chat_controller
 from controllers.UserController import user_controller
+from services.AppServices import EXTENSION_KEY, AppServices
+from storage.database import LazyEngine, create_engine_from_url, pool
+from utils import logging_config, metrics, profiling, rate_limit
 
-# Load environment variables
-DB_USER = os.getenv("DB_USER")
-DB_PASS = os.getenv("DB_PASS")
-DB_NAME = os.getenv("DB_NAME")
-INSTANCE_CONNECTION_NAME = os.getenv("INSTANCE_CONNECTION_NAME")
-
-# Initialize connector
-connector = Connector()
-
-# Define the connection function
-def getconn():
-    conn = connector.connect(
-        INSTANCE_CONNECTION_NAME,
-        "pymysql",
-        user=DB_USER,
-        password=DB_PASS,
-        db=DB_NAME,
-        ip_type=IPTypes.PUBLIC
-    )
-    return conn
-
-# Create connection pool
-pool = sqlalchemy.create_engine(
-    "mysql+pymysql://",
-    creator=getconn,
-)
-
-# Create Flask app
-app = Flask(__name__)
-
-# Configure CORS
-CORS(app, resources={
-    "*": {
-        "origins": ["http://localhost:3000", "https://getherly-frontend.vercel.app"],
-        "methods": ["GET", "POST", "PUT", "DELETE"],
-        "allow_headers": ["Content-Type", "Authorization"]
-    }
-})
-
-# Register the chat controller with the /api prefix
-app.register_blueprint(chat_controller, url_prefix='/api/chats')
-app.register_blueprint(user_controller, url_prefix='/api/auth')
-
-@app.route('/')
-def health_check():
-    """Health check endpoint."""
-    return {"status": "healthy"}, 200
-
-
-@app.teardown_appcontext
-def close_connector(exception=None):
-    """Clean up the connector on application teardown."""
-    connector.close()
+DEFAULT_CONFIG = {
+    "CORS_ORIGINS": ["http://localhost:3000", "https://getherly-frontend.vercel.app"],
+    # Root and per-module log levels, and debug sampling on hot endpoints (utils/logging_config.py)
+    "LOG_LEVEL": logging_config.LOG_LEVEL,
+    "LOG_LEVELS": logging_config.LOG_LEVELS,
+    "LOG_DEBUG_SAMPLE_RATE": logging_config.LOG_DEBUG_SAMPLE_RATE,
+    "LOG_SAMPLED_ENDPOINTS": logging_config.LOG_SAMPLED_ENDPOINTS,
+    # Purge soft-deleted chats in a background thread (services/ChatReaper.py)
+    "CHAT_REAPER": True,
+    # Per-user and per-chat token buckets on the chat API (utils/rate_limit.py)
+    "RATE_LIMITS": True,
+    # Requests over this many in flight get a 503 instead of waiting on the database pool
+    "MAX_IN_FLIGHT_REQUESTS": rate_limit.MAX_IN_FLIGHT_REQUESTS,
+}
+
+
+def create_app(config: Optional[Mapping[str, Any]] = None, engine=None, llm=None) -> Flask:
+    """Create and configure the Flask application
+
+    Nothing expensive happens here: the database engine (and Cloud SQL connector) is
+    created on the first query and the OpenAI client on the first LLM call. The app's
+    repositories and services live in ``app.extensions["gatherly"]`` (services.AppServices);
+    no module-level state is changed, so several apps can coexist in one process.
+
+    Args:
+        config: Flask config overrides, e.g. ``{"TESTING": True, "DATABASE_URL": "sqlite://"}``
+        engine: SQLAlchemy engine to use instead of the one configured by the environment
+        llm: LangChain LLM to use instead of the OpenAI client
+    """
+    # Pick up .env before anything reads the environment lazily
+    load_dotenv()
+
+    app = Flask(__name__)
+    app.config.from_mapping(DEFAULT_CONFIG)
+    app.config.from_mapping(config or {})
+
+    # JSON records with request ids, written off the request thread
+    logging_config.init_app(app)
+
+    if engine is None and app.config.get("DATABASE_URL"):
+        url = app.config["DATABASE_URL"]
+        engine = LazyEngine(lambda: create_engine_from_url(url))
+    engine = engine if engine is not None else pool
+    app.extensions[EXTENSION_KEY] = AppServices.build(engine, llm=llm)
+
+    # Configure CORS
+    CORS(app, resources={
+        "*": {
+            "origins": app.config["CORS_ORIGINS"],
+            "methods": ["GET", "POST", "PUT", "DELETE"],
+            "allow_headers": ["Content-Type", "Authorization"]
+        }
+    })
+
+    # Register the chat controller with the /api prefix
+    app.register_blueprint(chat_controller, url_prefix='/api/chats')
+    app.register_blueprint(user_controller, url_prefix='/api/auth')
+
+    # Per-request SQL/LLM timing, Server-Timing headers and the /metrics endpoint
+    metrics.init_app(app, engine)
+    # Opt-in per-request profiles (PROFILE_SECRET / PROFILE_SAMPLE_RATE)
+    profiling.init_app(app)
+    # Shed load with a 503 before the database pool runs out of connections
+    rate_limit.init_app(app)
+
+    @app.route('/')
+    def health_check():
+        """Health check endpoint."""
+        return {"status": "healthy"}, 200
+
+    return app
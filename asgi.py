@@ -0,0 +1,10 @@
+"""ASGI entry point for gunicorn's uvicorn worker (``gunicorn asgi:app``, see gunicorn.conf.py).
+
+The async ``/summary`` and ``/validate`` views run on the worker's event loop without
+holding a thread while the LLM answers; every other view runs on a thread pool
+(utils/asgi.py).
+"""
+from app import create_app
+from utils.asgi import AsgiApp
+
+app = AsgiApp(create_app())
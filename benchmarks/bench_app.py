@@ -0,0 +1,33 @@
+"""Entry points for benchmarks: the real app on a local database with a stub LLM, as
+``app`` (WSGI) and ``asgi_app`` (for uvicorn's worker).
+
+Configured through the environment so every gunicorn worker sets itself up the same way:
+
+    DATABASE_URL          database to run against (the load generator passes a SQLite file)
+    BENCH_LLM_LATENCY_MS  simulated LLM latency per call
+    BENCH_LLM             "openai" keeps the real OpenAI client (pointed at OPENAI_API_BASE,
+                          e.g. benchmarks.fake_openai) instead of the in-process stub
+"""
+import os
+
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from app import create_app  # noqa: E402
+from benchmarks.fake_llm import SlowFakeLLM  # noqa: E402
+from storage.database import pool  # noqa: E402
+from utils.asgi import AsgiApp  # noqa: E402
+from utils.llm_metrics import llm_metrics_callback  # noqa: E402
+
+if os.getenv("BENCH_LLM") == "openai":
+    app = create_app()
+else:
+    app = create_app(llm=SlowFakeLLM(
+        latency=float(os.getenv("BENCH_LLM_LATENCY_MS", "0")) / 1000,
+        callbacks=[llm_metrics_callback]
+    ))
+asgi_app = AsgiApp(app)
+
+if pool.dialect.name == "sqlite":
+    # Several worker processes write concurrently; WAL lets readers proceed during writes
+    with pool.connect() as conn:
+        conn.exec_driver_sql("PRAGMA journal_mode=WAL")
@@ -0,0 +1,90 @@
+"""Measure cold start: fresh interpreter -> app imported -> first response served.
+
+Each run spawns a new Python process that imports the ``wsgi`` entry point (module
+import plus ``create_app()``), then serves ``GET /`` through the test client, and reports the
+elapsed milliseconds for each step. The JSON report contains the median and max over
+``--runs``. ``--importtime`` also lists the slowest modules from ``python -X importtime``:
+
+    python -m benchmarks.cold_start --runs 10 --importtime 15
+"""
+from statistics import median
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.loadgen import REPO_ROOT, git_commit
+
+PROBE = """
+import json, time
+started = time.perf_counter()
+import wsgi
+imported = time.perf_counter()
+response = wsgi.app.test_client().get("/")
+assert response.status_code == 200, response.status_code
+served = time.perf_counter()
+print(json.dumps({"import_ms": (imported - started) * 1000, "first_response_ms": (served - started) * 1000}))
+"""
+
+
+def probe_env() -> dict:
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT)
+    env.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "cold-start.db"))
+    env.setdefault("OPENAI_API_KEY", "cold-start")
+    return env
+
+
+def run_probe(env: dict) -> dict:
+    output = subprocess.check_output([sys.executable, "-c", PROBE], cwd=REPO_ROOT, env=env, text=True)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def slowest_imports(env: dict, count: int) -> list:
+    """Top ``count`` modules by cumulative import time, from ``-X importtime``"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import wsgi"],
+                            cwd=REPO_ROOT, env=env, capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|(\s*)(\S+)", line)
+        if match:
+            rows.append({"module": match.group(3), "depth": len(match.group(2)) // 2,
+                         "cumulative_ms": int(match.group(1)) / 1000})
+    return sorted(rows, key=lambda row: row["cumulative_ms"], reverse=True)[:count]
+
+
+def main(argv=None) -> dict:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--importtime", type=int, default=0, metavar="N",
+                        help="also report the N slowest imports")
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    args = parser.parse_args(argv)
+
+    env = probe_env()
+    run_probe(env)  # warm the filesystem and bytecode caches
+    runs = [run_probe(env) for _ in range(args.runs)]
+    report = {
+        "commit": git_commit(),
+        "runs": args.runs,
+        **{
+            key: {"median": round(median(run[key] for run in runs), 1),
+                  "max": round(max(run[key] for run in runs), 1)}
+            for key in ("import_ms", "first_response_ms")
+        },
+    }
+    if args.importtime:
+        report["slowest_imports"] = slowest_imports(env, args.importtime)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+from typing import Any, List, Optional
+import asyncio
+import time
+from langchain_core.language_models.fake import FakeListLLM
+
+ON_TOPIC_RESPONSE = """
+1. Is_On_Topic: Yes
+2. Confidence: 90%
+3. Analysis: The discussion follows the agenda.
+4. Off_Topic_Examples: none
+"""
+
+
+class SlowFakeLLM(FakeListLLM):
+    """Canned completions that take ``latency`` seconds, standing in for the OpenAI round trip"""
+
+    latency: float = 0.0
+    responses: List[str] = [ON_TOPIC_RESPONSE]
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        return super()._call(prompt, stop, run_manager, **kwargs)
+
+    async def _acall(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> str:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return await super()._acall(prompt, stop, run_manager, **kwargs)
@@ -0,0 +1,81 @@
+"""Local stand-in for the OpenAI completions API with configurable latency.
+
+Point the app's OpenAI client at it (``OPENAI_API_BASE=http://127.0.0.1:<port>/v1``) to
+benchmark the real HTTP client path, sync or async, without calling OpenAI:
+
+    python -m benchmarks.fake_openai --port 8766 --latency-ms 500
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import threading
+import time
+import uuid
+
+from benchmarks.fake_llm import ON_TOPIC_RESPONSE
+
+
+class CompletionHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        request = json.loads(body or b"{}")
+        prompts = request.get("prompt") or [""]
+        if isinstance(prompts, str):
+            prompts = [prompts]
+        time.sleep(self.server.latency)
+
+        completion_tokens = len(ON_TOPIC_RESPONSE.split())
+        prompt_tokens = sum(len(prompt.split()) for prompt in prompts)
+        payload = json.dumps({
+            "id": f"cmpl-{uuid.uuid4().hex}",
+            "object": "text_completion",
+            "created": int(time.time()),
+            "model": request.get("model", "gpt-3.5-turbo-instruct"),
+            "choices": [
+                {"text": ON_TOPIC_RESPONSE, "index": index, "logprobs": None, "finish_reason": "stop"}
+                for index in range(len(prompts))
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens * len(prompts),
+                "total_tokens": prompt_tokens + completion_tokens * len(prompts),
+            },
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, port: int = 0, latency: float = 0.0):
+        super().__init__(("127.0.0.1", port), CompletionHandler)
+        self.latency = latency
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def start(self) -> "FakeOpenAIServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latency-ms", type=float, default=500)
+    args = parser.parse_args()
+    server = FakeOpenAIServer(args.port, args.latency_ms / 1000)
+    print(f"Serving fake completions on {server.base_url}")
+    server.serve_forever()
@@ -0,0 +1,333 @@
+"""Drive a realistic request mix against the app under gunicorn and report per-endpoint latency.
+
+By default this migrates a fresh SQLite database, starts gunicorn on
+``benchmarks.bench_app:app`` (stub LLM with ``--llm-latency-ms`` of simulated latency),
+registers users, then runs ``--concurrency`` client threads for ``--duration`` seconds.
+The JSON report lists throughput and p50/p95/p99 per endpoint plus the configuration
+and git commit, so runs can be compared across commits and worker/thread settings:
+
+    python -m benchmarks.loadgen --workers 2 --threads 8 --duration 30 --output bench.json
+
+Pass ``--url`` to benchmark a server that is already running instead. ``--fake-openai``
+replaces the stub LLM with the real OpenAI client talking to ``benchmarks.fake_openai``, so
+the HTTP client path (including the async summary/validate views and their shared LLM
+event loop) is exercised too.
+"""
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Optional
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import requests
+
+DEFAULT_MIX = {
+    "send_message": 50,
+    "get_messages": 25,
+    "get_user_chats": 10,
+    "create_chat": 5,
+    "join_chat": 5,
+    "get_summary": 5,
+}
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Linearly interpolated percentile of already sorted values, ``q`` in [0, 100]"""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def parse_mix(spec: Optional[str]) -> Dict[str, int]:
+    if not spec:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in DEFAULT_MIX:
+            raise SystemExit(f"Unknown operation in mix: {name}")
+        mix[name.strip()] = int(weight)
+    return mix
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@contextmanager
+def gunicorn_server(port: int, workers: int, threads: int, env: Dict[str, str], worker_class: Optional[str] = None):
+    worker_class = worker_class or env.get("GUNICORN_WORKER_CLASS")
+    # Without a worker class gunicorn.conf.py picks uvicorn's, which needs the ASGI app
+    asgi = worker_class is None or "uvicorn" in worker_class.lower()
+    target = "benchmarks.bench_app:asgi_app" if asgi else "benchmarks.bench_app:app"
+    command = [
+        sys.executable, "-m", "gunicorn", target,
+        "--bind", f"127.0.0.1:{port}",
+        "--workers", str(workers),
+        "--threads", str(threads),
+        "--log-level", "warning",
+    ]
+    if worker_class:
+        command += ["--worker-class", worker_class]
+    process = subprocess.Popen(command, cwd=REPO_ROOT, env=env)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                if requests.get(base_url + "/", timeout=5).status_code == 200:
+                    break
+            except requests.RequestException:
+                pass
+            if process.poll() is not None or time.time() > deadline:
+                raise SystemExit("gunicorn did not start")
+            time.sleep(0.2)
+        yield base_url
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+@contextmanager
+def fake_openai_server(port: int, latency_ms: float, env: Dict[str, str]):
+    """Run benchmarks.fake_openai and point the app's OpenAI client (via ``env``) at it"""
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_openai", "--port", str(port), "--latency-ms", str(latency_ms)],
+        cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL
+    )
+    env.update(OPENAI_API_BASE=f"http://127.0.0.1:{port}/v1", BENCH_LLM="openai")
+    try:
+        deadline = time.time() + 10
+        while True:
+            try:
+                requests.get(f"http://127.0.0.1:{port}/", timeout=1)
+                break
+            except requests.RequestException:
+                if process.poll() is not None or time.time() > deadline:
+                    raise SystemExit("fake OpenAI server did not start")
+                time.sleep(0.1)
+        yield
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+class Workload:
+    """Shared state for the simulated users: accounts, tokens and chat memberships"""
+
+    def __init__(self, base_url: str, users: int):
+        self.base_url = base_url
+        self.users = []
+        self.chats: List[str] = []
+        self.memberships: Dict[str, set] = defaultdict(set)
+        self.lock = threading.Lock()
+        self._setup(users)
+
+    def _setup(self, users: int) -> None:
+        session = requests.Session()
+        for i in range(users):
+            email = f"bench-{uuid.uuid4()}@example.com"
+            session.post(self.base_url + "/api/auth/register",
+                         json={"email": email, "password": "benchmark", "name": f"User {i}"}).raise_for_status()
+            login = session.post(self.base_url + "/api/auth/login", json={"email": email, "password": "benchmark"})
+            login.raise_for_status()
+            self.users.append({
+                "id": login.json()["user_id"],
+                "headers": {"Authorization": f"Bearer {login.json()['token']}"}
+            })
+        for user in self.users:
+            self.create_chat(session, user)
+
+    def create_chat(self, session, user):
+        response = session.post(self.base_url + "/api/chats/create", headers=user["headers"], json={
+            "creator_id": user["id"],
+            "chat_name": "Weekend trip",
+            "agenda": "Plan the weekend trip: destination, budget and schedule"
+        })
+        if response.status_code == 201:
+            chat_id = response.json()["chat"]["id"]
+            with self.lock:
+                self.chats.append(chat_id)
+                self.memberships[user["id"]].add(chat_id)
+        return response
+
+    def member_chat(self, rng, user) -> str:
+        with self.lock:
+            joined = list(self.memberships[user["id"]]) or self.chats
+            return rng.choice(joined)
+
+    def run_operation(self, name: str, session, rng, user):
+        url = self.base_url + "/api/chats"
+        if name == "create_chat":
+            return self.create_chat(session, user)
+        if name == "join_chat":
+            with self.lock:
+                candidates = [c for c in self.chats if c not in self.memberships[user["id"]]]
+            chat_id = rng.choice(candidates or self.chats)
+            response = session.post(f"{url}/{chat_id}/join", headers=user["headers"], json={"user_id": user["id"]})
+            if response.status_code == 200:
+                with self.lock:
+                    self.memberships[user["id"]].add(chat_id)
+            return response
+        if name == "send_message":
+            chat_id = self.member_chat(rng, user)
+            content = rng.choice([
+                "How about Coorg for the destination?",
+                "Budget should stay under 10k each",
+                "Can we leave Friday evening?",
+                "Did anyone watch the match yesterday?",
+            ])
+            return session.post(f"{url}/{chat_id}/messages", headers=user["headers"],
+                                json={"user_id": user["id"], "content": content})
+        if name == "get_messages":
+            return session.get(f"{url}/{self.member_chat(rng, user)}/messages?limit=20", headers=user["headers"])
+        if name == "get_user_chats":
+            return session.get(f"{url}/user/{user['id']}/chats", headers=user["headers"])
+        if name == "get_summary":
+            return session.get(f"{url}/{self.member_chat(rng, user)}/summary", headers=user["headers"])
+        raise ValueError(name)
+
+
+def run_clients(workload: Workload, mix: Dict[str, int], concurrency: int, duration: float,
+                warmup: float, seed: int) -> List[tuple]:
+    """Run client threads and return (operation, latency seconds, status, finished_at) samples"""
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    samples = []
+    samples_lock = threading.Lock()
+    start = time.perf_counter()
+    stop_at = start + warmup + duration
+
+    def client(index: int):
+        rng = random.Random(seed + index)
+        session = requests.Session()
+        local = []
+        while time.perf_counter() < stop_at:
+            name = rng.choices(names, weights)[0]
+            user = rng.choice(workload.users)
+            began = time.perf_counter()
+            try:
+                status = workload.run_operation(name, session, rng, user).status_code
+            except requests.RequestException:
+                status = 0
+            finished = time.perf_counter()
+            if began - start >= warmup:
+                local.append((name, finished - began, status, finished))
+        with samples_lock:
+            samples.extend(local)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+def summarize(samples: List[tuple], duration: float) -> Dict:
+    by_operation = defaultdict(list)
+    for sample in samples:
+        by_operation[sample[0]].append(sample)
+
+    def stats(group):
+        latencies = sorted(latency for _, latency, _, _ in group)
+        return {
+            "count": len(group),
+            "errors": sum(1 for _, _, status, _ in group if status == 0 or status >= 500),
+            "client_errors": sum(1 for _, _, status, _ in group if 400 <= status < 500),
+            "throughput_rps": round(len(group) / duration, 2),
+            "mean_ms": round(1000 * sum(latencies) / len(latencies), 2) if latencies else 0.0,
+            "p50_ms": round(1000 * percentile(latencies, 50), 2),
+            "p95_ms": round(1000 * percentile(latencies, 95), 2),
+            "p99_ms": round(1000 * percentile(latencies, 99), 2),
+            "max_ms": round(1000 * latencies[-1], 2) if latencies else 0.0,
+        }
+
+    return {
+        "overall": stats(samples),
+        "endpoints": {name: stats(group) for name, group in sorted(by_operation.items())},
+    }
+
+
+def main(argv=None) -> Dict:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="benchmark an already running server instead of starting gunicorn")
+    parser.add_argument("--database-url", help="database for the spawned server (default: fresh SQLite file)")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker processes")
+    parser.add_argument("--threads", type=int, default=4, help="gunicorn threads per worker")
+    parser.add_argument("--worker-class", help="gunicorn worker class (default: gunicorn.conf.py's, uvicorn)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--llm-latency-ms", type=float, default=300, help="simulated LLM latency per call")
+    parser.add_argument("--fake-openai", action="store_true",
+                        help="use the OpenAI client against a local fake completion server instead of the stub LLM")
+    parser.add_argument("--fake-openai-port", type=int, default=8766)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=16, help="client threads")
+    parser.add_argument("--duration", type=float, default=20, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds excluded from the report")
+    parser.add_argument("--mix", help="weights, e.g. send_message=50,get_messages=25 (default: realistic mix)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    args = parser.parse_args(argv)
+    mix = parse_mix(args.mix)
+
+    def execute(base_url):
+        workload = Workload(base_url, args.users)
+        samples = run_clients(workload, mix, args.concurrency, args.duration, args.warmup, args.seed)
+        return summarize(samples, args.duration)
+
+    if args.url:
+        results = execute(args.url.rstrip("/"))
+    else:
+        database_url = args.database_url or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+        env = dict(os.environ, DATABASE_URL=database_url, BENCH_LLM_LATENCY_MS=str(args.llm_latency_ms),
+                   BCRYPT_ROUNDS=os.getenv("BCRYPT_ROUNDS", "4"), PYTHONPATH=REPO_ROOT)
+        subprocess.check_call([sys.executable, "-m", "storage.migrations"], cwd=REPO_ROOT, env=env,
+                              stdout=subprocess.DEVNULL)
+        with fake_openai_server(args.fake_openai_port, args.llm_latency_ms, env) if args.fake_openai else nullcontext():
+            with gunicorn_server(args.port, args.workers, args.threads, env, args.worker_class) as base_url:
+                results = execute(base_url)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "config": {
+            "url": args.url,
+            "workers": args.workers,
+            "threads": args.threads,
+            "worker_class": args.worker_class,
+            "llm_latency_ms": args.llm_latency_ms,
+            "llm": "fake-openai" if args.fake_openai else "stub",
+            "users": args.users,
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "warmup_s": args.warmup,
+            "mix": mix,
+        },
+        **results,
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,12 @@
 from oauthlib.oauth2 import WebApplicationClient
+from utils.oidc import OIDCProvider
 import os
 
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
 GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
-GOOGLE_DISCOVERY_URL = "https://accounts.google.com/.well-known/openid-configuration"
+GOOGLE_DISCOVERY_URL = os.getenv("GOOGLE_DISCOVERY_URL", "https://accounts.google.com/.well-known/openid-configuration")
 GOOGLE_REDIRECT_URI = os.getenv("GOOGLE_REDIRECT_URI", "http://localhost:5000/api/auth/google/callback")
+GOOGLE_DISCOVERY_TTL = float(os.getenv("GOOGLE_DISCOVERY_TTL", "3600"))
 
-client = WebApplicationClient(GOOGLE_CLIENT_ID)
\ No newline at end of file
+client = WebApplicationClient(GOOGLE_CLIENT_ID)
+google_provider = OIDCProvider(GOOGLE_DISCOVERY_URL, GOOGLE_CLIENT_ID, ttl=GOOGLE_DISCOVERY_TTL)
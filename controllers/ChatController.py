@@ -1,31 +1,51 @@
-from flask import Blueprint, request, jsonify
-from services.ChatService import ChatService
-from repositories.ChatRepository import ChatRepository
-from repositories.UserRepository import UserRepository
+from flask import Blueprint, current_app, request, jsonify, Response, stream_with_context
+from werkzeug.local import LocalProxy
+from services.AppServices import current_services
 import uuid
 from datetime import datetime
 from entities.Message import Message
-from services.SummaryService import SummaryService
+from repositories.ChatRepository import CHAT_MESSAGES_LIMIT
+from services.ChatService import NotParticipant
+from utils.llm_scheduler import BACKGROUND, LLMOverloaded
+from middleware.auth import require_auth, current_identity
+from utils.concurrency import ServerBusy, release_request_slot
+from utils.rate_limit import RateLimited, rate_limit
+from utils.streaming import ndjson_batches, gzip_stream
+from itertools import chain
 import logging
-import traceback
 
-# Initialize logger
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='[%(asctime)s] %(levelname)s in %(module)s: %(message)s'
-)
+# Initialize logger (handlers are configured by create_app)
 logger = logging.getLogger(__name__)
 
 # Create Blueprint for chat routes
 chat_controller = Blueprint('chat_controller', __name__)
 
-# Initialize repositories and service
-chat_repo = ChatRepository()
-user_repo = UserRepository()
-chat_service = ChatService(chat_repo, user_repo)
+# Repositories and services belong to the app (create_app); these resolve per request
+chat_repo = LocalProxy(lambda: current_services().chat_repository)
+chat_service = LocalProxy(lambda: current_services().chat_service)
+summary_service = LocalProxy(lambda: current_services().summary_service)
 
-# Initialize SummaryService
-summary_service = SummaryService(chat_repo, chat_service)
+@chat_controller.before_app_request
+def start_chat_reaper():
+    # Started on the first request so importing the app touches no database
+    if current_app.config["CHAT_REAPER"]:
+        current_services().chat_reaper.start()
+
+@chat_controller.errorhandler(LLMOverloaded)
+def llm_overloaded(error):
+    return jsonify({"error": str(error)}), 503, {"Retry-After": str(max(1, round(error.retry_after)))}
+
+@chat_controller.errorhandler(ServerBusy)
+def server_busy(error):
+    return jsonify({"error": str(error)}), 503, {"Retry-After": str(error.retry_after)}
+
+@chat_controller.errorhandler(NotParticipant)
+def not_participant(error):
+    return jsonify({"error": str(error)}), 403
+
+@chat_controller.errorhandler(RateLimited)
+def rate_limited(error):
+    return jsonify({"error": str(error)}), 429, {"Retry-After": str(max(1, round(error.retry_after)))}
 
 @chat_controller.route('/health', methods=['GET'])
 def health_check():
@@ -35,6 +55,8 @@ def health_check():
 
 
 @chat_controller.route('/create', methods=['POST'])
+@require_auth
+@rate_limit("user")
 def create_chat():
     """Create a new chat"""
     try:
@@ -47,7 +69,6 @@ def create_chat():
                 "error": "Missing required fields: creator_id, chat_name, agenda"
             }), 400
 
-        logger.debug("Request data: %s", data)
         chat_id = str(uuid.uuid4())
         logger.debug("Generated chat ID: %s", chat_id)
         
@@ -76,12 +97,13 @@ def create_chat():
         }), 201
 
     except Exception as e:
-        logger.error("An error occurred while creating a chat: %s", str(e))
-        print("Stack trace: %s", traceback.format_exc())
+        logger.exception("An error occurred while creating a chat: %s", e)
         return jsonify({"error": "An unexpected error occurred"}), 500
 
 
 @chat_controller.route('/<chat_id>/join', methods=['POST'])
+@require_auth
+@rate_limit("user", "chat")
 def join_chat(chat_id):
     """Join an existing chat"""
     try:
@@ -103,6 +125,7 @@ def join_chat(chat_id):
         return jsonify({"error": str(e)}), 500
 
 @chat_controller.route('/<chat_id>/leave', methods=['POST'])
+@require_auth
 def leave_chat(chat_id):
     """Leave a chat"""
     try:
@@ -124,8 +147,9 @@ def leave_chat(chat_id):
         return jsonify({"error": str(e)}), 500
 
 @chat_controller.route('/<chat_id>', methods=['GET'])
+@require_auth
 def get_chat(chat_id):
-    """Get chat details"""
+    """Get chat details with its newest CHAT_MESSAGES_LIMIT messages (/export streams them all)"""
     try:
         chat = chat_repo.get_chat_by_id(chat_id)
         
@@ -150,6 +174,7 @@ def get_chat(chat_id):
         return jsonify({"error": str(e)}), 500
 
 @chat_controller.route('/<chat_id>', methods=['DELETE'])
+@require_auth
 def delete_chat(chat_id):
     """Delete a chat"""
     try:
@@ -171,19 +196,27 @@ def delete_chat(chat_id):
         return jsonify({"error": str(e)}), 500
 
 @chat_controller.route('/<chat_id>/messages', methods=['GET'])
+@require_auth
 def get_messages(chat_id):
-    """Get recent messages from a chat"""
+    """Get recent messages from a chat, or with ?after=<message_id> the ones that follow it"""
     try:
         # Get limit from query params, default to 10
         limit = request.args.get('limit', default=10, type=int)
-        
-        # Get chat
-        chat = chat_repo.get_chat_by_id(chat_id)
-        if not chat:
-            return jsonify({"error": "Chat not found"}), 404
-        
-        # Get messages ordered by timestamp
-        messages = chat.messages[-limit:] if limit > 0 else chat.messages
+        after = request.args.get('after', type=int)
+
+        if after is not None:
+            # Only the delta after a cursor (e.g. the user's last read message), oldest first
+            if not chat_repo.get_chat_by_id(chat_id, include_messages=False):
+                return jsonify({"error": "Chat not found"}), 404
+            messages = chat_repo.get_messages_after(chat_id, after, min(max(limit, 1), 500))
+        else:
+            # Only the newest messages are loaded; older archive blocks stay compressed
+            chat = chat_repo.get_chat_by_id(chat_id, message_limit=min(limit, CHAT_MESSAGES_LIMIT) if limit > 0 else CHAT_MESSAGES_LIMIT)
+            if not chat:
+                return jsonify({"error": "Chat not found"}), 404
+
+            # Messages ordered by timestamp
+            messages = chat.messages
         
         return jsonify({
             "chat_id": chat_id,
@@ -201,7 +234,234 @@ def get_messages(chat_id):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@chat_controller.route('/<chat_id>/read', methods=['POST'])
+@require_auth
+def mark_read(chat_id):
+    """Move the caller's read cursor up to a message"""
+    try:
+        data = request.get_json(silent=True)
+
+        if not data or 'message_id' not in data:
+            return jsonify({
+                "error": "Missing required field: message_id"
+            }), 400
+
+        message_id = data['message_id']
+        if not isinstance(message_id, int) or isinstance(message_id, bool):
+            return jsonify({"error": "message_id must be an integer"}), 400
+
+        unread_count, message = chat_service.mark_read(current_identity().user_id, chat_id, message_id)
+
+        if unread_count is None:
+            return jsonify({"error": message}), 404
+
+        return jsonify({
+            "message": message,
+            "chat_id": chat_id,
+            "unread_count": unread_count
+        }), 200
+
+    except NotParticipant:
+        raise
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@chat_controller.route('/<chat_id>/stats', methods=['GET'])
+@require_auth
+def get_chat_stats(chat_id):
+    """Message counts per participant, activity histograms and first/last activity"""
+    try:
+        stats, message = chat_service.get_chat_stats(chat_id, current_identity().user_id)
+        if not stats:
+            return jsonify({"error": message}), 404
+
+        return jsonify({
+            "chat_id": chat_id,
+            "message_count": stats.message_count,
+            "average_length": stats.average_length,
+            "first_message_at": stats.first_message_at.isoformat() if stats.first_message_at else None,
+            "last_message_at": stats.last_message_at.isoformat() if stats.last_message_at else None,
+            "participants": [
+                {
+                    "sender_id": p.sender_id,
+                    "sender_name": p.sender_name,
+                    "message_count": p.message_count,
+                    "average_length": p.average_length,
+                    "first_message_at": p.first_message_at.isoformat() if p.first_message_at else None,
+                    "last_message_at": p.last_message_at.isoformat() if p.last_message_at else None
+                } for p in stats.participants
+            ],
+            "hourly": stats.hourly,
+            "daily": [{"date": day, "message_count": count} for day, count in stats.daily.items()]
+        }), 200
+
+    except NotParticipant:
+        raise
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@chat_controller.route('/<chat_id>/export', methods=['GET'])
+@require_auth
+@rate_limit("user")
+def export_chat(chat_id):
+    """Stream the full chat history as NDJSON, optionally gzip-compressed
+
+    ``?compress=gzip`` downloads a .gz file; otherwise the stream is gzip-encoded in
+    transit when the client's Accept-Encoding allows it.
+    """
+    try:
+        batch_size = min(max(request.args.get('batch_size', default=500, type=int), 1), 5000)
+        compress = request.args.get('compress', default='').lower() == 'gzip'
+        encode = not compress and request.accept_encodings['gzip'] > 0
+
+        chat = chat_repo.get_chat_by_id(chat_id, include_messages=False)
+        if not chat:
+            return jsonify({"error": "Chat not found"}), 404
+        if current_identity().user_id not in chat.participants:
+            return jsonify({"error": "User is not in the chat"}), 403
+
+        header = {
+            "type": "chat",
+            "id": chat.id,
+            "admin_id": chat.admin_id,
+            "chat_name": chat.chat_name,
+            "agenda": chat.agenda,
+            "created_at": chat.created_at.isoformat() if chat.created_at else None,
+            "participants": chat.participants
+        }
+        messages = (
+            {
+                "type": "message",
+                "id": msg.id,
+                "sender_id": msg.sender_id,
+                "sender_name": msg.sender_name,
+                "content": msg.content,
+                "timestamp": msg.timestamp.isoformat() if msg.timestamp else None
+            } for msg in chat_repo.iter_messages(chat_id, batch_size)
+        )
+        # The header goes out as its own chunk so bytes flow before the first batch is read
+        body = chain(ndjson_batches([header], 1), ndjson_batches(messages, batch_size))
+
+        filename = f"chat-{chat_id}.ndjson"
+        mimetype = "application/x-ndjson"
+        headers = {"Vary": "Accept-Encoding"}
+        if compress:
+            body = gzip_stream(body)
+            filename += ".gz"
+            mimetype = "application/gzip"
+        elif encode:
+            body = gzip_stream(body)
+            headers["Content-Encoding"] = "gzip"
+        headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+
+        return Response(stream_with_context(body), mimetype=mimetype, headers=headers)
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def _search_response(query, chat_id=None):
+    limit = min(max(request.args.get('limit', default=20, type=int), 1), 100)
+    offset = max(request.args.get('offset', default=0, type=int), 0)
+
+    results, message = chat_service.search_messages(
+        current_identity().user_id, query, chat_id=chat_id, limit=limit, offset=offset
+    )
+    if results is None:
+        return jsonify({"error": message}), 400
+
+    return jsonify({
+        "query": query,
+        "results": [
+            {
+                "chat_id": result["chat_id"],
+                "id": result["message"].id,
+                "sender_id": result["message"].sender_id,
+                "sender_name": result["message"].sender_name,
+                "content": result["message"].content,
+                "timestamp": result["message"].timestamp.isoformat(),
+                "matched_terms": result["matched_terms"],
+                "score": result["score"]
+            } for result in results
+        ],
+        "limit": limit,
+        "offset": offset,
+        "next_offset": offset + limit if len(results) == limit else None
+    }), 200
+
+@chat_controller.route('/<chat_id>/search', methods=['GET'])
+@require_auth
+@rate_limit("user")
+def search_chat(chat_id):
+    """Search messages in one chat"""
+    try:
+        query = request.args.get('q', default='')
+        if not query.strip():
+            return jsonify({"error": "Missing required query parameter: q"}), 400
+
+        return _search_response(query, chat_id=chat_id)
+
+    except NotParticipant:
+        raise
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@chat_controller.route('/user/<user_id>/search', methods=['GET'])
+@require_auth
+@rate_limit("user")
+def search_user_chats(user_id):
+    """Search messages across all of a user's chats"""
+    try:
+        query = request.args.get('q', default='')
+        if not query.strip():
+            return jsonify({"error": "Missing required query parameter: q"}), 400
+
+        if user_id != current_identity().user_id:
+            return jsonify({"error": "Cannot search another user's chats"}), 403
+
+        return _search_response(query)
+
+    except NotParticipant:
+        raise
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@chat_controller.route('/user/<user_id>/feed', methods=['GET'])
+@require_auth
+def get_user_feed(user_id):
+    """Newest messages across all of a user's chats, paginated with ?before=<message_id>"""
+    try:
+        if user_id != current_identity().user_id:
+            return jsonify({"error": "Cannot read another user's feed"}), 403
+
+        limit = min(max(request.args.get('limit', default=20, type=int), 1), 100)
+        before = request.args.get('before', type=int)
+
+        entries, message = chat_service.get_user_feed(user_id, limit, before)
+        if entries is None:
+            return jsonify({"error": message}), 400
+
+        return jsonify({
+            "messages": [
+                {
+                    "chat_id": entry["chat_id"],
+                    "chat_name": entry["chat_name"],
+                    "id": entry["message"].id,
+                    "sender_id": entry["message"].sender_id,
+                    "sender_name": entry["message"].sender_name,
+                    "content": entry["message"].content,
+                    "timestamp": entry["message"].timestamp.isoformat()
+                } for entry in entries
+            ],
+            "limit": limit,
+            "next_before": entries[-1]["message"].id if len(entries) == limit else None
+        }), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @chat_controller.route('/<chat_id>/messages', methods=['POST'])
+@require_auth
+@rate_limit("user", "chat")
 def send_message(chat_id):
     """Send a message in a chat"""
     try:
@@ -212,7 +472,7 @@ def send_message(chat_id):
             }), 400
 
         # Send message
-        success, message = chat_service.send_message(
+        success, message, message_count = chat_service.send_message(
             data['user_id'], 
             chat_id, 
             data['content']
@@ -221,11 +481,18 @@ def send_message(chat_id):
         if not success:
             return jsonify({"error": message}), 400
 
-        # Get current message count
-        chat = chat_repo.get_chat_by_id(chat_id)
-        if chat and len(chat.messages) % 10 == 0:  # Check every 10 messages
-            # Trigger context validation
-            validation_result, _ = summary_service.validate_chat_context(chat_id)
+        if message_count % 10 == 0:  # Check every 10 messages
+            # Trigger context validation; nobody waits on it, so it yields to interactive calls.
+            # The message is stored, so the wait on the LLM doesn't hold a concurrency slot
+            release_request_slot()
+            try:
+                validation_result, _ = summary_service.validate_chat_context(chat_id, priority=BACKGROUND)
+            except LLMOverloaded:
+                logger.info("Skipped context validation for chat %s: LLM capacity exhausted", chat_id)
+                validation_result = None
+            except ServerBusy:
+                logger.info("Skipped context validation for chat %s: server busy", chat_id)
+                validation_result = None
             
             return jsonify({
                 "message": message,
@@ -249,14 +516,16 @@ def send_message(chat_id):
         }), 201
 
     except Exception as e:
-        logger.error(f"Error sending message: {str(e)}")
+        logger.exception("Error sending message: %s", e)
         return jsonify({"error": str(e)}), 500 
 
 @chat_controller.route('/<chat_id>/summary', methods=['GET'])
-def get_chat_summary(chat_id):
+@require_auth
+@rate_limit("user", "chat")
+async def get_chat_summary(chat_id):
     """Get a summary of the chat"""
     try:
-        summary, message = summary_service.get_chat_summary(chat_id)
+        summary, message = await summary_service.aget_chat_summary(chat_id)
         
         if not summary:
             return jsonify({"error": message}), 404
@@ -266,14 +535,18 @@ def get_chat_summary(chat_id):
             "summary": summary
         }), 200
 
+    except (LLMOverloaded, ServerBusy):
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @chat_controller.route('/<chat_id>/validate', methods=['GET'])
-def validate_chat_context(chat_id):
+@require_auth
+@rate_limit("user", "chat")
+async def validate_chat_context(chat_id):
     """Validate if chat messages align with the agenda"""
     try:
-        validation_result, message = summary_service.validate_chat_context(chat_id)
+        validation_result, message = await summary_service.avalidate_chat_context(chat_id)
         
         if not validation_result:
             return jsonify({
@@ -291,14 +564,17 @@ def validate_chat_context(chat_id):
             "message": message
         }), 200
 
+    except (LLMOverloaded, ServerBusy):
+        raise
     except Exception as e:
-        logger.error(f"Error in validate_chat_context: {str(e)}")
+        logger.exception("Error in validate_chat_context: %s", e)
         return jsonify({
             "error": "Internal server error",
             "details": str(e)
         }), 500
 
 @chat_controller.route('/user/<user_id>/chats', methods=['GET'])
+@require_auth
 def get_user_chats(user_id):
     """Get all chats for a user"""
     try:
@@ -312,11 +588,13 @@ def get_user_chats(user_id):
                 "agenda": chat.agenda,
                 "created_at": chat.created_at.isoformat(),
                 "participant_count": len(chat.participants),
-                "last_message": chat.messages[-1].content if chat.messages else None
+                "last_message": chat.last_message.content if chat.last_message else None,
+                "last_message_id": chat.last_message.id if chat.last_message else None,
+                "last_read_message_id": chat.last_read_message_id,
+                "unread_count": chat.unread_count
             } for chat in chats]
         }), 200
 
     except Exception as e:
-        print("Stack trace: %s", traceback.format_exc())
-        logger.error(f"Error getting user chats: {str(e)}")
+        logger.exception("Error getting user chats: %s", e)
         return jsonify({"error": str(e)}), 500
\ No newline at end of file
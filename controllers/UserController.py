@@ -1,9 +1,14 @@
 from flask import Blueprint, request, jsonify
-from services.AuthService import AuthService
-from repositories.UserRepository import UserRepository
+from werkzeug.local import LocalProxy
+from services.AppServices import current_services
+from utils.auth import HashPoolBusy
 
 user_controller = Blueprint('user_controller', __name__)
-auth_service = AuthService(UserRepository())
+auth_service = LocalProxy(lambda: current_services().auth_service)
+
+@user_controller.errorhandler(HashPoolBusy)
+def password_hashing_busy(error):
+    return jsonify({"error": "Server is busy, please retry shortly"}), 503, {"Retry-After": "1"}
 
 @user_controller.route('/register', methods=['POST'])
 def register():
@@ -13,4 +13,9 @@ class Chat:
     created_at: datetime
     participants: List[str] = field(default_factory=list)
     messages: List[Message] = field(default_factory=list)
-    created_at : Optional[datetime] = None
\ No newline at end of file
+    created_at : Optional[datetime] = None
+    message_count: int = 0
+    last_message: Optional[Message] = None
+    # Per-user fields, set when listing a user's chats
+    unread_count: Optional[int] = None
+    last_read_message_id: Optional[int] = None
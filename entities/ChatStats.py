@@ -0,0 +1,25 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional
+
+@dataclass
+class ParticipantStats:
+    sender_id: str
+    sender_name: Optional[str]
+    message_count: int
+    average_length: float
+    first_message_at: Optional[datetime] = None
+    last_message_at: Optional[datetime] = None
+
+@dataclass
+class ChatStats:
+    chat_id: str
+    message_count: int = 0
+    average_length: float = 0.0
+    first_message_at: Optional[datetime] = None
+    last_message_at: Optional[datetime] = None
+    participants: List[ParticipantStats] = field(default_factory=list)
+    # Messages per hour of day (UTC), index 0-23
+    hourly: List[int] = field(default_factory=lambda: [0] * 24)
+    # Messages per day, "YYYY-MM-DD" -> count, oldest first
+    daily: Dict[str, int] = field(default_factory=dict)
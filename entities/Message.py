@@ -8,4 +8,5 @@ class Message:
     content: str
     id: Optional[str] = None
     timestamp: Optional[datetime] = None
-    sender_name: Optional[str] = None
\ No newline at end of file
+    sender_name: Optional[str] = None
+    token_count: Optional[int] = None
@@ -0,0 +1,19 @@
+"""Gunicorn settings picked up automatically from the working directory."""
+import os
+
+# uvicorn's worker serves asgi:app (utils/asgi.py): /summary and /validate wait on the LLM
+# on the worker's event loop without holding a thread, so one worker keeps as many LLM calls
+# in flight as the scheduler admits (LLM_MAX_CONCURRENCY); other views run on
+# GUNICORN_THREADS threads. GUNICORN_WORKER_CLASS=gthread serves wsgi:app instead, where
+# every request, LLM calls included, holds one of the GUNICORN_THREADS threads.
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "uvicorn_worker.UvicornWorker")
+threads = int(os.getenv("GUNICORN_THREADS", "32"))
+wsgi_app = "asgi:app" if "uvicorn" in worker_class.lower() else "wsgi:app"
+
+
+def post_fork(server, worker):
+    # With --preload the master may already have opened database connections;
+    # each worker must start with its own pool
+    from storage.database import pool
+
+    pool.dispose()
@@ -1,20 +1,136 @@
 from functools import wraps
-from flask import request, jsonify
+from collections import OrderedDict
+from typing import Callable, Optional
+import hashlib
+import inspect
+import os
+import threading
+import time
+from flask import request, jsonify, g
+from entities.User import User
+from services.AppServices import current_services
 from utils.auth import verify_token
 
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', '10000'))
+
+
+class TokenCache:
+    """Bounded LRU of verified JWT payloads keyed by the SHA-256 digest of the token.
+
+    Entries are dropped once the token's ``exp`` claim has passed, so a cached
+    payload is never served for a token that ``verify_token`` would reject as expired.
+    """
+
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[dict]:
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            payload, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return payload
+
+    def put(self, token: str, payload: dict) -> None:
+        # Tokens without an expiry are not cached; they always take the full decode.
+        expires_at = payload.get('exp')
+        if expires_at is None or self.maxsize <= 0:
+            return
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (payload, float(expires_at))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class Identity:
+    """The authenticated caller of the current request.
+
+    The user row is only fetched when a handler reads ``user``, and at most once per request.
+    """
+
+    _UNSET = object()
+
+    def __init__(self, user_id: str, claims: dict, user_loader: Callable[[str], Optional[User]]):
+        self.user_id = user_id
+        self.claims = claims
+        self._user_loader = user_loader
+        self._user = self._UNSET
+
+    @property
+    def user(self) -> Optional[User]:
+        if self._user is self._UNSET:
+            self._user = self._user_loader(self.user_id)
+        return self._user
+
+
+token_cache = TokenCache()
+
+
+def _verify_cached(token: str) -> dict:
+    payload = token_cache.get(token)
+    if payload is None:
+        payload = verify_token(token)
+        token_cache.put(token, payload)
+    return payload
+
+
+def current_identity() -> Optional[Identity]:
+    """Return the Identity set by require_auth for this request, if any."""
+    return g.get('identity')
+
+
+def _authenticate():
+    """Verify the bearer token; returns an error response, or None once g.identity is set"""
+    token = request.headers.get('Authorization', '').replace('Bearer ', '')
+
+    if not token:
+        return jsonify({"error": "No token provided"}), 401
+
+    try:
+        payload = _verify_cached(token)
+        request.user_id = payload['user_id']
+    except Exception:
+        return jsonify({"error": "Invalid token"}), 401
+
+    g.identity = Identity(payload['user_id'], payload, current_services().user_repository.get_user_by_id)
+    return None
+
+
 def require_auth(f):
+    if inspect.iscoroutinefunction(f):
+        @wraps(f)
+        async def async_decorated(*args, **kwargs):
+            error = _authenticate()
+            if error is not None:
+                return error
+            return await f(*args, **kwargs)
+        return async_decorated
+
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = request.headers.get('Authorization', '').replace('Bearer ', '')
-        
-        if not token:
-            return jsonify({"error": "No token provided"}), 401
-
-        try:
-            payload = verify_token(token)
-            request.user_id = payload['user_id']
-        except Exception:
-            return jsonify({"error": "Invalid token"}), 401
-
+        error = _authenticate()
+        if error is not None:
+            return error
         return f(*args, **kwargs)
-    return decorated
\ No newline at end of file
+    return decorated
@@ -1,71 +1,455 @@
-from typing import Optional, List
+from functools import lru_cache
+from typing import Dict, Iterable, Optional, List, Iterator, Tuple
 from datetime import datetime
+from itertools import islice
 from entities.Chat import Chat
+from entities.ChatStats import ChatStats, ParticipantStats
 from entities.Message import Message
-from sqlalchemy import text
+from sqlalchemy import Integer, and_, bindparam, cast, delete, func, insert, literal_column, or_, select, union_all, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from storage.archive import ARCHIVE_BLOCK_SIZE, decode_block, encode_block
 from storage.database import pool
+from storage.schema import chat_participants, chats, message_archive_blocks, message_terms, messages, users
+from utils.text import term_frequencies
+from utils.tokens import exact_token_count
+import heapq
+import json
 import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched per round trip when streaming large result sets
+STREAM_BATCH_SIZE = 500
+# Most messages get_chat_by_id loads; the full history is streamed by iter_messages
+CHAT_MESSAGES_LIMIT = int(os.getenv("CHAT_MESSAGES_LIMIT", "1000"))
+# Per-chat branches in one feed query (SQLite caps compound SELECTs at 500 terms)
+FEED_CHATS_PER_QUERY = 200
+# Rows each chat contributes to the first feed query; a chat the merge drains is refilled
+# with twice as many rows, up to the page size
+FEED_CHUNK_SIZE = 8
+
+# Statements are built once, here; SQLAlchemy compiles each one once per dialect and
+# serves it from its compiled cache afterwards. In UPDATEs, WHERE parameters are prefixed
+# with b_ where they would clash with a column of the updated table.
+
+# Message columns in Message field order, so a row maps onto Message positionally
+_MESSAGE_COLUMNS = (messages.c.sender_id, messages.c.content, messages.c.id, messages.c.timestamp,
+                    users.c.name.label("sender_name"), messages.c.token_count)
+_MESSAGE_WIDTH = len(_MESSAGE_COLUMNS)
+_MESSAGES_WITH_SENDER = messages.join(users, messages.c.sender_id == users.c.id)
+_LIVE_CHAT = and_(chats.c.id == chat_participants.c.chat_id, chats.c.deleted_at.is_(None))
+
+_SELECT_CHAT = select(
+    chats.c.id, chats.c.admin_id, chats.c.chat_name, chats.c.agenda, chats.c.created_at,
+    chats.c.message_count, chats.c.archived_seq
+).where(chats.c.id == bindparam("chat_id"))
+_SELECT_LIVE_CHAT = _SELECT_CHAT.where(chats.c.deleted_at.is_(None))
+_SELECT_LIVE_CHAT_ID = select(chats.c.id).where(chats.c.id == bindparam("chat_id"), chats.c.deleted_at.is_(None))
+_SELECT_PARTICIPANT_IDS = select(chat_participants.c.user_id).where(
+    chat_participants.c.chat_id == bindparam("chat_id"))
+_SELECT_CHAT_MESSAGES = select(*_MESSAGE_COLUMNS).select_from(_MESSAGES_WITH_SENDER).where(
+    messages.c.chat_id == bindparam("chat_id")
+).order_by(messages.c.timestamp, messages.c.id)
+_SELECT_RECENT_MESSAGES = select(*_MESSAGE_COLUMNS).select_from(_MESSAGES_WITH_SENDER).where(
+    messages.c.chat_id == bindparam("chat_id")
+).order_by(messages.c.timestamp.desc(), messages.c.id.desc()).limit(bindparam("limit"))
+
+_SELECT_ARCHIVE_BLOCK_IDS = select(message_archive_blocks.c.id).where(
+    message_archive_blocks.c.chat_id == bindparam("chat_id"),
+    message_archive_blocks.c.last_seq > bindparam("after_seq")
+).order_by(message_archive_blocks.c.last_seq)
+_SELECT_RECENT_ARCHIVE_BLOCKS = select(message_archive_blocks.c.id, message_archive_blocks.c.message_count).where(
+    message_archive_blocks.c.chat_id == bindparam("chat_id")
+).order_by(message_archive_blocks.c.last_seq.desc())
+_SELECT_ARCHIVE_PAYLOAD = select(message_archive_blocks.c.payload).where(
+    message_archive_blocks.c.id == bindparam("id"))
+_SELECT_BLOCK_FOR_MESSAGE = select(
+    message_archive_blocks.c.first_message_id, message_archive_blocks.c.payload, message_archive_blocks.c.id
+).where(
+    message_archive_blocks.c.chat_id == bindparam("chat_id"),
+    message_archive_blocks.c.last_message_id >= bindparam("message_id")
+).order_by(message_archive_blocks.c.last_message_id).limit(1)
+_SELECT_SENDER_NAMES = select(users.c.id, users.c.name).where(users.c.id.in_(bindparam("ids", expanding=True)))
+_SELECT_MESSAGE_SEQ = select(messages.c.seq).where(
+    messages.c.id == bindparam("message_id"), messages.c.chat_id == bindparam("chat_id"))
+
+# The cursor row itself comes back first when it is still hot
+_since = messages.alias("since")
+_SELECT_FROM_CURSOR = select(*_MESSAGE_COLUMNS).select_from(_MESSAGES_WITH_SENDER).where(
+    messages.c.chat_id == bindparam("chat_id"),
+    messages.c.seq >= select(_since.c.seq).where(
+        _since.c.id == bindparam("message_id"), _since.c.chat_id == bindparam("chat_id")
+    ).scalar_subquery()
+).order_by(messages.c.seq).limit(bindparam("limit"))
+_SELECT_AFTER_SEQ = select(*_MESSAGE_COLUMNS).select_from(_MESSAGES_WITH_SENDER).where(
+    messages.c.chat_id == bindparam("chat_id"), messages.c.seq > bindparam("seq")
+).order_by(messages.c.seq).limit(bindparam("limit"))
+
+# Upsert syntax differs between MySQL and SQLite; keyed by dialect name
+_mysql_upsert_chat = mysql_insert(chats)
+_sqlite_upsert_chat = sqlite_insert(chats)
+_UPSERT_CHAT = {
+    "mysql": _mysql_upsert_chat.on_duplicate_key_update(
+        admin_id=_mysql_upsert_chat.inserted.admin_id,
+        chat_name=_mysql_upsert_chat.inserted.chat_name,
+        agenda=_mysql_upsert_chat.inserted.agenda
+    ),
+    "sqlite": _sqlite_upsert_chat.on_conflict_do_update(
+        index_elements=[chats.c.id],
+        set_={
+            "admin_id": _sqlite_upsert_chat.excluded.admin_id,
+            "chat_name": _sqlite_upsert_chat.excluded.chat_name,
+            "agenda": _sqlite_upsert_chat.excluded.agenda
+        }
+    )
+}
+_mysql_upsert_participant = mysql_insert(chat_participants)
+_UPSERT_PARTICIPANT = {
+    "mysql": _mysql_upsert_participant.on_duplicate_key_update(
+        user_id=_mysql_upsert_participant.inserted.user_id),
+    "sqlite": sqlite_insert(chat_participants).on_conflict_do_nothing(
+        index_elements=[chat_participants.c.chat_id, chat_participants.c.user_id])
+}
+_DELETE_PARTICIPANTS = delete(chat_participants).where(chat_participants.c.chat_id == bindparam("chat_id"))
+_INSERT_PARTICIPANT = insert(chat_participants)
+
+# Bump a chat's message counter and hand back the new value in the same statement
+_bump_live_chat = update(chats).where(chats.c.id == bindparam("chat_id"), chats.c.deleted_at.is_(None))
+_BUMP_MESSAGE_COUNT = {
+    "mysql": _bump_live_chat.values(message_count=func.last_insert_id(chats.c.message_count + 1)),
+    "sqlite": _bump_live_chat.values(message_count=chats.c.message_count + 1).returning(chats.c.message_count)
+}
+_INSERT_MESSAGE = insert(messages)
+_INSERT_POSTINGS = insert(message_terms)
+_DELETE_CHAT_POSTINGS = delete(message_terms).where(message_terms.c.chat_id == bindparam("chat_id"))
+
+_SOFT_DELETE_CHAT = update(chats).where(
+    chats.c.id == bindparam("chat_id"), chats.c.deleted_at.is_(None)
+).values(deleted_at=func.current_timestamp())
+_SELECT_DELETED_CHAT_IDS = select(chats.c.id).where(
+    chats.c.deleted_at.is_not(None)).order_by(chats.c.deleted_at).limit(bindparam("limit"))
+_SELECT_DELETED_CHAT = select(chats.c.id).where(chats.c.id == bindparam("chat_id"), chats.c.deleted_at.is_not(None))
+_SELECT_MESSAGE_IDS = select(messages.c.id).where(messages.c.chat_id == bindparam("chat_id")).limit(bindparam("limit"))
+_DELETE_POSTINGS = delete(message_terms).where(message_terms.c.message_id.in_(bindparam("ids", expanding=True)))
+_DELETE_MESSAGES = delete(messages).where(messages.c.id.in_(bindparam("ids", expanding=True)))
+_DECREMENT_MESSAGE_COUNT = update(chats).where(chats.c.id == bindparam("chat_id")).values(
+    message_count=chats.c.message_count - bindparam("deleted"))
+_SELECT_ARCHIVE_BLOCKS = select(
+    message_archive_blocks.c.id, message_archive_blocks.c.message_count,
+    message_archive_blocks.c.first_message_id, message_archive_blocks.c.last_message_id
+).where(message_archive_blocks.c.chat_id == bindparam("chat_id")).limit(bindparam("limit"))
+# Postings of archived messages, by the id range of their block
+_DELETE_BLOCK_POSTINGS = delete(message_terms).where(
+    message_terms.c.chat_id == bindparam("chat_id"),
+    message_terms.c.message_id.between(bindparam("first_message_id"), bindparam("last_message_id"))
+)
+_DELETE_ARCHIVE_BLOCKS = delete(message_archive_blocks).where(
+    message_archive_blocks.c.id.in_(bindparam("ids", expanding=True)))
+_SELECT_PARTICIPANT_BATCH = _SELECT_PARTICIPANT_IDS.limit(bindparam("limit"))
+_DELETE_PARTICIPANT_BATCH = delete(chat_participants).where(
+    chat_participants.c.chat_id == bindparam("chat_id"),
+    chat_participants.c.user_id.in_(bindparam("user_ids", expanding=True))
+)
+_DELETE_DELETED_CHAT = delete(chats).where(chats.c.id == bindparam("chat_id"), chats.c.deleted_at.is_not(None))
+
+_SELECT_ARCHIVE_CANDIDATES = select(chats.c.id).where(
+    chats.c.deleted_at.is_(None), chats.c.message_count - chats.c.archived_seq >= bindparam("block_size"))
+_SELECT_ARCHIVED_SEQ = select(chats.c.archived_seq).where(
+    chats.c.id == bindparam("chat_id"), chats.c.deleted_at.is_(None))
+# Rows for storage.archive.encode_block, which reads its FIELDS by name
+_SELECT_ARCHIVE_BATCH = select(
+    messages.c.id, messages.c.sender_id, messages.c.content, messages.c.timestamp, messages.c.token_count,
+    messages.c.seq
+).where(
+    messages.c.chat_id == bindparam("chat_id"), messages.c.seq > bindparam("after_seq")
+).order_by(messages.c.seq).limit(bindparam("block_size"))
+_CLAIM_ARCHIVE_RANGE = update(chats).where(
+    chats.c.id == bindparam("chat_id"), chats.c.archived_seq == bindparam("b_archived_seq")
+).values(archived_seq=bindparam("last_seq"))
+_INSERT_ARCHIVE_BLOCK = insert(message_archive_blocks)
+
+# Each chat of a user with its participant row and last message (found through the
+# (chat_id, timestamp, id) index), in one query however many chats there are
+_last = messages.alias("lm")
+_latest_msg = messages.alias("m")
+_last_message_id = select(_latest_msg.c.id).where(_latest_msg.c.chat_id == chats.c.id).order_by(
+    _latest_msg.c.timestamp.desc(), _latest_msg.c.id.desc()
+).limit(1).scalar_subquery()
+_SELECT_USER_CHATS = select(
+    chats.c.id, chats.c.admin_id, chats.c.chat_name, chats.c.agenda, chats.c.created_at, chats.c.message_count,
+    (chats.c.message_count - chat_participants.c.last_read_seq).label("unread_count"),
+    chat_participants.c.last_read_message_id,
+    _last.c.id, _last.c.sender_id, _last.c.content, _last.c.timestamp
+).select_from(
+    chat_participants.join(chats, _LIVE_CHAT).outerjoin(_last, _last.c.id == _last_message_id)
+).where(chat_participants.c.user_id == bindparam("user_id")).order_by(chats.c.created_at.desc())
+_others = chat_participants.alias("p")
+_SELECT_USER_CHAT_PARTICIPANTS = select(_others.c.chat_id, _others.c.user_id).select_from(
+    chat_participants.join(_others, _others.c.chat_id == chat_participants.c.chat_id)
+).where(chat_participants.c.user_id == bindparam("user_id"))
+_SELECT_FEED_CHATS = select(chat_participants.c.chat_id, chats.c.chat_name, chats.c.archived_seq).select_from(
+    chat_participants.join(chats, _LIVE_CHAT)
+).where(chat_participants.c.user_id == bindparam("user_id"))
+
+# Per-message aggregates for chat stats; character length and hour of day are spelled differently
+_CONTENT_LENGTH = {"mysql": func.char_length(messages.c.content), "sqlite": func.length(messages.c.content)}
+_HOUR_OF_DAY = {
+    "mysql": func.hour(messages.c.timestamp),
+    "sqlite": cast(func.strftime(literal_column("'%H'"), messages.c.timestamp), Integer)
+}
+
+
+def _sender_stats(dialect: str):
+    message_count = func.count().label("message_count")
+    return select(
+        messages.c.sender_id, users.c.name, message_count, func.avg(_CONTENT_LENGTH[dialect]),
+        func.min(messages.c.timestamp), func.max(messages.c.timestamp)
+    ).select_from(
+        messages.outerjoin(users, users.c.id == messages.c.sender_id)
+    ).where(
+        messages.c.chat_id == bindparam("chat_id")
+    ).group_by(messages.c.sender_id, users.c.name).order_by(message_count.desc(), messages.c.sender_id)
+
+
+def _activity_stats(dialect: str):
+    day = func.date(messages.c.timestamp).label("day")
+    hour = _HOUR_OF_DAY[dialect].label("hour")
+    return select(day, hour, func.count()).where(
+        messages.c.chat_id == bindparam("chat_id")
+    ).group_by(day, hour).order_by(day, hour)
+
+
+_SELECT_SENDER_STATS = {dialect: _sender_stats(dialect) for dialect in _CONTENT_LENGTH}
+_SELECT_ACTIVITY_STATS = {dialect: _activity_stats(dialect) for dialect in _HOUR_OF_DAY}
+_SELECT_ARCHIVE_STATS = select(message_archive_blocks.c.stats).where(
+    message_archive_blocks.c.chat_id == bindparam("chat_id"))
+
+_ADVANCE_READ_CURSOR = update(chat_participants).where(
+    chat_participants.c.chat_id == bindparam("b_chat_id"),
+    chat_participants.c.user_id == bindparam("b_user_id"),
+    chat_participants.c.last_read_seq < bindparam("seq")
+).values(last_read_seq=bindparam("seq"), last_read_message_id=bindparam("message_id"))
+_SELECT_UNREAD_COUNT = select(chats.c.message_count - chat_participants.c.last_read_seq).select_from(
+    chat_participants.join(chats, chats.c.id == chat_participants.c.chat_id)
+).where(chat_participants.c.chat_id == bindparam("chat_id"), chat_participants.c.user_id == bindparam("user_id"))
+_DELETE_PARTICIPANT = delete(chat_participants).where(
+    chat_participants.c.chat_id == bindparam("chat_id"), chat_participants.c.user_id == bindparam("user_id"))
+_COUNT_LIVE_CHATS = select(func.count()).select_from(chats).where(
+    chats.c.id == bindparam("chat_id"), chats.c.deleted_at.is_(None))
+_SELECT_LIVE_PARTICIPANT = select(chat_participants.c.user_id).select_from(
+    chat_participants.join(chats, _LIVE_CHAT)
+).where(chat_participants.c.chat_id == bindparam("chat_id"), chat_participants.c.user_id == bindparam("user_id"))
+
+
+@lru_cache(maxsize=None)
+def _search_query(by_chat: bool):
+    """Ranked message search, with or without a chat filter"""
+    matched = func.count().label("matched")
+    score = func.sum(message_terms.c.tf).label("score")
+    hits = select(message_terms.c.message_id, message_terms.c.chat_id, matched, score).select_from(
+        message_terms
+        .join(chat_participants, and_(chat_participants.c.chat_id == message_terms.c.chat_id,
+                                      chat_participants.c.user_id == bindparam("user_id")))
+        .join(chats, and_(chats.c.id == message_terms.c.chat_id, chats.c.deleted_at.is_(None)))
+    ).where(message_terms.c.term.in_(bindparam("terms", expanding=True)))
+    if by_chat:
+        hits = hits.where(message_terms.c.chat_id == bindparam("chat_id"))
+    hits = hits.group_by(message_terms.c.message_id, message_terms.c.chat_id).order_by(
+        matched.desc(), score.desc(), message_terms.c.message_id.desc()
+    ).limit(bindparam("limit")).offset(bindparam("offset")).subquery("hits")
+    # Archived messages keep their postings; their columns come back NULL and are read from the block
+    return select(
+        *_MESSAGE_COLUMNS, hits.c.message_id, hits.c.chat_id, hits.c.matched, hits.c.score
+    ).select_from(
+        hits.outerjoin(messages, messages.c.id == hits.c.message_id)
+        .outerjoin(users, users.c.id == messages.c.sender_id)
+    ).order_by(hits.c.matched.desc(), hits.c.score.desc(), hits.c.message_id.desc())
+
+
+# The feed's ``before`` cursor, only found in the caller's own live chats
+_SELECT_FEED_CURSOR = select(messages.c.timestamp, messages.c.id).select_from(
+    messages.join(chat_participants, and_(chat_participants.c.chat_id == messages.c.chat_id,
+                                          chat_participants.c.user_id == bindparam("user_id")))
+    .join(chats, _LIVE_CHAT)
+).where(messages.c.id == bindparam("before"))
+# An archived ``before``: the blocks of the caller's live chats whose id range holds it
+_SELECT_FEED_ARCHIVED_CURSOR = select(message_archive_blocks.c.payload).select_from(
+    chat_participants.join(chats, _LIVE_CHAT).join(
+        message_archive_blocks, message_archive_blocks.c.chat_id == chat_participants.c.chat_id)
+).where(
+    chat_participants.c.user_id == bindparam("user_id"),
+    message_archive_blocks.c.last_message_id >= bindparam("before"),
+    message_archive_blocks.c.first_message_id <= bindparam("before")
+)
+
+
+@lru_cache(maxsize=None)
+def _feed_query(branches: int, keyset: bool):
+    """UNION ALL of ``branches`` per-chat index seeks (``chat_0``...), newest first, below
+    (``before_ts``, ``before_id``) if keyset"""
+    selects = []
+    for index in range(branches):
+        branch = select(*_MESSAGE_COLUMNS, messages.c.chat_id, chats.c.chat_name).select_from(
+            messages.join(chats, chats.c.id == messages.c.chat_id).join(users, users.c.id == messages.c.sender_id)
+        ).where(messages.c.chat_id == bindparam(f"chat_{index}"))
+        if keyset:
+            branch = branch.where(or_(
+                messages.c.timestamp < bindparam("before_ts"),
+                and_(messages.c.timestamp == bindparam("before_ts"), messages.c.id < bindparam("before_id"))
+            ))
+        branch = branch.order_by(messages.c.timestamp.desc(), messages.c.id.desc()).limit(bindparam("limit"))
+        # Each branch keeps its own ORDER BY and LIMIT inside a derived table
+        selects.append(select(branch.subquery(f"feed_{index}")))
+    return selects[0] if branches == 1 else union_all(*selects)
+
 
 class ChatRepository:
-    def get_chat_by_id(self, chat_id: str) -> Optional[Chat]:
-        """Retrieve a chat by its ID"""
-        with pool.connect() as conn:
-            chat_data = conn.execute(
-                text("SELECT * FROM chats WHERE id = :chat_id"),
-                {"chat_id": chat_id}
-            ).fetchone()
+    def __init__(self, engine=pool):
+        # The process-wide lazy engine unless an app was created with its own
+        self.engine = engine
+
+    def get_chat_by_id(self, chat_id: str, include_messages: bool = True,
+                       include_deleted: bool = False, message_limit: int = CHAT_MESSAGES_LIMIT) -> Optional[Chat]:
+        """Retrieve a chat by its ID, optionally without loading its messages.
+
+        Only the newest ``message_limit`` messages are loaded, oldest first. When the hot
+        table holds fewer, the rest come from the newest archive blocks, decompressed only
+        as far back as needed. Deleted chats are not returned unless ``include_deleted`` is set.
+        """
+        params = {"chat_id": chat_id}
+        with self.engine.connect() as conn:
+            chat_data = conn.execute(_SELECT_CHAT if include_deleted else _SELECT_LIVE_CHAT, params).fetchone()
 
             if not chat_data:
                 return None
 
-            participants_data = conn.execute(
-                text("SELECT user_id FROM chat_participants WHERE chat_id = :chat_id"),
-                {"chat_id": chat_id}
-            ).fetchall()
-            participants = [row.user_id for row in participants_data]
-
-            messages_data = conn.execute(
-                text("""
-                    SELECT m.id, m.sender_id, u.name AS sender_name, m.content, m.timestamp
-                    FROM messages m
-                    JOIN users u ON m.sender_id = u.id
-                    WHERE m.chat_id = :chat_id
-                    ORDER BY m.timestamp
-                """),
-                {"chat_id": chat_id}
-            ).fetchall()
+            participants = conn.execute(_SELECT_PARTICIPANT_IDS, params).scalars().all()
 
-            messages = [
-                Message(
-                    id = row.id,
-                    sender_id=row.sender_id,
-                    content=row.content,
-                    timestamp=row.timestamp,
-                    sender_name=row.sender_name
-                ) for row in messages_data
-            ]
+            if not include_messages:
+                return self._row_to_chat(chat_data, participants)
+
+            messages = [self._row_to_message(row) for row in conn.execute(
+                _SELECT_RECENT_MESSAGES, {"chat_id": chat_id, "limit": message_limit})]
+            messages.reverse()
+            if chat_data[6] and len(messages) < message_limit:
+                messages = self._recent_archived_messages(conn, chat_id, message_limit - len(messages)) + messages
+
+            return self._row_to_chat(chat_data, participants, messages)
+
+    @staticmethod
+    def _row_to_chat(row, participants: List[str], messages: Optional[List[Message]] = None) -> Chat:
+        # row: id, admin_id, chat_name, agenda, created_at, message_count, archived_seq
+        return Chat(*row[:5], participants=participants, messages=messages or [], message_count=row[5])
+
+    @staticmethod
+    def _row_to_message(row) -> Message:
+        return Message(*row[:_MESSAGE_WIDTH])
+
+    def _archived_messages(self, conn, chat_id: str, after_seq: int = 0) -> Iterator[Message]:
+        """Messages from a chat's archive blocks with ``seq`` above ``after_seq``, oldest first.
+
+        Blocks are fetched and decompressed one at a time.
+        """
+        block_ids = conn.execute(
+            _SELECT_ARCHIVE_BLOCK_IDS, {"chat_id": chat_id, "after_seq": after_seq}
+        ).scalars().all()
+        names: Dict[str, str] = {}
+        for block_id in block_ids:
+            payload = conn.execute(_SELECT_ARCHIVE_PAYLOAD, {"id": block_id}).scalar()
+            records = [record for record in decode_block(payload) if record["seq"] > after_seq]
+            yield from self._records_to_messages(conn, records, names)
 
-            return Chat(
-                id=chat_data.id,
-                admin_id=chat_data.admin_id,
-                chat_name=chat_data.chat_name,
-                agenda=chat_data.agenda,
-                participants=participants,
-                messages=messages,
-                created_at=chat_data.created_at
+    def _recent_archived_messages(self, conn, chat_id: str, count: int) -> List[Message]:
+        """The newest ``count`` archived messages of a chat, oldest first, reading blocks newest first"""
+        needed, block_ids = count, []
+        for block_id, message_count in conn.execute(_SELECT_RECENT_ARCHIVE_BLOCKS, {"chat_id": chat_id}).fetchall():
+            block_ids.append(block_id)
+            needed -= message_count
+            if needed <= 0:
+                break
+        records = []
+        for block_id in reversed(block_ids):
+            records.extend(decode_block(conn.execute(_SELECT_ARCHIVE_PAYLOAD, {"id": block_id}).scalar()))
+        return list(self._records_to_messages(conn, records[-count:], {}))
+
+    def _records_to_messages(self, conn, records: List[Dict], names: Dict[str, str]) -> Iterator[Message]:
+        """Messages for decoded archive records; ``names`` caches sender names across calls"""
+        unknown = {record["sender_id"] for record in records} - names.keys()
+        if unknown:
+            names.update(self._sender_names(conn, unknown))
+        for record in records:
+            yield Message(
+                id=record["id"],
+                sender_id=record["sender_id"],
+                content=record["content"],
+                timestamp=record["timestamp"],
+                sender_name=names.get(record["sender_id"]),
+                token_count=record["token_count"]
             )
 
+    @staticmethod
+    def _sender_names(conn, sender_ids: Iterable[str]) -> Dict[str, str]:
+        return {user_id: name for user_id, name in conn.execute(_SELECT_SENDER_NAMES, {"ids": list(sender_ids)})}
+
+    @staticmethod
+    def _message_seq(conn, chat_id: str, message_id) -> Optional[int]:
+        """A message's position in its chat, looking in the archive if it is no longer hot"""
+        params = {"message_id": message_id, "chat_id": chat_id}
+        message = conn.execute(_SELECT_MESSAGE_SEQ, params).fetchone()
+        if message:
+            return message[0]
+        block = conn.execute(_SELECT_BLOCK_FOR_MESSAGE, params).fetchone()
+        if block and block[0] <= message_id:
+            for record in decode_block(block[1]):
+                if record["id"] == message_id:
+                    return record["seq"]
+        return None
+
+    def iter_messages(self, chat_id: str, batch_size: int = STREAM_BATCH_SIZE) -> Iterator[Message]:
+        """Stream a chat's messages in timestamp order using a server-side cursor.
+
+        Archived messages come first, one decompressed block at a time; then only
+        ``batch_size`` hot rows are held in memory at a time. The connection stays
+        checked out until the generator is exhausted or closed.
+        """
+        with self.engine.connect() as conn:
+            yield from self._archived_messages(conn, chat_id)
+            result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(
+                _SELECT_CHAT_MESSAGES, {"chat_id": chat_id}
+            )
+            for row in result:
+                yield self._row_to_message(row)
+
+    def get_messages_after(self, chat_id: str, message_id: int, limit: int) -> List[Message]:
+        """Up to ``limit`` messages that follow ``message_id`` in a chat, oldest first.
+
+        A hot cursor costs one query. A cursor that has been archived is found in its
+        block, and the page continues through the archive into the hot table.
+        """
+        with self.engine.connect() as conn:
+            page = [self._row_to_message(row) for row in conn.execute(
+                _SELECT_FROM_CURSOR, {"chat_id": chat_id, "message_id": message_id, "limit": limit + 1}
+            )]
+            if page and page[0].id == message_id:
+                return page[1:]
+
+            seq = self._message_seq(conn, chat_id, message_id)
+            if seq is None:
+                return []
+            messages = list(islice(self._archived_messages(conn, chat_id, seq), limit))
+            if len(messages) < limit:
+                hot = conn.execute(_SELECT_AFTER_SEQ, {"chat_id": chat_id, "seq": seq, "limit": limit - len(messages)})
+                messages.extend(self._row_to_message(row) for row in hot)
+            return messages
+
     def save_chat(self, chat: Chat) -> Chat:
         """Save or update a chat"""
         try:
-            with pool.begin() as conn:  # begin() starts a transaction
+            with self.engine.begin() as conn:  # begin() starts a transaction
                 conn.execute(
-                    text("""INSERT INTO chats (id, admin_id, chat_name, agenda) 
-                            VALUES (:id, :admin_id, :chat_name, :agenda)
-                            ON DUPLICATE KEY UPDATE 
-                                admin_id = :admin_id,
-                                chat_name = :chat_name,
-                                agenda = :agenda"""),
+                    _UPSERT_CHAT[conn.dialect.name],
                     {
                         "id": chat.id,
                         "admin_id": chat.admin_id,
@@ -74,16 +458,12 @@ class ChatRepository:
                     }
                 )
 
-                conn.execute(
-                    text("DELETE FROM chat_participants WHERE chat_id = :chat_id"),
-                    {"chat_id": chat.id}
-                )
+                conn.execute(_DELETE_PARTICIPANTS, {"chat_id": chat.id})
 
-                for participant in chat.participants:
+                if chat.participants:
                     conn.execute(
-                        text("""INSERT INTO chat_participants (chat_id, user_id) 
-                                VALUES (:chat_id, :user_id)"""),
-                        {"chat_id": chat.id, "user_id": participant}
+                        _INSERT_PARTICIPANT,
+                        [{"chat_id": chat.id, "user_id": participant} for participant in chat.participants]
                     )
             return chat
         except Exception:
@@ -94,95 +474,456 @@ class ChatRepository:
     def add_participant(self, chat_id: str, participant_id: str) -> bool:
         """Add a participant to a chat"""
         try:
-            with pool.begin() as conn:
-                chat_data = conn.execute(
-                    text("SELECT 1 FROM chats WHERE id = :chat_id"),
-                    {"chat_id": chat_id}
-                ).fetchone()
+            with self.engine.begin() as conn:
+                chat_data = conn.execute(_SELECT_LIVE_CHAT_ID, {"chat_id": chat_id}).fetchone()
 
                 if not chat_data:
                     return False
 
                 conn.execute(
-                    text("""INSERT INTO chat_participants (chat_id, user_id) 
-                            VALUES (:chat_id, :user_id)
-                            ON DUPLICATE KEY UPDATE user_id = :user_id"""),
+                    _UPSERT_PARTICIPANT[conn.dialect.name],
                     {"chat_id": chat_id, "user_id": participant_id}
                 )
             return True
         except Exception:
             raise
 
-    def add_message(self, chat_id: str, message: Message) -> bool:
-        """Add a message to a chat"""
+    def add_message(self, chat_id: str, message: Message) -> int:
+        """Add a message to a chat and return the chat's new message count (0 if the chat doesn't exist)
+
+        The sender's read cursor moves up to the new message, so their own messages never
+        count as unread for them.
+        """
         try:
-            with pool.begin() as conn:
-                chat_data = conn.execute(
-                    text("SELECT 1 FROM chats WHERE id = :chat_id"),
-                    {"chat_id": chat_id}
-                ).fetchone()
-                if not chat_data:
-                    return False
+            with self.engine.begin() as conn:
+                message_count = self._bump_message_count(conn, chat_id)
+                if not message_count:
+                    return 0
 
+                # NULL rather than an estimate while tiktoken is unavailable; counted again on read
+                message.token_count = exact_token_count(message.content)
+                # The new counter value doubles as the message's position for read cursors
+                result = conn.execute(
+                    _INSERT_MESSAGE,
+                    {"chat_id": chat_id, "sender_id": message.sender_id, "content": message.content,
+                     "token_count": message.token_count, "seq": message_count}
+                )
+                message.id = result.inserted_primary_key[0]
                 conn.execute(
-                    text("""INSERT INTO messages (chat_id, sender_id, content) 
-                            VALUES (:chat_id, :sender_id, :content)"""),
-                    {"chat_id": chat_id, "sender_id": message.sender_id, "content": message.content}
+                    _ADVANCE_READ_CURSOR,
+                    {"seq": message_count, "message_id": message.id,
+                     "b_chat_id": chat_id, "b_user_id": message.sender_id}
                 )
-            return True
+                self._index_message(conn, chat_id, message.id, message.content)
+            return message_count
         except Exception:
             raise
 
+    @staticmethod
+    def _bump_message_count(conn, chat_id: str) -> int:
+        result = conn.execute(_BUMP_MESSAGE_COUNT[conn.dialect.name], {"chat_id": chat_id})
+        if conn.dialect.name == "mysql":
+            # LAST_INSERT_ID(expr) makes the driver report the new counter as lastrowid
+            return result.lastrowid if result.rowcount else 0
+        return result.scalar() or 0
+
+    @staticmethod
+    def _index_message(conn, chat_id: str, message_id, content: str) -> None:
+        """Write the search postings for one message inside the caller's transaction"""
+        postings = [
+            {"term": term, "chat_id": chat_id, "message_id": message_id, "tf": tf}
+            for term, tf in term_frequencies(content).items()
+        ]
+        if postings:
+            conn.execute(_INSERT_POSTINGS, postings)
+
+    def rebuild_search_index(self, chat_id: str, batch_size: int = STREAM_BATCH_SIZE) -> int:
+        """Recreate the search postings for a chat, e.g. for messages written before indexing existed"""
+        with self.engine.begin() as conn:
+            conn.execute(_DELETE_CHAT_POSTINGS, {"chat_id": chat_id})
+        count = 0
+        batch = []
+        for message in self.iter_messages(chat_id, batch_size):
+            batch.append(message)
+            if len(batch) >= batch_size:
+                count += self._index_batch(chat_id, batch)
+                batch = []
+        if batch:
+            count += self._index_batch(chat_id, batch)
+        return count
+
+    def _index_batch(self, chat_id: str, messages: List[Message]) -> int:
+        with self.engine.begin() as conn:
+            for message in messages:
+                self._index_message(conn, chat_id, message.id, message.content)
+        return len(messages)
+
+    def search_messages(self, terms: List[str], user_id: str, chat_id: Optional[str] = None,
+                        limit: int = 20, offset: int = 0) -> List[Tuple[str, Message, int, int]]:
+        """Rank messages containing any of ``terms`` in chats where ``user_id`` participates.
+
+        Results are ordered by the number of distinct query terms matched, then by summed
+        term frequency, newest first on ties. Only the postings for the query terms are read,
+        so cost follows the matches rather than the size of the history. Archived messages
+        keep their postings; a hit on one reads its block (once per block). Returns
+        ``(chat_id, message, matched_terms, score)`` tuples.
+        """
+        params = {"terms": list(terms), "user_id": user_id, "limit": limit, "offset": offset}
+        if chat_id:
+            params["chat_id"] = chat_id
+
+        results = []
+        with self.engine.connect() as conn:
+            rows = conn.execute(_search_query(bool(chat_id)), params).fetchall()
+            blocks: Dict[int, Dict[int, Dict]] = {}
+            names: Dict[str, str] = {}
+            for row in rows:
+                message_id, message_chat_id, matched, score = row[_MESSAGE_WIDTH:]
+                if row[2] is not None:
+                    message = self._row_to_message(row)
+                else:
+                    record = self._archived_record(conn, message_chat_id, message_id, blocks)
+                    if record is None:
+                        continue
+                    message = next(self._records_to_messages(conn, [record], names))
+                results.append((message_chat_id, message, int(matched), int(score)))
+        return results
+
+    @staticmethod
+    def _archived_record(conn, chat_id: str, message_id, blocks: Dict) -> Optional[Dict]:
+        """A message's record from its archive block; ``blocks`` caches decoded blocks by id"""
+        block = conn.execute(_SELECT_BLOCK_FOR_MESSAGE, {"chat_id": chat_id, "message_id": message_id}).fetchone()
+        if not block or block[0] > message_id:
+            return None
+        if block[2] not in blocks:
+            blocks[block[2]] = {record["id"]: record for record in decode_block(block[1])}
+        return blocks[block[2]].get(message_id)
+
     def delete_chat(self, chat_id: str) -> bool:
-        """Delete a chat"""
+        """Soft-delete a chat: it disappears from reads at once, its rows are purged later"""
         try:
-            with pool.begin() as conn:
-                conn.execute(
-                    text("DELETE FROM chats WHERE id = :chat_id"),
-                    {"chat_id": chat_id}
-                )
-                # Check if chat still exists
-                count = conn.execute(
-                    text("SELECT COUNT(*) as cnt FROM chats WHERE id = :chat_id"),
-                    {"chat_id": chat_id}
-                ).fetchone().cnt
-                return count > 0
+            with self.engine.begin() as conn:
+                result = conn.execute(_SOFT_DELETE_CHAT, {"chat_id": chat_id})
+                return result.rowcount > 0
         except Exception:
             raise
 
+    def get_deleted_chat_ids(self, limit: int = 100) -> List[str]:
+        """Soft-deleted chats still waiting to be purged, oldest deletion first"""
+        with self.engine.connect() as conn:
+            return conn.execute(_SELECT_DELETED_CHAT_IDS, {"limit": limit}).scalars().all()
+
+    def purge_deleted_chat(self, chat_id: str, batch_size: int = STREAM_BATCH_SIZE) -> Dict[str, int]:
+        """Delete one bounded batch of a soft-deleted chat's rows in a short transaction.
+
+        Messages (with their search postings) go first, then archive blocks (with the
+        postings of the messages in them), then participants, and finally the chat row. The chat's message_count drops as messages go, so it shows what is
+        left. Returns rows deleted per table; empty once the chat is gone or isn't deleted.
+        """
+        with self.engine.begin() as conn:
+            if not conn.execute(_SELECT_DELETED_CHAT, {"chat_id": chat_id}).fetchone():
+                return {}
+
+            message_ids = conn.execute(_SELECT_MESSAGE_IDS, {"chat_id": chat_id, "limit": batch_size}).scalars().all()
+            if message_ids:
+                ids = {"ids": message_ids}
+                terms = conn.execute(_DELETE_POSTINGS, ids).rowcount
+                deleted = conn.execute(_DELETE_MESSAGES, ids).rowcount
+                conn.execute(_DECREMENT_MESSAGE_COUNT, {"deleted": deleted, "chat_id": chat_id})
+                return {"message_terms": terms, "messages": deleted}
+
+            blocks = conn.execute(
+                _SELECT_ARCHIVE_BLOCKS,
+                {"chat_id": chat_id, "limit": max(batch_size // ARCHIVE_BLOCK_SIZE, 1)}
+            ).fetchall()
+            if blocks:
+                terms = sum(
+                    conn.execute(
+                        _DELETE_BLOCK_POSTINGS,
+                        {"chat_id": chat_id, "first_message_id": first_id, "last_message_id": last_id}
+                    ).rowcount
+                    for _, _, first_id, last_id in blocks
+                )
+                archived = conn.execute(
+                    _DELETE_ARCHIVE_BLOCKS, {"ids": [block_id for block_id, *_ in blocks]}
+                ).rowcount
+                conn.execute(
+                    _DECREMENT_MESSAGE_COUNT,
+                    {"deleted": sum(count for _, count, *_ in blocks), "chat_id": chat_id}
+                )
+                return {"message_terms": terms, "message_archive_blocks": archived}
+
+            user_ids = conn.execute(
+                _SELECT_PARTICIPANT_BATCH, {"chat_id": chat_id, "limit": batch_size}
+            ).scalars().all()
+            if user_ids:
+                participants = conn.execute(
+                    _DELETE_PARTICIPANT_BATCH, {"chat_id": chat_id, "user_ids": user_ids}
+                ).rowcount
+                return {"chat_participants": participants}
+
+            return {"chats": conn.execute(_DELETE_DELETED_CHAT, {"chat_id": chat_id}).rowcount}
+
+    def get_archive_candidates(self, block_size: int = ARCHIVE_BLOCK_SIZE) -> List[str]:
+        """Live chats with at least ``block_size`` messages still in the hot table"""
+        with self.engine.connect() as conn:
+            return conn.execute(_SELECT_ARCHIVE_CANDIDATES, {"block_size": block_size}).scalars().all()
+
+    def archive_messages(self, chat_id: str, cutoff: datetime, block_size: int = ARCHIVE_BLOCK_SIZE) -> int:
+        """Move a chat's oldest ``block_size`` hot messages into one compressed archive block.
+
+        Only full blocks of messages all older than ``cutoff`` are archived, in one short
+        transaction. Their search postings stay, so archived messages remain searchable.
+        Returns the number of messages archived, 0 when there is no full block to move.
+        """
+        with self.engine.begin() as conn:
+            chat = conn.execute(_SELECT_ARCHIVED_SEQ, {"chat_id": chat_id}).fetchone()
+            if not chat:
+                return 0
+            archived_seq = chat[0]
+            rows = conn.execute(
+                _SELECT_ARCHIVE_BATCH, {"chat_id": chat_id, "after_seq": archived_seq, "block_size": block_size}
+            ).fetchall()
+            if len(rows) < block_size or rows[-1].timestamp >= cutoff:
+                return 0
+
+            # Claim the range; a concurrent archiver that got there first makes this a no-op
+            claimed = conn.execute(
+                _CLAIM_ARCHIVE_RANGE,
+                {"last_seq": rows[-1].seq, "chat_id": chat_id, "b_archived_seq": archived_seq}
+            ).rowcount
+            if not claimed:
+                return 0
+
+            payload, stats = encode_block(rows)
+            conn.execute(
+                _INSERT_ARCHIVE_BLOCK,
+                {
+                    "chat_id": chat_id,
+                    "first_seq": rows[0].seq,
+                    "last_seq": rows[-1].seq,
+                    "first_message_id": min(row.id for row in rows),
+                    "last_message_id": max(row.id for row in rows),
+                    "message_count": len(rows),
+                    "payload": payload,
+                    "stats": stats
+                }
+            )
+            conn.execute(_DELETE_MESSAGES, {"ids": [row.id for row in rows]})
+            return len(rows)
+
     def get_user_chats(self, user_id: str) -> List[Chat]:
-        """Get all chats for a user ordered by creation time"""
+        """Get all chats for a user ordered by creation time, with participants, last message
+        and unread count.
+
+        Uses two queries however many chats the user is in; messages other than the last
+        one are not loaded.
+        """
         try:
-            with pool.connect() as conn:
-                chats_data = conn.execute(
-                    text("""
-                        SELECT c.* 
-                        FROM chats c
-                        JOIN chat_participants cp ON c.id = cp.chat_id
-                        WHERE cp.user_id = :user_id
-                        ORDER BY c.created_at DESC
-                    """),
-                    {"user_id": user_id}
-                ).fetchall()
-
-                return [self.get_chat_by_id(chat.id) for chat in chats_data]
-        except Exception as e:
-            logging.error(f"Error getting user chats: {str(e)}")
+            params = {"user_id": user_id}
+            with self.engine.connect() as conn:
+                chats_data = conn.execute(_SELECT_USER_CHATS, params).fetchall()
+                participants_data = conn.execute(_SELECT_USER_CHAT_PARTICIPANTS, params).fetchall()
+
+            participants = {}
+            for chat_id, participant_id in participants_data:
+                participants.setdefault(chat_id, []).append(participant_id)
+
+            return [
+                Chat(
+                    chat_id, admin_id, chat_name, agenda, created_at,
+                    participants=participants.get(chat_id, []),
+                    message_count=message_count,
+                    unread_count=unread_count,
+                    last_read_message_id=last_read_message_id,
+                    last_message=Message(last_sender_id, last_content, last_id, last_timestamp)
+                    if last_id is not None else None
+                )
+                for (chat_id, admin_id, chat_name, agenda, created_at, message_count, unread_count,
+                     last_read_message_id, last_id, last_sender_id, last_content, last_timestamp) in chats_data
+            ]
+        except Exception:
+            logger.exception("Error getting user chats for user %s", user_id)
             raise
 
+    def get_user_feed(self, user_id: str, limit: int, before=None) -> Optional[List[Tuple[str, str, Message]]]:
+        """The newest messages across all of a user's chats, newest first.
+
+        Each chat's messages are read newest first through an index seek on
+        (chat_id, timestamp, id), below the ``before`` message when given (keyset
+        pagination), and the per-chat streams are k-way merged lazily. The first query
+        takes a small chunk (FEED_CHUNK_SIZE) from every chat at once; only a chat whose
+        chunk the merge drains is read again, with a doubled chunk. Cost follows the page
+        size plus a few rows per chat, not chats x page size. A chat whose hot rows run
+        out continues into its archive blocks, newest first, decompressed one at a time
+        and only once the merge reaches them.
+
+        Returns ``(chat_id, chat_name, message)`` tuples, or None when ``before`` is not a
+        message (hot or archived) in one of the user's chats.
+        """
+        with self.engine.connect() as conn:
+            params, cursor = {}, None
+            if before is not None:
+                cursor = self._feed_cursor(conn, user_id, before)
+                if cursor is None:
+                    return None
+                params = {"before_ts": cursor[0], "before_id": cursor[1]}
+
+            chunk = min(limit, FEED_CHUNK_SIZE)
+            streams = []
+            feed_chats = conn.execute(_SELECT_FEED_CHATS, {"user_id": user_id}).fetchall()
+            for start in range(0, len(feed_chats), FEED_CHATS_PER_QUERY):
+                batch = feed_chats[start:start + FEED_CHATS_PER_QUERY]
+                by_chat = self._feed_rows(conn, [chat_id for chat_id, _, _ in batch], dict(params, limit=chunk))
+                streams.extend(
+                    self._feed_stream(conn, (chat_id, chat_name), by_chat.get(chat_id, []), chunk, limit,
+                                      archived=bool(archived_seq), cursor=cursor)
+                    for chat_id, chat_name, archived_seq in batch
+                    if chat_id in by_chat or archived_seq
+                )
+            return list(islice(heapq.merge(*streams, key=_feed_key, reverse=True), limit))
+
+    @staticmethod
+    def _feed_cursor(conn, user_id: str, before) -> Optional[Tuple[datetime, int]]:
+        """(timestamp, id) of the ``before`` message, looking in the archive if it is no longer hot"""
+        params = {"user_id": user_id, "before": before}
+        cursor = conn.execute(_SELECT_FEED_CURSOR, params).fetchone()
+        if cursor is not None:
+            return cursor[0], cursor[1]
+        # Message ids are global, so other chats' blocks may span it too
+        for payload in conn.execute(_SELECT_FEED_ARCHIVED_CURSOR, params).scalars():
+            for record in decode_block(payload):
+                if record["id"] == before:
+                    return record["timestamp"], record["id"]
+        return None
+
+    def _feed_rows(self, conn, chat_ids: List[str], params: dict) -> Dict[str, List[Tuple[str, str, Message]]]:
+        """One UNION ALL over ``chat_ids``; each chat's entries, newest first"""
+        chat_params = {f"chat_{index}": chat_id for index, chat_id in enumerate(chat_ids)}
+        by_chat = {}
+        for row in conn.execute(_feed_query(len(chat_ids), "before_ts" in params), dict(params, **chat_params)):
+            chat_id, chat_name = row[_MESSAGE_WIDTH:]
+            by_chat.setdefault(chat_id, []).append((chat_id, chat_name, self._row_to_message(row)))
+        # SQL doesn't promise branch order through UNION ALL; re-sorting an ordered run is linear
+        for entries in by_chat.values():
+            entries.sort(key=_feed_key, reverse=True)
+        return by_chat
+
+    def _feed_stream(self, conn, chat: Tuple[str, str], entries, chunk: int, limit: int,
+                     archived: bool = False, cursor=None) -> Iterator[Tuple[str, str, Message]]:
+        """One chat's feed entries, reading the next (doubled) chunk only once the merge drains
+        these, then its archived messages below ``cursor`` (or the last hot entry)"""
+        chat_id, chat_name = chat
+        while True:
+            yield from entries
+            if entries:
+                cursor = _feed_key(entries[-1])
+            if len(entries) < chunk:
+                break
+            chunk = min(chunk * 2, limit)
+            params = {"before_ts": cursor[0], "before_id": cursor[1], "limit": chunk}
+            entries = self._feed_rows(conn, [chat_id], params).get(chat_id, [])
+        if archived:
+            for message in self._archived_feed(conn, chat_id, cursor):
+                yield chat_id, chat_name, message
+
+    def _archived_feed(self, conn, chat_id: str, cursor=None) -> Iterator[Message]:
+        """A chat's archived messages below ``cursor``, newest first, one block at a time"""
+        block_ids = [block_id for block_id, _ in conn.execute(_SELECT_RECENT_ARCHIVE_BLOCKS, {"chat_id": chat_id})]
+        names: Dict[str, str] = {}
+        for block_id in block_ids:
+            records = decode_block(conn.execute(_SELECT_ARCHIVE_PAYLOAD, {"id": block_id}).scalar())
+            records = [record for record in reversed(records)
+                       if cursor is None or (record["timestamp"], record["id"]) < cursor]
+            yield from self._records_to_messages(conn, records, names)
+
+    def get_chat_stats(self, chat_id: str) -> ChatStats:
+        """Activity statistics for a chat, aggregated in SQL without loading any messages.
+
+        Per-sender counts, average lengths and first/last activity come from one GROUP BY;
+        the hourly and daily histograms from a second one over (day, hour), which only
+        reads the (chat_id, timestamp) index. Archived messages are counted from the
+        aggregates stored with each archive block.
+        Hours and days are in the database's time zone (UTC).
+        """
+        params = {"chat_id": chat_id}
+        with self.engine.connect() as conn:
+            dialect = conn.dialect.name
+            senders = conn.execute(_SELECT_SENDER_STATS[dialect], params).fetchall()
+            activity = conn.execute(_SELECT_ACTIVITY_STATS[dialect], params).fetchall()
+            archived = [json.loads(stats) for stats in conn.execute(_SELECT_ARCHIVE_STATS, params).scalars()]
+
+            # sender_id -> [name, messages, characters, first, last]
+            totals = {
+                sender_id: [sender_name, count, float(average_length or 0) * count,
+                            _as_datetime(first_at), _as_datetime(last_at)]
+                for sender_id, sender_name, count, average_length, first_at, last_at in senders
+            }
+            for block in archived:
+                for sender_id, (count, characters, first_at, last_at) in block["senders"].items():
+                    entry = totals.setdefault(sender_id, [None, 0, 0.0, None, None])
+                    entry[1] += count
+                    entry[2] += characters
+                    entry[3] = _earliest(entry[3], _as_datetime(first_at))
+                    entry[4] = _latest(entry[4], _as_datetime(last_at))
+            unnamed = [sender_id for sender_id, entry in totals.items() if entry[0] is None]
+            if archived and unnamed:
+                for sender_id, name in self._sender_names(conn, unnamed).items():
+                    totals[sender_id][0] = name
+
+        stats = ChatStats(chat_id=chat_id)
+        for sender_id, (name, count, characters, first_at, last_at) in sorted(
+                totals.items(), key=lambda item: (-item[1][1], item[0])):
+            stats.participants.append(ParticipantStats(
+                sender_id=sender_id,
+                sender_name=name,
+                message_count=count,
+                average_length=round(characters / count, 1),
+                first_message_at=first_at,
+                last_message_at=last_at
+            ))
+        if stats.participants:
+            stats.message_count = sum(entry[1] for entry in totals.values())
+            stats.average_length = round(sum(entry[2] for entry in totals.values()) / stats.message_count, 1)
+            stats.first_message_at = min(p.first_message_at for p in stats.participants if p.first_message_at)
+            stats.last_message_at = max(p.last_message_at for p in stats.participants if p.last_message_at)
+        daily: Dict[str, int] = {}
+        for day, hour, count in activity:
+            if day is None:
+                continue
+            stats.hourly[int(hour)] += count
+            daily[str(day)] = daily.get(str(day), 0) + count
+        for block in archived:
+            for hour, count in enumerate(block["hours"]):
+                stats.hourly[hour] += count
+            for day, count in block["days"].items():
+                daily[day] = daily.get(day, 0) + count
+        stats.daily = dict(sorted(daily.items()))
+        return stats
+
+    def mark_read(self, chat_id: str, user_id: str, message_id) -> Optional[int]:
+        """Move a participant's read cursor up to ``message_id`` and return their unread count.
+
+        The cursor never moves backwards. Returns None if the message is not in the chat.
+        """
+        with self.engine.begin() as conn:
+            seq = self._message_seq(conn, chat_id, message_id)
+            if seq is None:
+                return None
+
+            conn.execute(
+                _ADVANCE_READ_CURSOR,
+                {"seq": seq, "message_id": message_id, "b_chat_id": chat_id, "b_user_id": user_id}
+            )
+            cursor = conn.execute(_SELECT_UNREAD_COUNT, {"chat_id": chat_id, "user_id": user_id}).fetchone()
+            return cursor[0] if cursor else None
+
     def remove_participant(self, chat_id: str, user_id: str) -> bool:
         """Remove a participant from a chat"""
         try:
-            with pool.begin() as conn:
-                conn.execute(
-                    text("""DELETE FROM chat_participants 
-                            WHERE chat_id = :chat_id AND user_id = :user_id"""),
-                    {"chat_id": chat_id, "user_id": user_id}
-                )
-                count = conn.execute(
-                    text("SELECT COUNT(*) as cnt FROM chats WHERE id = :chat_id"),
-                    {"chat_id": chat_id}
-                ).fetchone().cnt
+            with self.engine.begin() as conn:
+                conn.execute(_DELETE_PARTICIPANT, {"chat_id": chat_id, "user_id": user_id})
+                count = conn.execute(_COUNT_LIVE_CHATS, {"chat_id": chat_id}).scalar()
                 return count > 0
         except Exception:
             raise
@@ -190,12 +931,27 @@ class ChatRepository:
     def is_participant(self, chat_id: str, user_id: str) -> bool:
         """Check if a user is a participant in a chat"""
         try:
-            with pool.connect() as conn:
-                chat_data = conn.execute(
-                    text("""SELECT 1 FROM chat_participants 
-                            WHERE chat_id = :chat_id AND user_id = :user_id"""),
-                    {"chat_id": chat_id, "user_id": user_id}
-                ).fetchone()
+            with self.engine.connect() as conn:
+                chat_data = conn.execute(_SELECT_LIVE_PARTICIPANT, {"chat_id": chat_id, "user_id": user_id}).fetchone()
                 return chat_data is not None
         except Exception:
             raise
+
+
+def _as_datetime(value) -> Optional[datetime]:
+    """SQLite hands back aggregated timestamps as text"""
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+
+def _feed_key(entry: Tuple[str, str, Message]):
+    return entry[2].timestamp, entry[2].id
+
+
+def _earliest(a: Optional[datetime], b: Optional[datetime]) -> Optional[datetime]:
+    return min(a, b) if a and b else a or b
+
+
+def _latest(a: Optional[datetime], b: Optional[datetime]) -> Optional[datetime]:
+    return max(a, b) if a and b else a or b
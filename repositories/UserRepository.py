@@ -1,68 +1,87 @@
-from typing import Optional, List
+from typing import Optional, List, Iterator
 from entities.User import User
-from sqlalchemy import text
+from sqlalchemy import bindparam, delete, insert, select, update
 from storage.database import pool
+from storage.schema import users
+
+# Rows fetched per round trip when streaming large result sets
+STREAM_BATCH_SIZE = 500
+
+# Statements are built once; SQLAlchemy compiles each one once per dialect and caches it.
+# Selected columns follow the User field order, so rows map onto it positionally.
+_PROFILE_COLUMNS = (users.c.id, users.c.email, users.c.name)
+_SELECT_BY_ID = select(*_PROFILE_COLUMNS).where(users.c.id == bindparam("user_id"))
+_SELECT_BY_EMAIL = select(
+    *_PROFILE_COLUMNS, users.c.password_hash, users.c.google_id, users.c.created_at
+).where(users.c.email == bindparam("email"))
+_INSERT_USER = insert(users)
+_UPDATE_PASSWORD_HASH = update(users).where(users.c.id == bindparam("user_id")).values(
+    password_hash=bindparam("password_hash"))
+_DELETE_USER = delete(users).where(users.c.id == bindparam("user_id"))
+_SELECT_ALL = select(*_PROFILE_COLUMNS, users.c.created_at).order_by(users.c.id)
+
 
 class UserRepository:
+    def __init__(self, engine=pool):
+        # The process-wide lazy engine unless an app was created with its own
+        self.engine = engine
+
     def get_user_by_id(self, user_id: str) -> Optional[User]:
         try:
-            with pool.connect() as conn:
-                user_data = conn.execute(
-                    text("SELECT * FROM users WHERE id = :user_id"),
-                    {"user_id": user_id}
-                ).fetchone()
-                if user_data:
-                    return User(id=user_data.id, name=user_data.name, email=user_data.email)
-                return None
+            with self.engine.connect() as conn:
+                row = conn.execute(_SELECT_BY_ID, {"user_id": user_id}).fetchone()
+                return User(*row) if row else None
         except Exception:
             raise
 
     def get_user_by_email(self, email: str) -> Optional[User]:
         try:
-            with pool.connect() as conn:
-                result = conn.execute(
-                    text("SELECT * FROM users WHERE email = :email"),
-                    {"email": email}
-                ).fetchone()
-                
-                if result is None:
-                    return None
-                # Convert Row to dictionary using _mapping
-                return User(**result._mapping)
+            with self.engine.connect() as conn:
+                row = conn.execute(_SELECT_BY_EMAIL, {"email": email}).fetchone()
+                return User(*row) if row else None
         except Exception:
             raise
 
     def save_user(self, user: User) -> User:
         try:
-            with pool.begin() as conn:
-                conn.execute(
-                    text("""
-                    INSERT INTO users (id, email, name, password_hash, created_at)
-                    VALUES (:id, :email, :name, :password_hash, :created_at)
-                    """),
-                    user.__dict__
-                )
+            with self.engine.begin() as conn:
+                conn.execute(_INSERT_USER, {
+                    "id": user.id,
+                    "email": user.email,
+                    "name": user.name,
+                    "password_hash": user.password_hash,
+                    "google_id": user.google_id,
+                    "created_at": user.created_at
+                })
             return user
         except Exception:
             raise
 
+    def update_password_hash(self, user_id: str, password_hash: str) -> bool:
+        """Replace a user's stored password hash"""
+        try:
+            with self.engine.begin() as conn:
+                result = conn.execute(_UPDATE_PASSWORD_HASH, {"user_id": user_id, "password_hash": password_hash})
+            return result.rowcount > 0
+        except Exception:
+            raise
+
     def delete_user(self, user_id: str) -> bool:
         """Delete a user"""
         try:
-            with pool.begin() as conn:
-                result = conn.execute(
-                    text("DELETE FROM users WHERE id = :user_id"),
-                    {"user_id": user_id}
-                )
+            with self.engine.begin() as conn:
+                result = conn.execute(_DELETE_USER, {"user_id": user_id})
             return result.rowcount > 0
         except Exception:
             raise
 
     def get_all_users(self) -> List[User]:
         """Get all users"""
-        try:
-            with pool.connect() as conn:
-                result = conn.execute(text("SELECT * FROM users"))
-                return [User(id=row.id, name=row.name) for row in result.fetchall()]
-        except Exception:
-            raise
+        return list(self.iter_users())
+
+    def iter_users(self, batch_size: int = STREAM_BATCH_SIZE) -> Iterator[User]:
+        """Stream all users in id order using a server-side cursor, ``batch_size`` rows at a time"""
+        with self.engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(_SELECT_ALL)
+            for user_id, email, name, created_at in result:
+                yield User(user_id, email, name, created_at=created_at)
@@ -0,0 +1,46 @@
+from dataclasses import dataclass
+from flask import current_app
+from repositories.ChatRepository import ChatRepository
+from repositories.UserRepository import UserRepository
+from services.AuthService import AuthService
+from services.ChatReaper import ChatReaper
+from services.ChatService import ChatService
+from services.SummaryService import SummaryService
+
+EXTENSION_KEY = "gatherly"
+
+
+@dataclass
+class AppServices:
+    """The repositories and services of one app, kept in ``app.extensions``.
+
+    Each app built by ``create_app`` gets its own set wired to its own engine and LLM,
+    so creating a second app (a test, a benchmark) leaves the first one untouched.
+    """
+    chat_repository: ChatRepository
+    user_repository: UserRepository
+    chat_reaper: ChatReaper
+    chat_service: ChatService
+    summary_service: SummaryService
+    auth_service: AuthService
+
+    @classmethod
+    def build(cls, engine, llm=None) -> "AppServices":
+        """Wire everything to ``engine``; the LLM defaults to an OpenAI client built on first use"""
+        chat_repository = ChatRepository(engine)
+        user_repository = UserRepository(engine)
+        chat_reaper = ChatReaper(chat_repository)
+        chat_service = ChatService(chat_repository, user_repository, reaper=chat_reaper)
+        return cls(
+            chat_repository=chat_repository,
+            user_repository=user_repository,
+            chat_reaper=chat_reaper,
+            chat_service=chat_service,
+            summary_service=SummaryService(chat_repository, chat_service, llm=llm),
+            auth_service=AuthService(user_repository),
+        )
+
+
+def current_services() -> AppServices:
+    """The services of the app handling the current request"""
+    return current_app.extensions[EXTENSION_KEY]
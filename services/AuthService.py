@@ -1,14 +1,18 @@
 from typing import Optional, Tuple
 from entities.User import User
 from repositories.UserRepository import UserRepository
-from utils.auth import hash_password, verify_password, create_token
+from utils.auth import hash_password, verify_password, password_needs_rehash, create_token
+from utils.http import get_session
+from utils.oidc import OIDCProvider
 import uuid
-import requests
-from config.oauth import client, GOOGLE_DISCOVERY_URL, GOOGLE_CLIENT_ID
+from config.oauth import client, google_provider, GOOGLE_CLIENT_SECRET, GOOGLE_REDIRECT_URI
 
 class AuthService:
-    def __init__(self, user_repository: UserRepository):
+    def __init__(self, user_repository: UserRepository, oidc_provider: Optional[OIDCProvider] = None,
+                 session=None):
         self.user_repository = user_repository
+        self.oidc_provider = oidc_provider or google_provider
+        self.session = session or get_session()
 
     def register(self, email: str, password: str, name: str) -> Tuple[Optional[User], str]:
         if self.user_repository.get_user_by_email(email):
@@ -23,18 +27,21 @@ class AuthService:
         saved_user = self.user_repository.save_user(user)
         return saved_user, "Registration successful"
 
-    def login(self, email: str, password: str) -> Tuple[Optional[str], str]:
+    def login(self, email: str, password: str) -> Tuple[Optional[str], str, Optional[str]]:
         user = self.user_repository.get_user_by_email(email)
 
-        if not user or not verify_password(password, user.password_hash):
-            return None, "Invalid credentials"
-            
+        if not user or not user.password_hash or not verify_password(password, user.password_hash):
+            return None, "Invalid credentials", None
+
+        # Upgrade hashes made with an older work factor while we still have the plaintext
+        if password_needs_rehash(user.password_hash):
+            self.user_repository.update_password_hash(user.id, hash_password(password))
+
         token = create_token(user.id)
         return token, "Login successful", user.id
 
     def get_google_auth_url(self) -> str:
-        google_provider_cfg = requests.get(GOOGLE_DISCOVERY_URL).json()
-        authorization_endpoint = google_provider_cfg["authorization_endpoint"]
+        authorization_endpoint = self.oidc_provider.config()["authorization_endpoint"]
         
         return client.prepare_request_uri(
             authorization_endpoint,
@@ -42,30 +49,40 @@ class AuthService:
             scope=["openid", "email", "profile"],
         )
 
-    def handle_google_callback(self, code: str) -> Tuple[Optional[str], str]:
-        try:
-            google_provider_cfg = requests.get(GOOGLE_DISCOVERY_URL).json()
-            token_endpoint = google_provider_cfg["token_endpoint"]
+    def _fetch_google_claims(self, code: str) -> dict:
+        """Exchange the authorization code and return the verified identity claims."""
+        google_provider_cfg = self.oidc_provider.config()
+        token_endpoint = google_provider_cfg["token_endpoint"]
 
-            # Get tokens
-            token_url, headers, body = client.prepare_token_request(
-                token_endpoint,
-                authorization_response=code,
-                redirect_url=GOOGLE_REDIRECT_URI,
-                client_secret=GOOGLE_CLIENT_SECRET
-            )
-            token_response = requests.post(token_url, headers=headers, data=body)
-            client.parse_request_body_response(token_response.text)
+        # Get tokens
+        token_url, headers, body = client.prepare_token_request(
+            token_endpoint,
+            code=code,
+            redirect_url=GOOGLE_REDIRECT_URI,
+            client_secret=GOOGLE_CLIENT_SECRET
+        )
+        token_response = self.session.post(token_url, headers=headers, data=body)
+        tokens = client.parse_request_body_response(token_response.text)
 
-            # Get user info
-            userinfo_endpoint = google_provider_cfg["userinfo_endpoint"]
-            uri, headers, body = client.add_token(userinfo_endpoint)
-            userinfo_response = requests.get(uri, headers=headers, data=body)
+        # The id_token already carries the profile claims; verifying it locally saves a round trip
+        if tokens.get("id_token"):
+            return self.oidc_provider.verify_id_token(tokens["id_token"])
+
+        userinfo_response = self.session.get(
+            google_provider_cfg["userinfo_endpoint"],
+            headers={"Authorization": f"Bearer {tokens['access_token']}"}
+        )
+        userinfo_response.raise_for_status()
+        return userinfo_response.json()
+
+    def handle_google_callback(self, code: str) -> Tuple[Optional[str], str]:
+        try:
+            claims = self._fetch_google_claims(code)
             
-            if userinfo_response.json().get("email_verified"):
-                google_id = userinfo_response.json()["sub"]
-                email = userinfo_response.json()["email"]
-                name = userinfo_response.json()["given_name"]
+            if claims.get("email_verified"):
+                google_id = claims["sub"]
+                email = claims["email"]
+                name = claims.get("given_name") or claims.get("name") or email
                 
                 # Check if user exists
                 user = self.user_repository.get_user_by_email(email)
@@ -86,4 +103,4 @@ class AuthService:
             return None, "Google authentication failed"
             
         except Exception as e:
-            return None, str(e)
\ No newline at end of file
+            return None, str(e)
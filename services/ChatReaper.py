@@ -0,0 +1,94 @@
+"""Background purge of soft-deleted chats.
+
+Deleting a chat only marks it deleted. This reaper then removes its messages, search
+postings and participants in batches of ``REAPER_BATCH_SIZE`` rows, one short
+transaction per batch with a pause in between, so a chat with a long history never
+holds locks long enough to stall writers.
+
+Progress shows in ``/metrics`` (``gatherly_reaper_*``) and in the chat's
+``message_count``, which counts down as its messages are purged. Each gunicorn worker
+runs its own reaper; they may work on the same chat, which only costs empty batches.
+"""
+from typing import Dict
+import logging
+import os
+import threading
+import time
+from repositories.ChatRepository import ChatRepository
+from utils.metrics import registry
+
+REAPER_BATCH_SIZE = int(os.getenv("REAPER_BATCH_SIZE", "500"))
+REAPER_PAUSE = float(os.getenv("REAPER_PAUSE_MS", "50")) / 1000
+# How often to look for deleted chats left over from another process or a restart
+REAPER_INTERVAL = float(os.getenv("REAPER_INTERVAL", "60"))
+
+logger = logging.getLogger(__name__)
+
+reaper_rows = registry.counter(
+    "gatherly_reaper_deleted_rows_total", "Rows purged from soft-deleted chats, by table")
+reaper_chats = registry.counter(
+    "gatherly_reaper_chats_total", "Soft-deleted chats purged completely")
+reaper_pending = registry.gauge(
+    "gatherly_reaper_pending_chats", "Soft-deleted chats waiting to be purged, as of the last sweep")
+
+
+class ChatReaper:
+    def __init__(self, chat_repository: ChatRepository, batch_size: int = REAPER_BATCH_SIZE,
+                 pause: float = REAPER_PAUSE, interval: float = REAPER_INTERVAL):
+        self.chat_repository = chat_repository
+        self.batch_size = batch_size
+        self.pause = pause
+        self.interval = interval
+        self._wake = threading.Event()
+        self._thread_pid = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """Start the reaper thread in this process unless it is already running"""
+        if self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread_pid != os.getpid():
+                threading.Thread(target=self._run, name="chat-reaper", daemon=True).start()
+                self._thread_pid = os.getpid()
+
+    def wake(self) -> None:
+        """Sweep now instead of at the next interval"""
+        self._wake.set()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Chat reaper sweep failed")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def run_once(self) -> int:
+        """Purge every chat that is currently soft-deleted; returns the number purged"""
+        chat_ids = self.chat_repository.get_deleted_chat_ids()
+        reaper_pending.set(len(chat_ids))
+        for remaining, chat_id in enumerate(chat_ids, 1):
+            self.purge(chat_id)
+            reaper_pending.set(len(chat_ids) - remaining)
+        return len(chat_ids)
+
+    def purge(self, chat_id: str) -> Dict[str, int]:
+        """Delete a soft-deleted chat batch by batch; returns rows deleted per table"""
+        totals: Dict[str, int] = {}
+        while True:
+            deleted = self.chat_repository.purge_deleted_chat(chat_id, self.batch_size)
+            if not deleted:
+                break
+            for table, rows in deleted.items():
+                totals[table] = totals.get(table, 0) + rows
+                reaper_rows.inc(rows, table=table)
+            if "chats" in deleted:
+                reaper_chats.inc()
+                break
+            logger.debug("Purging chat %s: %s rows deleted so far", chat_id, totals)
+            time.sleep(self.pause)
+        if totals:
+            logger.info("Purged deleted chat %s: %s", chat_id, totals)
+        return totals
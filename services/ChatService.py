@@ -1,22 +1,36 @@
 from typing import Optional, List, Tuple
 from entities.Chat import Chat
+from entities.ChatStats import ChatStats
 from entities.User import User
 from entities.Message import Message
 from repositories.ChatRepository import ChatRepository
 from repositories.UserRepository import UserRepository
+from utils.text import tokenize
 import logging
 
+logger = logging.getLogger(__name__)
+
+
+class NotParticipant(Exception):
+    """The caller is not a participant of the chat they addressed"""
+
+    def __init__(self, message: str = "User is not in the chat"):
+        super().__init__(message)
+
+
 class ChatService:
-    def __init__(self, chat_repository: ChatRepository, user_repository: UserRepository):
+    def __init__(self, chat_repository: ChatRepository, user_repository: UserRepository, reaper=None):
         """
         Initialize ChatService with required repositories
         
         Args:
             chat_repository (ChatRepository): Repository for chat operations
             user_repository (UserRepository): Repository for user operations
+            reaper (ChatReaper): Purges deleted chats in the background; woken after a delete
         """
         self.chat_repository = chat_repository
         self.user_repository = user_repository
+        self.reaper = reaper
 
     def create_chat(self, creator_id: str, chat_id: str, chat_name: str, agenda: str) -> Tuple[Optional[Chat], str]:
         """
@@ -31,8 +45,8 @@ class ChatService:
         Returns:
             Tuple[Optional[Chat], str]: (Chat object or None, success/error message)
         """
-        # Check if chat ID already exists
-        if self.chat_repository.get_chat_by_id(chat_id):
+        # Check if chat ID already exists; a deleted chat keeps its ID until it is purged
+        if self.chat_repository.get_chat_by_id(chat_id, include_messages=False, include_deleted=True):
             return None, "Chat ID already exists"
 
         # Verify creator exists
@@ -70,7 +84,7 @@ class ChatService:
             return False, "User not found"
 
         # Verify chat exists
-        chat = self.chat_repository.get_chat_by_id(chat_id)
+        chat = self.chat_repository.get_chat_by_id(chat_id, include_messages=False)
         if not chat:
             return False, "Chat not found"
 
@@ -84,7 +98,7 @@ class ChatService:
             return True, "User joined chat successfully"
         return False, "Failed to add user to chat"
 
-    def send_message(self, user_id: str, chat_id: str, content: str) -> Tuple[bool, str]:
+    def send_message(self, user_id: str, chat_id: str, content: str) -> Tuple[bool, str, int]:
         """
         Send a message in a chat
         
@@ -93,33 +107,51 @@ class ChatService:
             content (str): Message content
             
         Returns:
-            Tuple[bool, str]: (Success status, success/error message)
+            Tuple[bool, str, int]: (Success status, success/error message, chat message count)
         """
         try:
-            # Verify chat exists
-            chat = self.chat_repository.get_chat_by_id(chat_id)
-            if not chat:
-                return False, "Chat not found"
-
             # if not self.chat_repository.is_participant(chat_id, user_id):
             #     # raise error
             #     raise Exception("User is not a participant in this chat")
 
-            # Create and add message
+            # Create and add message; the repository reports a missing chat as a count of 0
             message = Message(
                 sender_id=user_id,
                 content=content
             )
             
-            success = self.chat_repository.add_message(chat_id, message)
-            if success:
-                return True, "Message sent successfully"
-            return False, "Failed to send message"
+            message_count = self.chat_repository.add_message(chat_id, message)
+            if message_count:
+                return True, "Message sent successfully", message_count
+            return False, "Chat not found", 0
             
         except Exception as e:
-            logging.error(f"Error in send_message: {str(e)}")
+            logger.exception("Error in send_message for chat %s", chat_id)
             raise
 
+    def mark_read(self, user_id: str, chat_id: str, message_id) -> Tuple[Optional[int], str]:
+        """
+        Record that a user has read a chat up to and including a message
+        
+        Args:
+            user_id (str): ID of the reader
+            chat_id (str): ID of the chat
+            message_id: ID of the last message the user has seen
+            
+        Returns:
+            Tuple[Optional[int], str]: (Messages still unread or None, success/error message)
+
+        Raises:
+            NotParticipant: The user is not in the chat
+        """
+        if not self.chat_repository.is_participant(chat_id, user_id):
+            raise NotParticipant()
+
+        unread_count = self.chat_repository.mark_read(chat_id, user_id, message_id)
+        if unread_count is None:
+            return None, "Message not found"
+        return unread_count, "Read cursor updated"
+
     def leave_chat(self, user_id: str, chat_id: str) -> Tuple[bool, str]:
         """
         Remove a user from a chat
@@ -131,7 +163,7 @@ class ChatService:
         Returns:
             Tuple[bool, str]: (Success status, success/error message)
         """
-        chat = self.chat_repository.get_chat_by_id(chat_id)
+        chat = self.chat_repository.get_chat_by_id(chat_id, include_messages=False)
         if not chat:
             return False, "Chat not found"
 
@@ -164,7 +196,8 @@ class ChatService:
 
     def delete_chat(self, user_id: str, chat_id: str) -> Tuple[bool, str]:
         """
-        Delete a chat (admin only)
+        Delete a chat (admin only). The chat is hidden at once; its messages and
+        participants are purged in the background.
         
         Args:
             user_id (str): ID of the user requesting deletion
@@ -173,7 +206,7 @@ class ChatService:
         Returns:
             Tuple[bool, str]: (Success status, success/error message)
         """
-        chat = self.chat_repository.get_chat_by_id(chat_id)
+        chat = self.chat_repository.get_chat_by_id(chat_id, include_messages=False)
         if not chat:
             return False, "Chat not found"
 
@@ -182,5 +215,87 @@ class ChatService:
 
         success = self.chat_repository.delete_chat(chat_id)
         if success:
+            if self.reaper is not None:
+                self.reaper.wake()
             return True, "Chat deleted successfully"
         return False, "Failed to delete chat"
+
+    def get_user_feed(self, user_id: str, limit: int = 20, before=None) -> Tuple[Optional[List[dict]], str]:
+        """
+        The newest messages across all chats a user participates in
+        
+        Args:
+            user_id (str): ID of the user
+            limit (int): Page size
+            before: ID of the last message of the previous page, if any
+            
+        Returns:
+            Tuple[Optional[List[dict]], str]: (Feed entries newest first, or None if ``before``
+            is not a message in the user's chats; success/error message)
+        """
+        entries = self.chat_repository.get_user_feed(user_id, limit, before)
+        if entries is None:
+            return None, "Cursor message not found in the user's chats"
+        return [
+            {
+                "chat_id": chat_id,
+                "chat_name": chat_name,
+                "message": message
+            } for chat_id, chat_name, message in entries
+        ], "Feed loaded"
+
+    def get_chat_stats(self, chat_id: str, user_id: str) -> Tuple[Optional[ChatStats], str]:
+        """
+        Activity statistics for a chat, aggregated by the database
+        
+        Args:
+            chat_id (str): ID of the chat
+            user_id (str): ID of the user asking
+            
+        Returns:
+            Tuple[Optional[ChatStats], str]: (Stats or None, success/error message)
+
+        Raises:
+            NotParticipant: The user is not in the chat
+        """
+        chat = self.chat_repository.get_chat_by_id(chat_id, include_messages=False)
+        if not chat:
+            return None, "Chat not found"
+        if user_id not in chat.participants:
+            raise NotParticipant()
+        return self.chat_repository.get_chat_stats(chat_id), "Stats computed successfully"
+
+    def search_messages(self, user_id: str, query: str, chat_id: Optional[str] = None,
+                        limit: int = 20, offset: int = 0) -> Tuple[Optional[List[dict]], str]:
+        """
+        Full-text search over messages in chats the user participates in
+        
+        Args:
+            user_id (str): ID of the user searching
+            query (str): Free-text query
+            chat_id (Optional[str]): Restrict the search to one chat
+            limit (int): Page size
+            offset (int): Number of ranked results to skip
+            
+        Returns:
+            Tuple[Optional[List[dict]], str]: (Ranked results or None, success/error message)
+
+        Raises:
+            NotParticipant: ``chat_id`` is given and the user is not in it
+        """
+        terms = sorted(set(tokenize(query)))
+        if not terms:
+            return None, "Query has no searchable terms"
+
+        if chat_id and not self.chat_repository.is_participant(chat_id, user_id):
+            raise NotParticipant()
+
+        hits = self.chat_repository.search_messages(terms, user_id, chat_id=chat_id, limit=limit, offset=offset)
+        return [
+            {
+                "chat_id": hit_chat_id,
+                "message": message,
+                "matched_terms": matched,
+                "score": score
+            } for hit_chat_id, message, matched, score in hits
+        ], "Search completed"
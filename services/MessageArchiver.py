@@ -0,0 +1,64 @@
+"""Move cold messages out of the hot ``messages`` table into compressed archive blocks.
+
+Messages older than ``ARCHIVE_AFTER_DAYS`` are archived per chat in full blocks of
+``ARCHIVE_BLOCK_SIZE`` (see ``storage/archive.py``), one short transaction per block.
+The hot table and its indexes then only hold recent messages; chat reads, exports,
+stats, feeds and read cursors fall back to the archive transparently. Archived messages
+keep their search postings, so search finds them too and decompresses only the blocks
+holding hits.
+
+Run it periodically, e.g. from cron:
+
+    python -m services.MessageArchiver
+"""
+from datetime import datetime, timedelta
+from typing import Optional
+import logging
+import os
+import time
+from repositories.ChatRepository import ChatRepository
+from storage.archive import ARCHIVE_BLOCK_SIZE
+from utils.metrics import registry
+
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_PAUSE = float(os.getenv("ARCHIVE_PAUSE_MS", "50")) / 1000
+
+logger = logging.getLogger(__name__)
+
+archived_messages = registry.counter(
+    "gatherly_archived_messages_total", "Messages moved into compressed archive blocks")
+
+
+class MessageArchiver:
+    def __init__(self, chat_repository: ChatRepository, max_age_days: float = ARCHIVE_AFTER_DAYS,
+                 block_size: int = ARCHIVE_BLOCK_SIZE, pause: float = ARCHIVE_PAUSE):
+        self.chat_repository = chat_repository
+        self.max_age_days = max_age_days
+        self.block_size = block_size
+        self.pause = pause
+
+    def run_once(self, now: Optional[datetime] = None) -> int:
+        """Archive every full block of old enough messages; returns the number of messages moved"""
+        # Timestamps are stored in UTC
+        cutoff = (now or datetime.utcnow()) - timedelta(days=self.max_age_days)
+        total = 0
+        for chat_id in self.chat_repository.get_archive_candidates(self.block_size):
+            while True:
+                moved = self.chat_repository.archive_messages(chat_id, cutoff, self.block_size)
+                if not moved:
+                    break
+                total += moved
+                archived_messages.inc(moved)
+                time.sleep(self.pause)
+        if total:
+            logger.info("Archived %s messages", total)
+        return total
+
+
+if __name__ == "__main__":
+    from storage.database import pool
+
+    logging.basicConfig(level=logging.INFO)
+    moved = MessageArchiver(ChatRepository()).run_once()
+    print(f"Archived {moved} messages")
+    pool.dispose()
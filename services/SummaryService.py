@@ -1,35 +1,95 @@
-from typing import Optional, Tuple, Dict
+from typing import Optional, Tuple, Dict, List
+from entities.Chat import Chat
+from entities.ChatStats import ChatStats
+from entities.Message import Message
 from repositories.ChatRepository import ChatRepository
 from services.ChatService import ChatService
-from langchain_openai import OpenAI
-from langchain_core.prompts import PromptTemplate
+from utils.aio import background_loop
+from utils.concurrency import ServerBusy, database_slot
+from utils.llm_scheduler import INTERACTIVE, LLM_TIMEOUT, ON_DEMAND, LLMOverloaded, LLMScheduler, llm_scheduler
+from utils.tokens import prompt_line_tokens, window_start
+import asyncio
 import os
-from dotenv import load_dotenv
-import traceback
+import threading
 import logging
 
+logger = logging.getLogger(__name__)
+
+# Token budgets for the message part of each prompt: the most recent messages that fit are sent
+SUMMARY_PROMPT_TOKENS = int(os.getenv("LLM_SUMMARY_PROMPT_TOKENS", "2500"))
+VALIDATION_PROMPT_TOKENS = int(os.getenv("LLM_VALIDATION_PROMPT_TOKENS", "1000"))
+VALIDATION_MAX_MESSAGES = 25
+
 class SummaryService:
-    def __init__(self, chat_repository: ChatRepository, chat_service: ChatService):
+    def __init__(self, chat_repository: ChatRepository, chat_service: ChatService, llm=None,
+                 scheduler: LLMScheduler = llm_scheduler, relevance=None):
         """
         Initialize SummaryService with required repository and service
         
         Args:
             chat_repository (ChatRepository): Repository for chat operations
             chat_service (ChatService): Service for chat operations
+            llm: LangChain LLM to use; by default an OpenAI client is built on first use
+            scheduler (LLMScheduler): Admission, rate budgets and retries for LLM calls
+            relevance (RelevanceIndex): Local agenda scorer consulted before validating with
+                the LLM; defaults to the process-wide index
         """
-        # Load environment variables from .env file
-        load_dotenv()
-        
         self.chat_repository = chat_repository
         self.chat_service = chat_service
         self.ai_user_id = 'd973e76d-0b64-493b-91ed-f4de8182f53a'  # AI admin user
-        
-        # Initialize OpenAI LLM with API key from .env
-        self.llm = OpenAI(
+        self._llm = llm
+        self.scheduler = scheduler
+        self._relevance = relevance
+        self._llm_lock = threading.Lock()
+
+    @property
+    def llm(self):
+        """The LLM client, created on first use so importing the app stays cheap"""
+        if self._llm is None:
+            with self._llm_lock:
+                if self._llm is None:
+                    self._llm = self._build_llm()
+        return self._llm
+
+    @llm.setter
+    def llm(self, llm):
+        self._llm = llm
+
+    @property
+    def relevance(self):
+        """The relevance index; imported on first use so NumPy stays off the import path"""
+        if self._relevance is None:
+            from utils.relevance import relevance_index
+            self._relevance = relevance_index
+        return self._relevance
+
+    @staticmethod
+    def _build_llm():
+        from langchain_openai import OpenAI
+        from utils.llm_metrics import llm_metrics_callback
+
+        return OpenAI(
             api_key=os.getenv("OPENAI_API_KEY"),
-            model="gpt-3.5-turbo-instruct"
+            model="gpt-3.5-turbo-instruct",
+            callbacks=[llm_metrics_callback],
+            # Retries are the scheduler's job, so they respect its budgets and Retry-After
+            max_retries=0,
+            timeout=LLM_TIMEOUT
         )
 
+    def _read_chat(self, chat_id: str) -> Optional[Chat]:
+        # A concurrency slot for the read only, not for the LLM call that follows
+        with database_slot():
+            return self.chat_repository.get_chat_by_id(chat_id)
+
+    def _read_summary_inputs(self, chat_id: str) -> Tuple[Optional[Chat], Optional[ChatStats]]:
+        """The chat and its stats (both None if it doesn't exist), read under one concurrency slot"""
+        with database_slot():
+            chat = self.chat_repository.get_chat_by_id(chat_id)
+            if not chat:
+                return None, None
+            return chat, self.chat_repository.get_chat_stats(chat_id)
+
     def get_chat_summary(self, chat_id: str) -> Tuple[Optional[Dict], str]:
         """
         Get a concise and engaging summary of a chat using the LLM.
@@ -39,23 +99,61 @@ class SummaryService:
         
         Returns:
             Tuple[Optional[Dict], str]: (Summary dictionary or None, success/error message)
+
+        Raises:
+            LLMOverloaded: The scheduler shed the call
+            ServerBusy: No concurrency slot was free for the database reads
         """
         try:
-            # Retrieve the chat
-            chat = self.chat_repository.get_chat_by_id(chat_id)
+            chat, stats = self._read_summary_inputs(chat_id)
+            if not chat:
+                return None, "Chat not found"
+
+            summary = self.scheduler.invoke(
+                self.llm, self._summary_prompt(chat, stats), INTERACTIVE, config={"tags": ["summary"]}
+            )
+            return self._summary_result(chat_id, chat, summary), "Summary generated successfully"
+        except (LLMOverloaded, ServerBusy):
+            raise
+        except Exception as e:
+            logger.exception("Error generating summary for chat %s", chat_id)
+            return None, f"Error generating summary: {str(e)}"
+
+    async def aget_chat_summary(self, chat_id: str) -> Tuple[Optional[Dict], str]:
+        """Async variant of ``get_chat_summary``: awaits the LLM instead of blocking on it
+
+        The LLM call runs on the shared background loop so the async client's connections
+        outlive the per-request event loop.
+        """
+        try:
+            chat, stats = await asyncio.to_thread(self._read_summary_inputs, chat_id)
             if not chat:
                 return None, "Chat not found"
 
-            # Gather messages into text
-            messages_text = "\n".join([
-                f"{msg.sender_name}: {msg.content}"
-                for msg in chat.messages
-            ])
+            # Summaries are idempotent, so a slow call may be hedged with a duplicate
+            summary = await background_loop.run(self.scheduler.ainvoke(
+                self.llm, self._summary_prompt(chat, stats), INTERACTIVE, hedge=True, config={"tags": ["summary"]}
+            ))
+            return self._summary_result(chat_id, chat, summary), "Summary generated successfully"
+        except (LLMOverloaded, ServerBusy):
+            raise
+        except Exception as e:
+            logger.exception("Error generating summary for chat %s", chat_id)
+            return None, f"Error generating summary: {str(e)}"
 
-            # Prepare the detailed and structured prompt
-            prompt = PromptTemplate(
-                input_variables=["messages"],
-                template="""
+    def _summary_prompt(self, chat, stats: ChatStats) -> str:
+        from langchain_core.prompts import PromptTemplate
+
+        # Gather the most recent messages that fit the budget into text
+        messages_text = "\n".join([
+            f"{msg.sender_name}: {msg.content}"
+            for msg in self._prompt_window(chat.messages, SUMMARY_PROMPT_TOKENS, "sender_name")
+        ])
+
+        # Prepare the detailed and structured prompt
+        prompt = PromptTemplate(
+            input_variables=["stats", "messages"],
+            template="""
     You are an AI assistant that specializes in summarizing group discussions or chats. You have the following goal:
 
     **Goal**: Produce a concise, well-structured, and engaging summary of the conversation that captures:
@@ -127,41 +225,149 @@ class SummaryService:
     Feel free to adjust the emojis, headings, or bullet points to fit the conversation’s context.
 
     **Input to Summarize**:
-    Chat messages:
+    Chat details and activity statistics (exact figures for the whole chat; use them for the overview,
+    contributions and timing instead of estimating from the messages):
+    {stats}
+
+    Chat messages (the most recent ones):
     {messages}
 
     Provide the summary below:
     """
-            )
+        )
 
-            # Format and invoke the LLM
-            formatted_prompt = prompt.format(messages=messages_text)
-            summary = self.llm.invoke(formatted_prompt)
+        return prompt.format(stats=self._stats_text(chat, stats), messages=messages_text)
+
+    @staticmethod
+    def _stats_text(chat, stats: ChatStats) -> str:
+        lines = [
+            f"- Chat name: {chat.chat_name}",
+            f"- Agenda: {chat.agenda}",
+            f"- Messages: {stats.message_count} from {len(stats.participants)} participants, "
+            f"{stats.average_length:.0f} characters on average",
+        ]
+        if stats.first_message_at:
+            lines.append(f"- Active from {stats.first_message_at:%Y-%m-%d %H:%M} to "
+                         f"{stats.last_message_at:%Y-%m-%d %H:%M} UTC, active on {len(stats.daily)} days")
+        for p in stats.participants:
+            share = 100 * p.message_count / stats.message_count
+            lines.append(f"- {p.sender_name or p.sender_id}: {p.message_count} messages ({share:.0f}%), "
+                         f"{p.average_length:.0f} characters on average")
+        busiest = sorted(range(24), key=lambda hour: -stats.hourly[hour])[:3]
+        hours = ", ".join(f"{hour:02d}:00 ({stats.hourly[hour]})" for hour in busiest if stats.hourly[hour])
+        if hours:
+            lines.append(f"- Busiest hours (UTC): {hours}")
+        return "\n".join(lines)
+
+    @staticmethod
+    def _prompt_window(messages: List[Message], budget: int, sender_field: str) -> List[Message]:
+        """The most recent ``messages`` whose prompt lines fit in ``budget`` tokens
+
+        Uses the token counts stored with each message, so no text is re-tokenized.
+        """
+        counts = [prompt_line_tokens(getattr(msg, sender_field), msg) for msg in messages]
+        return messages[window_start(counts, budget):]
+
+    @staticmethod
+    def _summary_result(chat_id: str, chat, summary: str) -> Dict:
+        return {
+            "chat_id": chat_id,
+            "message_count": chat.message_count,
+            "summary": summary
+        }
+
+    def validate_chat_context(self, chat_id: str, priority: int = ON_DEMAND) -> Tuple[Optional[Dict], str]:
+        """
+        Decide whether recent messages follow the agenda and post a reminder if not.
 
-            return {
-                "chat_id": chat_id,
-                "message_count": len(chat.messages),
-                "summary": summary
-            }, "Summary generated successfully"
-        except Exception as e:
-            traceback.print_tb(e.__traceback__)
-            return None, f"Error generating summary: {str(e)}"
+        Windows the local relevance scorer is sure about are decided without the LLM;
+        only ambiguous ones are sent to it.
 
+        Args:
+            chat_id (str): ID of the chat to validate
+            priority (int): Scheduler priority; BACKGROUND for checks nobody is waiting on
 
-    def validate_chat_context(self, chat_id: str) -> Tuple[Optional[Dict], str]:
+        Raises:
+            LLMOverloaded: The scheduler shed the call
+            ServerBusy: No concurrency slot was free for the database work
+        """
         try:
-            chat = self.chat_repository.get_chat_by_id(chat_id)
+            chat = self._read_chat(chat_id)
             if not chat:
                 return None, "Chat not found"
 
-            messages_text = "\n".join([
-                f"{msg.sender_id}: {msg.content}" 
-                for msg in chat.messages[-25:]
-            ])
+            result = self._local_validation(chat)
+            if result is None:
+                response = self.scheduler.invoke(
+                    self.llm, self._validation_prompt(chat), priority, config={"tags": ["validation"]}
+                )
+                result = self._validation_result(chat, response)
+                self.relevance.record_escalation(result["is_on_topic"])
+
+            if not result["is_on_topic"]:
+                self._send_reminder(chat)
+
+            return result, "Context validation complete"
 
-            prompt = PromptTemplate(
-                input_variables=["chat_name", "agenda", "messages"],
-                template="""
+        except (LLMOverloaded, ServerBusy):
+            raise
+        except Exception as e:
+            logger.exception("Error validating chat context for chat %s", chat_id)
+            return None, f"Error validating chat context: {str(e)}"
+
+    async def avalidate_chat_context(self, chat_id: str, priority: int = ON_DEMAND) -> Tuple[Optional[Dict], str]:
+        """Async variant of ``validate_chat_context``: awaits the LLM instead of blocking on it"""
+        try:
+            chat = await asyncio.to_thread(self._read_chat, chat_id)
+            if not chat:
+                return None, "Chat not found"
+
+            result = self._local_validation(chat)
+            if result is None:
+                response = await background_loop.run(self.scheduler.ainvoke(
+                    self.llm, self._validation_prompt(chat), priority, config={"tags": ["validation"]}
+                ))
+                result = self._validation_result(chat, response)
+                self.relevance.record_escalation(result["is_on_topic"])
+
+            if not result["is_on_topic"]:
+                await asyncio.to_thread(self._send_reminder, chat)
+
+            return result, "Context validation complete"
+
+        except (LLMOverloaded, ServerBusy):
+            raise
+        except Exception as e:
+            logger.exception("Error validating chat context for chat %s", chat_id)
+            return None, f"Error validating chat context: {str(e)}"
+
+    def _local_validation(self, chat) -> Optional[Dict]:
+        """The validation result when the local relevance score settles it, else None"""
+        is_on_topic, score = self.relevance.decide(chat, skip_senders={self.ai_user_id})
+        if is_on_topic is None:
+            return None
+        # Same layout as the LLM's answer so clients can parse either
+        details = (
+            f"1. Is_On_Topic: {'Yes' if is_on_topic else 'No'}\n"
+            f"2. Confidence: {round((score if is_on_topic else 1 - score) * 100)}%\n"
+            f"3. Analysis: Decided locally from the agenda relevance score ({score:.2f}) "
+            "of the recent messages.\n"
+            "4. Off_Topic_Examples: none"
+        )
+        return self._validation_result(chat, details)
+
+    def _validation_prompt(self, chat) -> str:
+        from langchain_core.prompts import PromptTemplate
+
+        recent = chat.messages[-VALIDATION_MAX_MESSAGES:]
+        messages_text = "\n".join([
+            f"{msg.sender_id}: {msg.content}"
+            for msg in self._prompt_window(recent, VALIDATION_PROMPT_TOKENS, "sender_id")
+        ])
+
+        prompt = PromptTemplate(
+            input_variables=["chat_name", "agenda", "messages"],
+            template="""
                 Analyze if the following chat messages align with the chat agenda.
                 Chat Name: {chat_name}
                 Chat Agenda: {agenda}
@@ -173,39 +379,35 @@ class SummaryService:
                 3. Analysis: [brief explanation]
                 4. Off_Topic_Examples: [list specific messages if any]
                 """
-            )
-
-            formatted_prompt = prompt.format(
-                chat_name=chat.chat_name,
-                agenda=chat.agenda,
-                messages=messages_text
-            )
-
-            response = self.llm.invoke(formatted_prompt)
-            
-            # Parse LLM response
-            is_on_topic = 'yes' in response.lower().split('is_on_topic:')[1].split('\n')[0].lower()
-
-            if not is_on_topic:
-                # Send AI reminder message
-                reminder_message = (
-                    "🤖 Friendly reminder: Let's stay focused on our agenda: "
-                    f"'{chat.agenda}'. I noticed some off-topic discussions."
-                )
-                self.chat_service.send_message(
-                    self.ai_user_id,
-                    chat_id,
-                    reminder_message
-                )
+        )
 
-            return {
-                "is_on_topic": is_on_topic,
-                "validation_details": response,
-                "chat_name": chat.chat_name,
-                "message_count": len(chat.messages),
-                "agenda": chat.agenda
-            }, "Context validation complete"
+        return prompt.format(
+            chat_name=chat.chat_name,
+            agenda=chat.agenda,
+            messages=messages_text
+        )
 
-        except Exception as e:
-            logging.error(f"Error validating chat context: {str(e)}")
-            return None, f"Error validating chat context: {str(e)}"
+    @staticmethod
+    def _validation_result(chat, response: str) -> Dict:
+        # Parse LLM response
+        is_on_topic = 'yes' in response.lower().split('is_on_topic:')[1].split('\n')[0].lower()
+        return {
+            "is_on_topic": is_on_topic,
+            "validation_details": response,
+            "chat_name": chat.chat_name,
+            "message_count": chat.message_count,
+            "agenda": chat.agenda
+        }
+
+    def _send_reminder(self, chat) -> None:
+        """Post an AI reminder to get an off-topic chat back to its agenda"""
+        reminder_message = (
+            "🤖 Friendly reminder: Let's stay focused on our agenda: "
+            f"'{chat.agenda}'. I noticed some off-topic discussions."
+        )
+        with database_slot():
+            self.chat_service.send_message(
+                self.ai_user_id,
+                chat.id,
+                reminder_message
+            )
@@ -0,0 +1,59 @@
+"""Compressed archive blocks for cold messages.
+
+An archive block holds a run of consecutive messages of one chat (by ``seq``) as
+zlib-compressed JSON. Alongside the payload each block stores its aggregates (messages
+and characters per sender, hourly and daily counts), so chat stats never need to
+decompress it.
+"""
+from datetime import datetime
+from typing import Dict, Iterable, List, Tuple
+import json
+import os
+import zlib
+
+ARCHIVE_BLOCK_SIZE = int(os.getenv("ARCHIVE_BLOCK_SIZE", "500"))
+COMPRESSION_LEVEL = 6
+
+FIELDS = ("id", "sender_id", "content", "timestamp", "token_count", "seq")
+
+
+def _timestamp(value) -> str:
+    return value.isoformat(sep=" ") if isinstance(value, datetime) else value
+
+
+def encode_block(rows: Iterable) -> Tuple[bytes, str]:
+    """Compressed payload and aggregates JSON for message rows with the ``FIELDS`` columns"""
+    records = [
+        [row.id, row.sender_id, row.content, _timestamp(row.timestamp), row.token_count, row.seq]
+        for row in rows
+    ]
+    payload = zlib.compress(json.dumps(records, separators=(",", ":")).encode(), COMPRESSION_LEVEL)
+    return payload, json.dumps(block_stats(records), separators=(",", ":"))
+
+
+def decode_block(payload: bytes) -> List[Dict]:
+    """The block's messages as dicts keyed by ``FIELDS``, in ``seq`` order"""
+    messages = []
+    for record in json.loads(zlib.decompress(payload)):
+        message = dict(zip(FIELDS, record))
+        if message["timestamp"]:
+            message["timestamp"] = datetime.fromisoformat(message["timestamp"])
+        messages.append(message)
+    return messages
+
+
+def block_stats(records: List[list]) -> Dict:
+    """Per-sender [messages, characters, first, last] plus hourly and daily message counts"""
+    senders: Dict[str, list] = {}
+    hours = [0] * 24
+    days: Dict[str, int] = {}
+    for _, sender_id, content, timestamp, _, _ in records:
+        entry = senders.setdefault(sender_id, [0, 0, timestamp, timestamp])
+        entry[0] += 1
+        entry[1] += len(content)
+        if timestamp:
+            entry[2] = min(entry[2] or timestamp, timestamp)
+            entry[3] = max(entry[3] or timestamp, timestamp)
+            hours[int(timestamp[11:13])] += 1
+            days[timestamp[:10]] = days.get(timestamp[:10], 0) + 1
+    return {"senders": senders, "hours": hours, "days": days}
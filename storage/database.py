@@ -1,26 +1,107 @@
 import os
+import sqlite3
+import threading
+from typing import Callable, List, Optional
 import sqlalchemy
-from google.cloud.sql.connector import Connector, IPTypes
 
-DB_USER = os.getenv("DB_USER")
-DB_PASS = os.getenv("DB_PASS")
-DB_NAME = os.getenv("DB_NAME")
-INSTANCE_CONNECTION_NAME = os.getenv("INSTANCE_CONNECTION_NAME")
+# The Cloud SQL connector is imported and started on the first connection, not at import
+# time: it is slow to import, and its background thread would not survive a gunicorn fork.
+_connector = None
+_connector_lock = threading.Lock()
+
+
+def get_connector():
+    global _connector
+    with _connector_lock:
+        if _connector is None:
+            from google.cloud.sql.connector import Connector
+            _connector = Connector()
+        return _connector
 
-connector = Connector()
 
 def getconn():
-    conn = connector.connect(
-        INSTANCE_CONNECTION_NAME,
+    from google.cloud.sql.connector import IPTypes
+
+    conn = get_connector().connect(
+        os.getenv("INSTANCE_CONNECTION_NAME"),
         "pymysql",
-        user=DB_USER,
-        password=DB_PASS,
-        db=DB_NAME,
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASS"),
+        db=os.getenv("DB_NAME"),
         ip_type=IPTypes.PUBLIC
     )
     return conn
 
-pool = sqlalchemy.create_engine(
-    "mysql+pymysql://",
-    creator=getconn,
-)
+def create_engine_from_url(url: str) -> sqlalchemy.engine.Engine:
+    """Create an engine for a plain database URL"""
+    if url.startswith("sqlite"):
+        # Let sqlite3 hand back datetimes for TIMESTAMP columns, as MySQL does
+        return sqlalchemy.create_engine(
+            url,
+            connect_args={"detect_types": sqlite3.PARSE_DECLTYPES},
+            native_datetime=True
+        )
+    return sqlalchemy.create_engine(url)
+
+def create_engine_from_env() -> sqlalchemy.engine.Engine:
+    """``DATABASE_URL`` (e.g. sqlite:///gatherly.db) if set, otherwise Cloud SQL via the connector"""
+    database_url = os.getenv("DATABASE_URL")
+    if database_url:
+        return create_engine_from_url(database_url)
+    return sqlalchemy.create_engine("mysql+pymysql://", creator=getconn)
+
+
+class LazyEngine:
+    """Stands in for an Engine and creates the real one on first use.
+
+    Repositories default to the module-level ``pool``; the engine is only built (and the
+    environment only read) when the first query runs. ``on_create`` runs setup such as
+    instrumentation once the engine exists, and ``dispose`` drops pooled connections after
+    a fork.
+    """
+
+    def __init__(self, factory: Callable[[], sqlalchemy.engine.Engine]):
+        self._factory = factory
+        self._engine: Optional[sqlalchemy.engine.Engine] = None
+        self._callbacks: List[Callable] = []
+        self._lock = threading.RLock()
+
+    @property
+    def engine(self) -> sqlalchemy.engine.Engine:
+        engine = self._engine
+        if engine is None:
+            with self._lock:
+                if self._engine is None:
+                    engine = self._factory()
+                    for callback in self._callbacks:
+                        callback(engine)
+                    self._engine = engine
+                engine = self._engine
+        return engine
+
+    @property
+    def created(self) -> bool:
+        return self._engine is not None
+
+    def on_create(self, callback: Callable[[sqlalchemy.engine.Engine], None]) -> None:
+        """Call ``callback(engine)`` when the engine is created, or now if it already exists.
+
+        Registering the same callback again (e.g. from a second app) is a no-op.
+        """
+        with self._lock:
+            if callback in self._callbacks:
+                return
+            self._callbacks.append(callback)
+            if self._engine is not None:
+                callback(self._engine)
+
+    def dispose(self) -> None:
+        """Forget pooled connections inherited from a parent process"""
+        if self._engine is not None:
+            self._engine.dispose(close=False)
+
+    def __getattr__(self, name):
+        return getattr(self.engine, name)
+
+
+pool = LazyEngine(create_engine_from_env)
@@ -0,0 +1,237 @@
+"""Versioned schema migrations for MySQL and SQLite.
+
+Each migration runs in its own transaction and is recorded in ``schema_migrations``.
+Tables are created with IF NOT EXISTS and indexes are only created when missing, so
+the first run against the existing production database adopts the tables already
+there and adds whatever indexes they lack.
+
+Run ``python -m storage.migrations`` to bring the configured database up to date.
+"""
+from typing import Callable, List, Optional, Sequence, Tuple
+import logging
+import sqlalchemy
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+
+def _table_options(conn) -> str:
+    if conn.dialect.name == "mysql":
+        return " ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+    return ""
+
+
+def _autoincrement_pk(conn) -> str:
+    if conn.dialect.name == "sqlite":
+        return "INTEGER PRIMARY KEY AUTOINCREMENT"
+    return "BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY"
+
+
+def _blob(conn) -> str:
+    return "LONGBLOB" if conn.dialect.name == "mysql" else "BLOB"
+
+
+def create_table(conn, name: str, body: str) -> None:
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {name} ({body}){_table_options(conn)}"))
+
+
+def create_index(conn, name: str, table: str, columns: Sequence[str], unique: bool = False) -> None:
+    """Create an index unless one with the same name already exists (MySQL lacks IF NOT EXISTS)"""
+    existing = {index["name"] for index in sqlalchemy.inspect(conn).get_indexes(table)}
+    if name in existing:
+        return
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    conn.execute(text(f"CREATE {kind} {name} ON {table} ({', '.join(columns)})"))
+
+
+def _initial_schema(conn) -> None:
+    create_table(conn, "users", """
+        id VARCHAR(36) NOT NULL PRIMARY KEY,
+        email VARCHAR(255) NOT NULL,
+        name VARCHAR(255) NOT NULL,
+        password_hash VARCHAR(255) NULL,
+        google_id VARCHAR(255) NULL,
+        created_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP
+    """)
+    create_table(conn, "chats", """
+        id VARCHAR(64) NOT NULL PRIMARY KEY,
+        admin_id VARCHAR(36) NOT NULL,
+        chat_name VARCHAR(255) NOT NULL,
+        agenda TEXT,
+        created_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP
+    """)
+    create_table(conn, "chat_participants", """
+        chat_id VARCHAR(64) NOT NULL,
+        user_id VARCHAR(36) NOT NULL,
+        PRIMARY KEY (chat_id, user_id)
+    """)
+    create_table(conn, "messages", f"""
+        id {_autoincrement_pk(conn)},
+        chat_id VARCHAR(64) NOT NULL,
+        sender_id VARCHAR(36) NOT NULL,
+        content TEXT NOT NULL,
+        timestamp TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP
+    """)
+
+
+def _hot_path_indexes(conn) -> None:
+    # messages WHERE chat_id = ? ORDER BY timestamp
+    create_index(conn, "ix_messages_chat_timestamp", "messages", ["chat_id", "timestamp", "id"])
+    # chat_participants WHERE user_id = ?  (the primary key leads with chat_id)
+    create_index(conn, "ix_chat_participants_user", "chat_participants", ["user_id", "chat_id"])
+    # users WHERE email = ?
+    create_index(conn, "ux_users_email", "users", ["email"], unique=True)
+
+
+def _search_index(conn) -> None:
+    create_table(conn, "message_terms", """
+        term VARCHAR(64) NOT NULL,
+        chat_id VARCHAR(64) NOT NULL,
+        message_id BIGINT NOT NULL,
+        tf INT NOT NULL,
+        PRIMARY KEY (message_id, term)
+    """)
+    create_index(conn, "ix_message_terms_term", "message_terms", ["term", "chat_id", "message_id"])
+    create_index(conn, "ix_message_terms_chat", "message_terms", ["chat_id", "message_id"])
+
+
+def _message_counter(conn) -> None:
+    columns = {column["name"] for column in sqlalchemy.inspect(conn).get_columns("chats")}
+    if "message_count" not in columns:
+        conn.execute(text("ALTER TABLE chats ADD COLUMN message_count INT NOT NULL DEFAULT 0"))
+    conn.execute(text("""
+        UPDATE chats SET message_count = (
+            SELECT COUNT(*) FROM messages WHERE messages.chat_id = chats.id
+        )
+    """))
+
+
+def _message_token_counts(conn) -> None:
+    # Filled in when a message is written; NULL for older messages, which are counted on read
+    columns = {column["name"] for column in sqlalchemy.inspect(conn).get_columns("messages")}
+    if "token_count" not in columns:
+        conn.execute(text("ALTER TABLE messages ADD COLUMN token_count INT NULL"))
+
+
+# Number each chat's existing messages 1..n in timestamp order, matching message_count
+_BACKFILL_MESSAGE_SEQ = {
+    "mysql": """
+        UPDATE messages m
+        JOIN (
+            SELECT id, ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY timestamp, id) AS seq
+            FROM messages
+        ) numbered ON numbered.id = m.id
+        SET m.seq = numbered.seq
+    """,
+    "sqlite": """
+        UPDATE messages SET seq = numbered.seq
+        FROM (
+            SELECT id, ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY timestamp, id) AS seq
+            FROM messages
+        ) AS numbered
+        WHERE numbered.id = messages.id
+    """,
+}
+
+
+def _read_cursors(conn) -> None:
+    # messages.seq is the chat's message_count right after the message was added, so a
+    # participant's unread count is chats.message_count - chat_participants.last_read_seq
+    message_columns = {column["name"] for column in sqlalchemy.inspect(conn).get_columns("messages")}
+    if "seq" not in message_columns:
+        conn.execute(text("ALTER TABLE messages ADD COLUMN seq INT NULL"))
+    conn.execute(text(_BACKFILL_MESSAGE_SEQ[conn.dialect.name]))
+    create_index(conn, "ix_messages_chat_seq", "messages", ["chat_id", "seq"])
+
+    participant_columns = {column["name"] for column in sqlalchemy.inspect(conn).get_columns("chat_participants")}
+    if "last_read_seq" not in participant_columns:
+        conn.execute(text("ALTER TABLE chat_participants ADD COLUMN last_read_seq INT NOT NULL DEFAULT 0"))
+    if "last_read_message_id" not in participant_columns:
+        conn.execute(text("ALTER TABLE chat_participants ADD COLUMN last_read_message_id BIGINT NULL"))
+
+
+def _soft_delete(conn) -> None:
+    # Deleted chats are hidden at once and their rows purged later in small batches
+    columns = {column["name"] for column in sqlalchemy.inspect(conn).get_columns("chats")}
+    if "deleted_at" not in columns:
+        conn.execute(text("ALTER TABLE chats ADD COLUMN deleted_at TIMESTAMP NULL"))
+    create_index(conn, "ix_chats_deleted_at", "chats", ["deleted_at"])
+
+
+def _message_archive(conn) -> None:
+    # Cold messages move here in compressed blocks (storage/archive.py); chats.archived_seq
+    # is the last seq archived, so messages with a higher seq are still in the hot table
+    create_table(conn, "message_archive_blocks", f"""
+        id {_autoincrement_pk(conn)},
+        chat_id VARCHAR(64) NOT NULL,
+        first_seq INT NOT NULL,
+        last_seq INT NOT NULL,
+        first_message_id BIGINT NOT NULL,
+        last_message_id BIGINT NOT NULL,
+        message_count INT NOT NULL,
+        payload {_blob(conn)} NOT NULL,
+        stats TEXT NOT NULL,
+        created_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP
+    """)
+    create_index(conn, "ix_archive_blocks_chat_seq", "message_archive_blocks", ["chat_id", "last_seq"])
+    create_index(conn, "ix_archive_blocks_chat_message", "message_archive_blocks", ["chat_id", "last_message_id"])
+    columns = {column["name"] for column in sqlalchemy.inspect(conn).get_columns("chats")}
+    if "archived_seq" not in columns:
+        conn.execute(text("ALTER TABLE chats ADD COLUMN archived_seq INT NOT NULL DEFAULT 0"))
+
+
+# (version, description, upgrade) in the order they must be applied
+MIGRATIONS: List[Tuple[int, str, Callable]] = [
+    (1, "initial schema", _initial_schema),
+    (2, "hot-path composite indexes", _hot_path_indexes),
+    (3, "message search index", _search_index),
+    (4, "per-chat message counter", _message_counter),
+    (5, "per-message token counts", _message_token_counts),
+    (6, "per-participant read cursors", _read_cursors),
+    (7, "soft-deleted chats", _soft_delete),
+    (8, "compressed message archive", _message_archive),
+]
+
+
+def _ensure_version_table(engine) -> None:
+    with engine.begin() as conn:
+        create_table(conn, "schema_migrations", """
+            version INT NOT NULL PRIMARY KEY,
+            description VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP
+        """)
+
+
+def current_version(engine) -> int:
+    """Highest applied migration version, 0 for an empty database"""
+    _ensure_version_table(engine)
+    with engine.connect() as conn:
+        version = conn.execute(text("SELECT MAX(version) FROM schema_migrations")).scalar()
+    return version or 0
+
+
+def migrate(engine, target: Optional[int] = None) -> List[int]:
+    """Apply pending migrations up to ``target`` (default: latest) and return the versions applied"""
+    applied = []
+    version = current_version(engine)
+    for number, description, upgrade in MIGRATIONS:
+        if number <= version or (target is not None and number > target):
+            continue
+        logger.info("Applying migration %s: %s", number, description)
+        # MySQL commits DDL implicitly, so the version row is written right after each step
+        with engine.begin() as conn:
+            upgrade(conn)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, description) VALUES (:version, :description)"),
+                {"version": number, "description": description}
+            )
+        applied.append(number)
+    return applied
+
+
+if __name__ == "__main__":
+    from storage.database import pool
+
+    logging.basicConfig(level=logging.INFO)
+    versions = migrate(pool)
+    print(f"Applied migrations: {versions}" if versions else "Schema is up to date")
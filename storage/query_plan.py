@@ -0,0 +1,58 @@
+"""Capture the SQL a block of code runs and flag statements whose plan scans a whole table."""
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple
+import re
+from sqlalchemy import event
+
+_EXPLAINABLE = ("SELECT", "UPDATE", "DELETE", "WITH")
+_SQLITE_SCAN = re.compile(r"^SCAN (\w+)(.*)$")
+_SQLITE_SUBQUERY = re.compile(r"^(?:CO-ROUTINE|MATERIALIZE) (\w+)")
+
+
+@contextmanager
+def capture_statements(engine) -> Iterator[List[Tuple[str, object]]]:
+    """Record (statement, parameters) for every cursor execution on ``engine`` inside the block"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # An executemany is one round trip; keep the first parameter set for EXPLAIN
+        statements.append((statement, parameters[0] if executemany else parameters))
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def _sqlite_full_scans(conn, statement: str, parameters) -> List[str]:
+    rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+    details = [row[-1] for row in rows]
+    # Derived tables from subqueries show up as SCAN too; those are fine
+    derived = {m.group(1) for m in map(_SQLITE_SUBQUERY.match, details) if m}
+    scans = []
+    for detail in details:
+        match = _SQLITE_SCAN.match(detail)
+        if match and match.group(1) not in derived and "INDEX" not in match.group(2):
+            scans.append(detail)
+    return scans
+
+
+def _mysql_full_scans(conn, statement: str, parameters) -> List[str]:
+    result = conn.exec_driver_sql(f"EXPLAIN {statement}", parameters)
+    return [
+        f"{row.table}: type=ALL" for row in result
+        if row.type == "ALL" and row.table and not row.table.startswith("<")
+    ]
+
+
+def full_table_scans(engine, statement: str, parameters) -> List[str]:
+    """EXPLAIN ``statement`` and describe every full table scan in its plan (empty when none)"""
+    if not statement.lstrip().upper().startswith(_EXPLAINABLE):
+        return []
+    with engine.connect() as conn:
+        if engine.dialect.name == "sqlite":
+            return _sqlite_full_scans(conn, statement, parameters)
+        if engine.dialect.name == "mysql":
+            return _mysql_full_scans(conn, statement, parameters)
+    raise NotImplementedError(f"No plan check for dialect {engine.dialect.name}")
@@ -0,0 +1,100 @@
+"""SQLAlchemy Core table definitions for the application schema.
+
+The repositories build their statements from these tables once, at import, so each
+statement is compiled once per dialect and then served from SQLAlchemy's compiled cache.
+Types carry their dialect variants (BIGINT auto-increment keys on MySQL, LONGBLOB
+payloads), so ``metadata.create_all`` creates the same schema on MySQL and SQLite as the
+migrations in ``storage/migrations.py``; ``tests/test_schema.py`` keeps the two in step.
+"""
+from sqlalchemy import (BigInteger, Column, Index, Integer, LargeBinary, MetaData, PrimaryKeyConstraint, String, Table,
+                        Text, TIMESTAMP, func, text)
+from sqlalchemy.dialects import mysql
+
+metadata = MetaData()
+
+# SQLite only auto-increments an INTEGER PRIMARY KEY (and never reuses ids with sqlite_autoincrement)
+_AutoIncrementId = BigInteger().with_variant(Integer, "sqlite")
+_MYSQL_OPTIONS = {"mysql_engine": "InnoDB", "mysql_charset": "utf8mb4"}
+
+users = Table(
+    "users", metadata,
+    Column("id", String(36), primary_key=True),
+    Column("email", String(255), nullable=False),
+    Column("name", String(255), nullable=False),
+    Column("password_hash", String(255)),
+    Column("google_id", String(255)),
+    Column("created_at", TIMESTAMP, server_default=func.current_timestamp()),
+    Index("ux_users_email", "email", unique=True),
+    **_MYSQL_OPTIONS
+)
+
+chats = Table(
+    "chats", metadata,
+    Column("id", String(64), primary_key=True),
+    Column("admin_id", String(36), nullable=False),
+    Column("chat_name", String(255), nullable=False),
+    Column("agenda", Text),
+    Column("created_at", TIMESTAMP, server_default=func.current_timestamp()),
+    Column("message_count", Integer, nullable=False, server_default=text("0")),
+    Column("deleted_at", TIMESTAMP),
+    # Last seq moved into message_archive_blocks
+    Column("archived_seq", Integer, nullable=False, server_default=text("0")),
+    Index("ix_chats_deleted_at", "deleted_at"),
+    **_MYSQL_OPTIONS
+)
+
+chat_participants = Table(
+    "chat_participants", metadata,
+    Column("chat_id", String(64), primary_key=True),
+    Column("user_id", String(36), primary_key=True),
+    Column("last_read_seq", Integer, nullable=False, server_default=text("0")),
+    Column("last_read_message_id", BigInteger),
+    Index("ix_chat_participants_user", "user_id", "chat_id"),
+    **_MYSQL_OPTIONS
+)
+
+messages = Table(
+    "messages", metadata,
+    Column("id", _AutoIncrementId, primary_key=True, autoincrement=True),
+    Column("chat_id", String(64), nullable=False),
+    Column("sender_id", String(36), nullable=False),
+    Column("content", Text, nullable=False),
+    Column("timestamp", TIMESTAMP, server_default=func.current_timestamp()),
+    Column("token_count", Integer),
+    # The chat's message_count right after this message was added
+    Column("seq", Integer),
+    Index("ix_messages_chat_timestamp", "chat_id", "timestamp", "id"),
+    Index("ix_messages_chat_seq", "chat_id", "seq"),
+    sqlite_autoincrement=True,
+    **_MYSQL_OPTIONS
+)
+
+message_terms = Table(
+    "message_terms", metadata,
+    Column("term", String(64), nullable=False),
+    Column("chat_id", String(64), nullable=False),
+    Column("message_id", BigInteger, nullable=False),
+    Column("tf", Integer, nullable=False),
+    PrimaryKeyConstraint("message_id", "term"),
+    Index("ix_message_terms_term", "term", "chat_id", "message_id"),
+    Index("ix_message_terms_chat", "chat_id", "message_id"),
+    **_MYSQL_OPTIONS
+)
+
+message_archive_blocks = Table(
+    "message_archive_blocks", metadata,
+    Column("id", _AutoIncrementId, primary_key=True, autoincrement=True),
+    Column("chat_id", String(64), nullable=False),
+    Column("first_seq", Integer, nullable=False),
+    Column("last_seq", Integer, nullable=False),
+    Column("first_message_id", BigInteger, nullable=False),
+    Column("last_message_id", BigInteger, nullable=False),
+    Column("message_count", Integer, nullable=False),
+    Column("payload", LargeBinary().with_variant(mysql.LONGBLOB, "mysql"), nullable=False),
+    Column("stats", Text, nullable=False),
+    Column("created_at", TIMESTAMP, server_default=func.current_timestamp()),
+    Index("ix_archive_blocks_chat_seq", "chat_id", "last_seq"),
+    Index("ix_archive_blocks_chat_message", "chat_id", "last_message_id"),
+    sqlite_autoincrement=True,
+    **_MYSQL_OPTIONS
+)
@@ -0,0 +1,138 @@
+import os
+import tempfile
+import uuid
+from contextlib import contextmanager
+
+import pytest
+
+# Point the storage layer at a throwaway SQLite database before any repository is imported
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "gatherly-test.db"))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+# Cheap, in-thread bcrypt keeps auth tests fast
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("HASH_POOL_WORKERS", "0")
+
+from langchain_core.language_models.fake import FakeListLLM  # noqa: E402
+
+from entities.Chat import Chat  # noqa: E402
+from entities.Message import Message  # noqa: E402
+from entities.User import User  # noqa: E402
+from repositories.ChatRepository import ChatRepository  # noqa: E402
+from repositories.UserRepository import UserRepository  # noqa: E402
+from storage.database import pool  # noqa: E402
+from storage.migrations import migrate  # noqa: E402
+from storage.query_plan import capture_statements  # noqa: E402
+from utils.auth import create_token  # noqa: E402
+from utils.llm_metrics import llm_metrics_callback  # noqa: E402
+
+APP_TABLES = ("message_archive_blocks", "message_terms", "messages", "chat_participants", "chats", "users")
+
+ON_TOPIC_RESPONSE = """
+1. Is_On_Topic: Yes
+2. Confidence: 90%
+3. Analysis: The discussion follows the agenda.
+4. Off_Topic_Examples: none
+"""
+
+
+@pytest.fixture(scope="session")
+def database():
+    migrate(pool)
+    return pool.engine
+
+
+@pytest.fixture
+def clean_database(database):
+    with database.begin() as conn:
+        for table in APP_TABLES:
+            conn.exec_driver_sql(f"DELETE FROM {table}")
+    return database
+
+
+@pytest.fixture
+def fake_llm():
+    """A canned local LLM to use instead of the OpenAI client"""
+    return FakeListLLM(responses=[ON_TOPIC_RESPONSE], callbacks=[llm_metrics_callback])
+
+
+@pytest.fixture
+def app(clean_database, fake_llm):
+    from app import create_app
+
+    return create_app({"TESTING": True, "CHAT_REAPER": False, "RATE_LIMITS": False}, llm=fake_llm)
+
+
+@pytest.fixture
+def services(app):
+    """The app's repositories and services (services.AppServices)"""
+    return app.extensions["gatherly"]
+
+
+@pytest.fixture
+def client(app):
+    with app.test_client() as client:
+        yield client
+
+
+@pytest.fixture
+def make_user(clean_database):
+    """Create a user and return (user, Authorization headers)"""
+    def make(name="Alice"):
+        user = User(id=str(uuid.uuid4()), email=f"{uuid.uuid4()}@example.com", name=name, password_hash="x")
+        UserRepository().save_user(user)
+        return user, {"Authorization": f"Bearer {create_token(user.id)}"}
+    return make
+
+
+@pytest.fixture
+def create_chat(client):
+    """Create a chat through the API as ``user`` and return its id"""
+    def create(user, headers, chat_name="Trip", agenda="Plan"):
+        response = client.post('/api/chats/create',
+                               json={'creator_id': user.id, 'chat_name': chat_name, 'agenda': agenda},
+                               headers=headers)
+        assert response.status_code == 201, response.json
+        return response.json['chat']['id']
+    return create
+
+
+@pytest.fixture
+def send_message(client):
+    """Post a message through the API as ``user`` and return the response"""
+    def send(chat_id, user, headers, content="coorg"):
+        return client.post(f'/api/chats/{chat_id}/messages', json={'user_id': user.id, 'content': content},
+                           headers=headers)
+    return send
+
+
+@pytest.fixture
+def make_chat(make_user):
+    """Save a chat and its messages straight through a ChatRepository, bypassing the API;
+    returns (repository, chat_id)"""
+    def make(contents=(), user=None, repository=None):
+        if user is None:
+            user, _ = make_user()
+        repository = repository or ChatRepository()
+        chat = Chat(id=str(uuid.uuid4()), admin_id=user.id, chat_name="Trip", agenda="Plan",
+                    created_at=None, participants=[user.id])
+        repository.save_chat(chat)
+        for content in contents:
+            repository.add_message(chat.id, Message(sender_id=user.id, content=content))
+        return repository, chat.id
+    return make
+
+
+@pytest.fixture
+def max_queries(database):
+    """Assert that the block issues at most ``n`` SQL statements::
+
+        with max_queries(2):
+            client.post(...)
+    """
+    @contextmanager
+    def check(n):
+        with capture_statements(database) as statements:
+            yield statements
+        executed = "\n".join(" ".join(statement.split()) for statement, _ in statements)
+        assert len(statements) <= n, f"expected at most {n} queries, got {len(statements)}:\n{executed}"
+    return check
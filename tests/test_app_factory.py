@@ -0,0 +1,56 @@
+import json
+import os
+import subprocess
+import sys
+
+import sqlalchemy
+
+from storage.database import pool
+from storage.migrations import migrate
+
+PROBE = """
+import json, sys
+import wsgi
+from storage.database import pool
+print(json.dumps({
+    "engine_created": pool.created,
+    "loaded": [name for name in ("langchain_openai", "google.cloud.sql.connector") if name in sys.modules],
+}))
+"""
+
+
+def test_importing_the_app_does_no_eager_initialization():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output([sys.executable, "-c", PROBE], cwd=root, text=True,
+                                     env=dict(os.environ, PYTHONPATH=root))
+    state = json.loads(output.strip().splitlines()[-1])
+    assert state == {"engine_created": False, "loaded": []}
+
+
+def test_create_app_injects_the_llm(app, services, fake_llm):
+    assert services.summary_service.llm is fake_llm
+
+
+def test_apps_keep_their_own_engine_and_llm(app, services, fake_llm, make_user):
+    from app import create_app
+
+    user, headers = make_user()
+    engine = sqlalchemy.create_engine("sqlite://", poolclass=sqlalchemy.pool.StaticPool)
+    migrate(engine)
+    callbacks = len(pool._callbacks)
+    other = create_app({"TESTING": True, "CHAT_REAPER": False, "RATE_LIMITS": False}, engine=engine)
+
+    with app.test_client() as client:
+        assert client.post('/api/chats/create', json={'creator_id': user.id, 'chat_name': 'Trip', 'agenda': 'Plan'},
+                           headers=headers).status_code == 201
+        assert len(client.get(f'/api/chats/user/{user.id}/chats', headers=headers).json['chats']) == 1
+
+    # The second app reads its own (empty) database; the first keeps its engine and LLM
+    assert other.extensions["gatherly"].chat_repository.engine is engine
+    assert other.test_client().get(f'/api/chats/user/{user.id}/chats', headers=headers).json == {'chats': []}
+    assert services.chat_repository.engine is pool and pool.created
+    assert services.summary_service.llm is fake_llm
+    # Built on first use, not borrowed from the first app
+    assert other.extensions["gatherly"].summary_service._llm is None
+    assert len(pool._callbacks) == callbacks
+    engine.dispose()
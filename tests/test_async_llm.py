@@ -0,0 +1,104 @@
+import asyncio
+
+import httpx
+
+from benchmarks.fake_llm import SlowFakeLLM
+from benchmarks.fake_openai import FakeOpenAIServer
+from utils.aio import background_loop
+from utils.asgi import AsgiApp
+
+
+def test_async_summary_reuses_the_openai_client_across_requests(client, services, make_user, create_chat,
+                                                                monkeypatch):
+    """Each async view runs on its own event loop; the LLM client must survive that"""
+    summary_service = services.summary_service
+    server = FakeOpenAIServer(latency=0.01).start()
+    monkeypatch.setenv("OPENAI_API_BASE", server.base_url)
+    monkeypatch.setattr(summary_service, "llm", summary_service._build_llm())
+    user, headers = make_user()
+    chat_id = create_chat(user, headers, 'Trip planning', 'Plan the trip')
+
+    try:
+        for _ in range(3):
+            response = client.get(f'/api/chats/{chat_id}/summary', headers=headers)
+            assert response.status_code == 200
+            assert 'llm;dur=' in response.headers['Server-Timing']
+            assert '"1 calls"' in response.headers['Server-Timing']
+
+        response = client.get(f'/api/chats/{chat_id}/validate', headers=headers)
+        assert response.status_code == 200
+        assert response.json['is_on_topic'] is True
+    finally:
+        server.shutdown()
+
+
+class CountingLLM(SlowFakeLLM):
+    """Records the most completions awaited at once"""
+
+    active: int = 0
+    peak: int = 0
+
+    async def _acall(self, *args, **kwargs):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            return await super()._acall(*args, **kwargs)
+        finally:
+            self.active -= 1
+
+
+def test_asgi_keeps_more_llm_calls_in_flight_than_threads(app, services, make_user, create_chat, send_message,
+                                                          monkeypatch):
+    llm = CountingLLM(latency=0.3)
+    monkeypatch.setattr(services.summary_service, "llm", llm)
+    user, headers = make_user()
+    chat_id = create_chat(user, headers)
+    send_message(chat_id, user, headers)
+    asgi = AsgiApp(app, threads=2)
+
+    async def requests():
+        # The async views' database reads share the two threads through to_thread
+        asyncio.get_running_loop().set_default_executor(asgi.executor)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=asgi), base_url="http://test") as client:
+            health = await client.get('/api/chats/health')
+            responses = await asyncio.gather(*(
+                client.get(f'/api/chats/{chat_id}/summary', headers=headers) for _ in range(8)
+            ))
+        return health, responses
+
+    health, responses = asyncio.run(requests())
+
+    assert health.status_code == 200 and 'total;dur=' in health.headers['Server-Timing']
+    assert [response.status_code for response in responses] == [200] * 8
+    # Each request has its own context, although the test client left one active here
+    assert len({response.headers['X-Request-ID'] for response in responses}) == 8
+    assert all('llm;dur=' in response.headers['Server-Timing'] for response in responses)
+    # All eight wait on the LLM at once, although only two threads serve the app
+    assert llm.peak == 8
+
+
+def test_asgi_lifespan_adopts_the_server_loop_for_llm_calls(app, services, make_user, create_chat, monkeypatch):
+    monkeypatch.setattr(services.summary_service, "llm", SlowFakeLLM())
+    user, headers = make_user()
+    chat_id = create_chat(user, headers)
+    asgi = AsgiApp(app, threads=2)
+
+    async def serve():
+        messages = iter([{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}])
+        sent = []
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            sent.append(message["type"])
+
+        await asgi({"type": "lifespan"}, receive, send)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=asgi), base_url="http://test") as client:
+            response = await client.get(f'/api/chats/{chat_id}/summary', headers=headers)
+        return sent, response, background_loop._loop is asyncio.get_running_loop()
+
+    sent, response, adopted = asyncio.run(serve())
+    assert sent == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+    assert response.status_code == 200
+    assert adopted
@@ -0,0 +1,114 @@
+import time
+import uuid
+
+from entities.User import User
+from middleware import auth
+from middleware.auth import Identity, TokenCache
+from repositories.UserRepository import UserRepository
+from utils import auth as utils_auth
+from utils.auth import PasswordHasher, _bcrypt_hash, password_needs_rehash
+
+
+def test_token_cache_drops_expired_entries():
+    cache = TokenCache(maxsize=10)
+    cache.put("fresh", {"user_id": "a", "exp": time.time() + 60})
+    cache.put("stale", {"user_id": "b", "exp": time.time() - 1})
+    # Tokens without an expiry are never cached
+    cache.put("forever", {"user_id": "c"})
+
+    assert cache.get("fresh")["user_id"] == "a"
+    assert cache.get("stale") is None
+    assert cache.get("forever") is None
+    assert len(cache) == 1
+
+
+def test_token_cache_evicts_least_recently_used():
+    cache = TokenCache(maxsize=2)
+    expires = time.time() + 60
+    cache.put("a", {"user_id": "a", "exp": expires})
+    cache.put("b", {"user_id": "b", "exp": expires})
+    cache.get("a")
+    cache.put("c", {"user_id": "c", "exp": expires})
+
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("a")["user_id"] == "a"
+    assert cache.get("c")["user_id"] == "c"
+
+
+def test_identity_loads_the_user_on_first_access_only():
+    loads = []
+
+    def load(user_id):
+        loads.append(user_id)
+        return "user-" + user_id
+
+    identity = Identity("u1", {"user_id": "u1"}, load)
+    assert loads == []
+
+    assert identity.user == "user-u1"
+    assert identity.user == "user-u1"
+    assert loads == ["u1"]
+
+
+def test_requests_reuse_verified_tokens_and_skip_the_user_lookup(client, services, make_user, monkeypatch):
+    user, headers = make_user()
+    verified, loaded = [], []
+    verify_token = auth.verify_token
+    monkeypatch.setattr(auth, "token_cache", TokenCache())
+    monkeypatch.setattr(auth, "verify_token", lambda token: verified.append(token) or verify_token(token))
+    monkeypatch.setattr(services.user_repository, "get_user_by_id", lambda user_id: loaded.append(user_id))
+
+    for _ in range(3):
+        assert client.get(f'/api/chats/user/{user.id}/chats', headers=headers).status_code == 200
+
+    assert len(verified) == 1
+    # No handler on this path reads identity.user
+    assert loaded == []
+    assert client.get(f'/api/chats/user/{user.id}/chats',
+                      headers={"Authorization": "Bearer not-a-token"}).status_code == 401
+
+
+def test_password_hashing_runs_in_the_process_pool():
+    hasher = PasswordHasher(rounds=4, max_workers=1)
+    try:
+        hashed = hasher.hash("s3cret")
+        assert hashed.startswith("$2b$04$")
+        assert hasher.verify("s3cret", hashed)
+        assert not hasher.verify("wrong", hashed)
+        assert hasher._executor is not None
+    finally:
+        hasher.shutdown()
+
+
+def test_saturated_hash_pool_returns_503(client, monkeypatch):
+    hasher = PasswordHasher(rounds=4, max_workers=0, max_pending=1)
+    monkeypatch.setattr(utils_auth, "password_hasher", hasher)
+
+    assert hasher._slots.acquire(blocking=False)
+    try:
+        response = client.post('/api/auth/register',
+                               json={'email': f'{uuid.uuid4()}@example.com', 'password': 'pw', 'name': 'Alice'})
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+    finally:
+        hasher._slots.release()
+
+    response = client.post('/api/auth/register',
+                           json={'email': f'{uuid.uuid4()}@example.com', 'password': 'pw', 'name': 'Alice'})
+    assert response.status_code == 201
+
+
+def test_login_upgrades_hashes_with_an_outdated_work_factor(client, clean_database):
+    repository = UserRepository()
+    user = User(id=str(uuid.uuid4()), email=f"{uuid.uuid4()}@example.com", name="Alice",
+                password_hash=_bcrypt_hash("s3cret", 5))
+    repository.save_user(user)
+
+    response = client.post('/api/auth/login', json={'email': user.email, 'password': 's3cret'})
+    assert response.status_code == 200
+
+    upgraded = repository.get_user_by_email(user.email).password_hash
+    assert upgraded.startswith(f"$2b${utils_auth.BCRYPT_ROUNDS:02d}$")
+    assert not password_needs_rehash(upgraded)
+    assert client.post('/api/auth/login', json={'email': user.email, 'password': 's3cret'}).status_code == 200
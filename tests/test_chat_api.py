@@ -1,74 +1,212 @@
-import pytest
-from app import create_app
 import json
 
-@pytest.fixture
-def client():
-    app = create_app()
-    app.config['TESTING'] = True
-    with app.test_client() as client:
-        yield client
 
-def test_create_chat(client):
+def test_create_chat(client, make_user):
     """Test chat creation"""
-    response = client.post('/api/chats', 
+    user, headers = make_user()
+    response = client.post('/api/chats/create',
         json={
-            'creator_id': 'user1',
-            'chat_id': 'test_chat'
-        }
+            'creator_id': user.id,
+            'chat_name': 'Trip planning',
+            'agenda': 'Plan the Coorg trip'
+        },
+        headers=headers
     )
     assert response.status_code == 201
     data = json.loads(response.data)
     assert 'chat' in data
-    assert data['chat']['id'] == 'test_chat'
+    assert data['chat']['admin_id'] == user.id
+    assert data['chat']['participants'] == [user.id]
 
-def test_join_chat(client):
+
+def test_chat_routes_require_token(client, make_user):
+    """Test that chat routes reject unauthenticated requests"""
+    user, _ = make_user()
+    response = client.post('/api/chats/create',
+        json={'creator_id': user.id, 'chat_name': 'Trip planning', 'agenda': 'Plan the Coorg trip'}
+    )
+    assert response.status_code == 401
+
+
+def test_join_chat(client, make_user, create_chat):
     """Test joining a chat"""
     # First create a chat
-    client.post('/api/chats', 
-        json={
-            'creator_id': 'user1',
-            'chat_id': 'test_chat'
-        }
-    )
-    
+    admin, admin_headers = make_user()
+    chat_id = create_chat(admin, admin_headers)
+
     # Then try to join it
-    response = client.post('/api/chats/test_chat/join',
-        json={'user_id': 'user2'}
+    member, member_headers = make_user('Bob')
+    response = client.post(f'/api/chats/{chat_id}/join',
+        json={'user_id': member.id},
+        headers=member_headers
     )
     assert response.status_code == 200
 
-def test_send_message(client):
+
+def test_send_message(client, make_user, create_chat):
     """Test sending a message"""
-    # Create chat and join
-    client.post('/api/chats', 
-        json={
-            'creator_id': 'user1',
-            'chat_id': 'test_chat'
-        }
-    )
-    
+    user, headers = make_user()
+    chat_id = create_chat(user, headers)
+
     # Send message
-    response = client.post('/api/chats/test_chat/messages',
+    response = client.post(f'/api/chats/{chat_id}/messages',
         json={
-            'user_id': 'user1',
+            'user_id': user.id,
             'content': 'Hello, World!'
-        }
+        },
+        headers=headers
     )
     assert response.status_code == 201
+    assert response.json['validation_triggered'] is False
 
-def test_get_chat(client):
-    """Test getting chat details"""
-    # Create chat
-    client.post('/api/chats', 
-        json={
-            'creator_id': 'user1',
-            'chat_id': 'test_chat'
-        }
+
+def test_every_tenth_message_triggers_validation(client, make_user, create_chat):
+    """Test that context validation runs on every 10th message"""
+    user, headers = make_user()
+    chat_id = create_chat(user, headers)
+
+    for i in range(10):
+        response = client.post(f'/api/chats/{chat_id}/messages',
+            json={'user_id': user.id, 'content': f'Message {i} about the trip'},
+            headers=headers
+        )
+    assert response.json['validation_triggered'] is True
+    assert response.json['validation_result']['is_on_topic'] is True
+
+
+def test_send_message_to_missing_chat(client, make_user):
+    """Test sending a message to a chat that does not exist"""
+    user, headers = make_user()
+    response = client.post('/api/chats/missing/messages',
+        json={'user_id': user.id, 'content': 'Hello?'},
+        headers=headers
     )
-    
+    assert response.status_code == 400
+
+
+def test_get_chat(client, make_user, create_chat, send_message):
+    """Test getting chat details"""
+    user, headers = make_user()
+    chat_id = create_chat(user, headers)
+    send_message(chat_id, user, headers, 'Hello, World!')
+
     # Get chat details
-    response = client.get('/api/chats/test_chat')
+    response = client.get(f'/api/chats/{chat_id}', headers=headers)
     assert response.status_code == 200
     data = json.loads(response.data)
-    assert data['id'] == 'test_chat' 
\ No newline at end of file
+    assert data['id'] == chat_id
+    assert [message['content'] for message in data['messages']] == ['Hello, World!']
+
+
+def test_get_user_chats(client, make_user, create_chat, send_message):
+    """Test listing a user's chats with their last message"""
+    user, headers = make_user()
+    chat_id = create_chat(user, headers)
+    for content in ('first', 'second'):
+        send_message(chat_id, user, headers, content)
+
+    response = client.get(f'/api/chats/user/{user.id}/chats', headers=headers)
+    assert response.status_code == 200
+    chats = response.json['chats']
+    assert len(chats) == 1
+    assert chats[0]['participant_count'] == 1
+    assert chats[0]['last_message'] == 'second'
+
+
+def test_get_chat_stats(client, make_user, create_chat, send_message):
+    """Test per-participant counts and activity histograms"""
+    alice, headers = make_user('Alice')
+    bob, bob_headers = make_user('Bob')
+    chat_id = create_chat(alice, headers)
+    client.post(f'/api/chats/{chat_id}/join', json={'user_id': bob.id}, headers=bob_headers)
+    for user, content in ((alice, 'abcd'), (alice, 'abcdef'), (bob, 'ab')):
+        send_message(chat_id, user, headers, content)
+
+    response = client.get(f'/api/chats/{chat_id}/stats', headers=headers)
+    assert response.status_code == 200
+    stats = response.json
+    assert stats['message_count'] == 3
+    assert stats['average_length'] == 4.0
+    assert [(p['sender_name'], p['message_count'], p['average_length']) for p in stats['participants']] == [
+        ('Alice', 2, 5.0), ('Bob', 1, 2.0)
+    ]
+    assert sum(stats['hourly']) == 3 and len(stats['hourly']) == 24
+    assert [day['message_count'] for day in stats['daily']] == [3]
+    assert stats['first_message_at'] <= stats['last_message_at']
+
+    assert client.get('/api/chats/missing/stats', headers=headers).status_code == 404
+    _, outsider_headers = make_user('Carol')
+    assert client.get(f'/api/chats/{chat_id}/stats', headers=outsider_headers).status_code == 403
+
+
+def test_read_cursor_and_unread_counts(client, make_user, create_chat, send_message):
+    """Test marking messages read, unread counts and fetching the unread delta"""
+    user, headers = make_user()
+    sender, sender_headers = make_user('Bob')
+    outsider, outsider_headers = make_user('Mallory')
+    chat_id = create_chat(user, headers)
+    client.post(f'/api/chats/{chat_id}/join', json={'user_id': sender.id}, headers=sender_headers)
+    for content in ('one', 'two', 'three'):
+        send_message(chat_id, sender, sender_headers, content)
+    ids = [m['id'] for m in client.get(f'/api/chats/{chat_id}/messages', headers=headers).json['messages']]
+
+    chats = client.get(f'/api/chats/user/{user.id}/chats', headers=headers).json['chats']
+    assert chats[0]['unread_count'] == 3
+    # Your own messages are never unread
+    chats = client.get(f'/api/chats/user/{sender.id}/chats', headers=sender_headers).json['chats']
+    assert (chats[0]['unread_count'], chats[0]['last_read_message_id']) == (0, ids[2])
+
+    response = client.post(f'/api/chats/{chat_id}/read', json={'message_id': ids[1]}, headers=headers)
+    assert response.status_code == 200
+    assert response.json['unread_count'] == 1
+
+    # The cursor never moves backwards
+    response = client.post(f'/api/chats/{chat_id}/read', json={'message_id': ids[0]}, headers=headers)
+    assert response.json['unread_count'] == 1
+
+    chats = client.get(f'/api/chats/user/{user.id}/chats', headers=headers).json['chats']
+    assert (chats[0]['unread_count'], chats[0]['last_read_message_id']) == (1, ids[1])
+
+    delta = client.get(f'/api/chats/{chat_id}/messages?after={ids[1]}', headers=headers).json['messages']
+    assert [m['content'] for m in delta] == ['three']
+
+    assert client.post(f'/api/chats/{chat_id}/read', json={'message_id': 999999}, headers=headers).status_code == 404
+    for bad_id in ('abc', str(ids[1]), 1.5, True, None):
+        assert client.post(f'/api/chats/{chat_id}/read', json={'message_id': bad_id}, headers=headers).status_code == 400
+    assert client.post(f'/api/chats/{chat_id}/read', json={'message_id': ids[2]},
+                       headers=outsider_headers).status_code == 403
+
+    # Sending marks the chat read up to your own message
+    send_message(chat_id, user, headers, 'four')
+    chats = client.get(f'/api/chats/user/{user.id}/chats', headers=headers).json['chats']
+    assert chats[0]['unread_count'] == 0
+
+
+def test_user_feed_merges_chats_newest_first(client, make_user, create_chat, send_message):
+    """Test the cross-chat feed and its keyset pagination"""
+    user, headers = make_user()
+    other, other_headers = make_user('Bob')
+    trip = create_chat(user, headers)
+    work = create_chat(user, headers)
+    elsewhere = create_chat(other, other_headers)
+    for chat_id, content in ((trip, 'a1'), (work, 'b1'), (elsewhere, 'x'), (trip, 'a2'), (work, 'b2'), (trip, 'a3')):
+        send_message(chat_id, user, headers, content)
+
+    pages, before = [], None
+    while True:
+        url = f'/api/chats/user/{user.id}/feed?limit=2' + (f'&before={before}' if before else '')
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200
+        pages.append([m['content'] for m in response.json['messages']])
+        before = response.json['next_before']
+        if before is None:
+            break
+
+    assert pages == [['a3', 'b2'], ['a2', 'b1'], ['a1']]
+    assert client.get(f'/api/chats/user/{other.id}/feed', headers=headers).status_code == 403
+
+    # The cursor must be a message in one of the caller's own chats
+    foreign = client.get(f'/api/chats/{elsewhere}/messages', headers=other_headers).json['messages'][0]['id']
+    for before in (foreign, 999999):
+        response = client.get(f'/api/chats/user/{user.id}/feed?before={before}', headers=headers)
+        assert response.status_code == 400
@@ -0,0 +1,40 @@
+from sqlalchemy import text
+
+from repositories.ChatRepository import ChatRepository
+from services.ChatReaper import ChatReaper, reaper_rows
+
+
+def count_rows(database, table, chat_id):
+    with database.connect() as conn:
+        return conn.execute(text(f"SELECT COUNT(*) FROM {table} WHERE chat_id = :chat_id"),
+                            {"chat_id": chat_id}).scalar()
+
+
+def test_deleted_chats_are_hidden_then_purged_in_batches(client, make_user, create_chat, send_message, clean_database):
+    user, headers = make_user()
+    chat_id = create_chat(user, headers)
+    for i in range(5):
+        send_message(chat_id, user, headers, f'coorg {i}')
+
+    assert client.delete(f'/api/chats/{chat_id}', json={'user_id': user.id}, headers=headers).status_code == 200
+
+    # Gone for readers and writers at once, although no rows have been purged yet
+    assert client.get(f'/api/chats/{chat_id}', headers=headers).status_code == 404
+    assert client.get(f'/api/chats/user/{user.id}/chats', headers=headers).json['chats'] == []
+    assert client.get(f'/api/chats/{chat_id}/search?q=coorg', headers=headers).status_code == 403
+    response = send_message(chat_id, user, headers, 'late')
+    assert response.json['error'] == 'Chat not found'
+    assert count_rows(clean_database, "messages", chat_id) == 5
+
+    repository = ChatRepository()
+    assert repository.purge_deleted_chat(chat_id, batch_size=2) == {"message_terms": 2, "messages": 2}
+    assert repository.get_chat_by_id(chat_id, include_messages=False, include_deleted=True).message_count == 3
+
+    purged_before = reaper_rows.value(table="messages")
+    reaper = ChatReaper(repository, batch_size=2, pause=0)
+    assert reaper.run_once() == 1
+    assert reaper_rows.value(table="messages") - purged_before == 3
+    for table in ("messages", "message_terms", "chat_participants"):
+        assert count_rows(clean_database, table, chat_id) == 0
+    assert repository.get_chat_by_id(chat_id, include_deleted=True) is None
+    assert repository.get_deleted_chat_ids() == []
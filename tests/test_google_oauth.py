@@ -0,0 +1,181 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from repositories.UserRepository import UserRepository
+from services.AuthService import AuthService
+from utils.oidc import OIDCProvider
+
+CLIENT_ID = 'test-client'
+
+
+class FakeProvider:
+    """Minimal OpenID provider serving discovery, JWKS and token endpoints on localhost"""
+
+    def __init__(self):
+        self.hits = {'discovery': 0, 'jwks': 0, 'userinfo': 0}
+        self.kid = 'key-1'
+        self.private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        # Form bodies posted to /token, and what the id_token it issues is signed with and claims
+        self.token_requests = []
+        self.issuing_key = None
+        self.issued_claims = {}
+        provider = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/.well-known/openid-configuration':
+                    provider.hits['discovery'] += 1
+                    body = {
+                        'issuer': provider.url,
+                        'authorization_endpoint': provider.url + '/auth',
+                        'token_endpoint': provider.url + '/token',
+                        'userinfo_endpoint': provider.url + '/userinfo',
+                        'jwks_uri': provider.url + '/jwks'
+                    }
+                elif self.path == '/jwks':
+                    provider.hits['jwks'] += 1
+                    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(provider.private_key.public_key()))
+                    jwk.update({'kid': provider.kid, 'alg': 'RS256', 'use': 'sig'})
+                    body = {'keys': [jwk]}
+                elif self.path == '/userinfo':
+                    provider.hits['userinfo'] += 1
+                    body = {}
+                else:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                self.send_json(body)
+
+            def do_POST(self):
+                if self.path != '/token':
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                length = int(self.headers.get('Content-Length', 0))
+                provider.token_requests.append(parse_qs(self.rfile.read(length).decode()))
+                self.send_json({
+                    'access_token': 'access-token',
+                    'token_type': 'Bearer',
+                    'expires_in': 3600,
+                    'id_token': provider.id_token(key=provider.issuing_key, **provider.issued_claims)
+                })
+
+            def send_json(self, body):
+                payload = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def id_token(self, key=None, **overrides):
+        claims = {
+            'iss': self.url,
+            'aud': CLIENT_ID,
+            'sub': 'google-123',
+            'email': 'alice@example.com',
+            'email_verified': True,
+            'given_name': 'Alice',
+            'exp': int(time.time()) + 300
+        }
+        claims.update(overrides)
+        return jwt.encode(claims, key or self.private_key, algorithm='RS256', headers={'kid': self.kid})
+
+
+@pytest.fixture
+def fake_provider():
+    provider = FakeProvider()
+    yield provider
+    provider.server.shutdown()
+
+
+def make_provider(fake_provider, **kwargs):
+    return OIDCProvider(fake_provider.url + '/.well-known/openid-configuration', CLIENT_ID, **kwargs)
+
+
+def test_discovery_document_is_cached(fake_provider):
+    provider = make_provider(fake_provider)
+    for _ in range(5):
+        assert provider.config()['token_endpoint'] == fake_provider.url + '/token'
+    assert fake_provider.hits['discovery'] == 1
+
+
+def test_stale_discovery_document_refreshes_in_background(fake_provider):
+    provider = make_provider(fake_provider, ttl=0)
+    provider.config()
+    # Stale copy is returned immediately while the refresh runs
+    assert provider.config()['issuer'] == fake_provider.url
+    deadline = time.time() + 2
+    while fake_provider.hits['discovery'] < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    assert fake_provider.hits['discovery'] == 2
+
+
+def test_id_token_verified_locally_with_cached_keys(fake_provider):
+    provider = make_provider(fake_provider)
+    for _ in range(3):
+        claims = provider.verify_id_token(fake_provider.id_token())
+        assert claims['email'] == 'alice@example.com'
+    assert fake_provider.hits['jwks'] == 1
+
+
+def test_id_token_with_wrong_audience_is_rejected(fake_provider):
+    provider = make_provider(fake_provider)
+    with pytest.raises(jwt.InvalidAudienceError):
+        provider.verify_id_token(fake_provider.id_token(aud='someone-else'))
+
+
+def test_rotated_signing_key_triggers_jwks_refetch(fake_provider):
+    provider = make_provider(fake_provider, jwks_refetch_interval=0)
+    provider.verify_id_token(fake_provider.id_token())
+    fake_provider.kid = 'key-2'
+    fake_provider.private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    assert provider.verify_id_token(fake_provider.id_token())['sub'] == 'google-123'
+    assert fake_provider.hits['jwks'] == 2
+
+
+@pytest.fixture
+def auth_service(fake_provider, clean_database, monkeypatch):
+    # oauthlib refuses plain-http token endpoints unless told otherwise
+    monkeypatch.setenv('OAUTHLIB_INSECURE_TRANSPORT', '1')
+    return AuthService(UserRepository(), oidc_provider=make_provider(fake_provider))
+
+
+def test_google_callback_exchanges_the_code_and_verifies_the_id_token_locally(auth_service, fake_provider):
+    token, message = auth_service.handle_google_callback('auth-code')
+
+    assert message == "Login successful" and token
+    assert [request['code'] for request in fake_provider.token_requests] == [['auth-code']]
+    assert fake_provider.token_requests[0]['grant_type'] == ['authorization_code']
+    # The profile comes from the verified id_token; userinfo is never called
+    assert fake_provider.hits['userinfo'] == 0
+    user = UserRepository().get_user_by_email('alice@example.com')
+    assert (user.name, user.google_id) == ('Alice', 'google-123')
+
+
+@pytest.mark.parametrize('forgery', ['signature', 'audience'])
+def test_google_callback_rejects_forged_id_tokens(auth_service, fake_provider, forgery):
+    if forgery == 'signature':
+        fake_provider.issuing_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    else:
+        fake_provider.issued_claims = {'aud': 'someone-else'}
+
+    token, message = auth_service.handle_google_callback('auth-code')
+
+    assert token is None
+    assert message == {'signature': "Signature verification failed", 'audience': "Audience doesn't match"}[forgery]
+    assert UserRepository().get_user_by_email('alice@example.com') is None
@@ -0,0 +1,248 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from utils.circuit_breaker import CLOSED, OPEN, CircuitBreaker, CircuitOpen
+from utils.llm_scheduler import BACKGROUND, INTERACTIVE, LLMOverloaded, LLMScheduler, TokenBucket
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after):
+        super().__init__("rate limited")
+        self.response = type("Response", (), {"headers": {"retry-after": str(retry_after)}})()
+
+
+class FlakyLLM:
+    max_tokens = 10
+
+    def __init__(self, failures):
+        self.failures = list(failures)
+        self.calls = 0
+
+    def invoke(self, prompt, **kwargs):
+        self.calls += 1
+        if self.failures:
+            raise self.failures.pop(0)
+        return "ok"
+
+
+def wait_for_queue(scheduler, size):
+    deadline = time.time() + 2
+    while sum(t.state == "waiting" for t in scheduler._queue) < size:
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_interactive_calls_are_granted_before_background_calls():
+    scheduler = LLMScheduler(max_concurrency=1)
+    holder = scheduler.acquire(INTERACTIVE, 1)
+    order = []
+
+    def call(priority, name):
+        ticket = scheduler.acquire(priority, 1)
+        order.append(name)
+        scheduler.release(ticket)
+
+    background = threading.Thread(target=call, args=(BACKGROUND, "background"))
+    background.start()
+    wait_for_queue(scheduler, 1)
+    interactive = threading.Thread(target=call, args=(INTERACTIVE, "interactive"))
+    interactive.start()
+    wait_for_queue(scheduler, 2)
+
+    scheduler.release(holder)
+    background.join(2)
+    interactive.join(2)
+    assert order == ["interactive", "background"]
+
+
+def test_full_queue_sheds_background_work_first():
+    scheduler = LLMScheduler(max_concurrency=1, max_queue=1)
+    holder = scheduler.acquire(INTERACTIVE, 1)
+    errors = []
+
+    def background_call():
+        try:
+            scheduler.acquire(BACKGROUND, 1)
+        except LLMOverloaded as e:
+            errors.append(e)
+
+    background = threading.Thread(target=background_call)
+    background.start()
+    wait_for_queue(scheduler, 1)
+    interactive = threading.Thread(target=lambda: scheduler.release(scheduler.acquire(INTERACTIVE, 1)))
+    interactive.start()
+
+    background.join(2)
+    assert len(errors) == 1
+    scheduler.release(holder)
+    interactive.join(2)
+    assert not interactive.is_alive()
+
+    # A new background call into a full queue of interactive work is rejected outright
+    holder = scheduler.acquire(INTERACTIVE, 1)
+    waiter = threading.Thread(target=lambda: scheduler.release(scheduler.acquire(INTERACTIVE, 1)))
+    waiter.start()
+    wait_for_queue(scheduler, 1)
+    with pytest.raises(LLMOverloaded):
+        scheduler.acquire(BACKGROUND, 1)
+    scheduler.release(holder)
+    waiter.join(2)
+
+
+def test_background_calls_are_shed_after_their_max_wait():
+    scheduler = LLMScheduler(max_concurrency=1, max_wait={BACKGROUND: 0.05})
+    holder = scheduler.acquire(INTERACTIVE, 1)
+    with pytest.raises(LLMOverloaded):
+        scheduler.acquire(BACKGROUND, 1)
+    scheduler.release(holder)
+
+
+def test_rate_limited_calls_are_retried_after_retry_after():
+    scheduler = LLMScheduler()
+    llm = FlakyLLM([RateLimited(0.3)])
+
+    started = time.monotonic()
+    assert scheduler.invoke(llm, "hello", INTERACTIVE) == "ok"
+    assert llm.calls == 2
+    assert time.monotonic() - started >= 0.3
+    assert scheduler.active == 0
+
+
+def test_non_retryable_errors_propagate_immediately():
+    scheduler = LLMScheduler()
+    llm = FlakyLLM([ValueError("bad prompt")])
+    with pytest.raises(ValueError):
+        scheduler.invoke(llm, "hello", INTERACTIVE)
+    assert llm.calls == 1
+    assert scheduler.active == 0
+
+
+def test_token_bucket_refills_per_minute():
+    now = [0.0]
+    bucket = TokenBucket(600, clock=lambda: now[0])  # 10 per second
+    assert bucket.time_until(600, now[0]) == 0
+    bucket.take(600)
+    assert bucket.time_until(5, now[0]) == pytest.approx(0.5)
+    now[0] = 0.5
+    assert bucket.time_until(5, now[0]) == 0
+
+
+class SlowAsyncLLM:
+    """Async LLM whose n-th call takes ``delays[n]`` seconds (None: raise)"""
+    max_tokens = 10
+
+    def __init__(self, delays):
+        self.delays = list(delays)
+        self.calls = 0
+
+    async def ainvoke(self, prompt, **kwargs):
+        delay = self.delays[min(self.calls, len(self.delays) - 1)]
+        self.calls += 1
+        if delay is None:
+            raise ConnectionError("provider down")
+        await asyncio.sleep(delay)
+        return f"answer after {delay}"
+
+
+def test_async_calls_are_cut_off_at_the_deadline():
+    scheduler = LLMScheduler(call_timeout=0.1, deadline=0.35)
+    llm = SlowAsyncLLM([5])
+
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        asyncio.run(scheduler.ainvoke(llm, "hello"))
+    assert time.monotonic() - started < 1
+    assert scheduler.active == 0
+
+
+def test_hedged_call_takes_whichever_finishes_first():
+    scheduler = LLMScheduler(hedging=True, hedge_delay=0.05)
+    llm = SlowAsyncLLM([1.0, 0.01])
+
+    started = time.monotonic()
+    result = asyncio.run(scheduler.ainvoke(llm, "hello", hedge=True))
+    assert result == "answer after 0.01"
+    assert llm.calls == 2
+    assert time.monotonic() - started < 0.5
+    assert scheduler.active == 0
+
+
+def test_breaker_opens_after_consecutive_failures_and_fails_fast():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    scheduler = LLMScheduler(breaker=breaker, max_attempts=1)
+    llm = SlowAsyncLLM([None])
+
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            asyncio.run(scheduler.ainvoke(llm, "hello"))
+    with pytest.raises(LLMOverloaded):
+        asyncio.run(scheduler.ainvoke(llm, "hello"))
+    assert llm.calls == 2
+
+
+def test_breaker_probes_after_reset_timeout_and_counts_slow_calls():
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=1, slow_call_threshold=1.0, reset_timeout=10, clock=lambda: now[0])
+
+    breaker.before_call()
+    breaker.record_success(2.0)  # slow
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()
+
+    now[0] = 10.0
+    breaker.before_call()  # the probe
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()  # only one probe at a time
+    breaker.record_success(0.1)
+    assert breaker.state == CLOSED
+
+
+def test_shed_half_open_probe_releases_the_breaker():
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=lambda: now[0])
+    breaker.record_failure()
+    scheduler = LLMScheduler(breaker=breaker, max_concurrency=1, max_wait={BACKGROUND: 0.05})
+    llm = FlakyLLM([])
+    holder = scheduler.acquire(INTERACTIVE, 1)
+
+    # The probe is let through by the breaker, then shed while waiting for a ticket
+    now[0] = 10.0
+    with pytest.raises(LLMOverloaded):
+        scheduler.invoke(llm, "hello", BACKGROUND)
+    scheduler.release(holder)
+
+    # The next call becomes the probe instead of failing fast forever
+    assert scheduler.invoke(llm, "hello", INTERACTIVE) == "ok"
+    assert breaker.state == CLOSED
+
+
+class BlockingLLM:
+    """Sync LLM that blocks until ``release`` is set"""
+    max_tokens = 10
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def invoke(self, prompt, **kwargs):
+        self.release.wait(5)
+        return "late answer"
+
+
+def test_sync_calls_are_cut_off_at_the_deadline():
+    scheduler = LLMScheduler(call_timeout=0.1, deadline=0.35)
+    llm = BlockingLLM()
+
+    started = time.monotonic()
+    try:
+        with pytest.raises(TimeoutError):
+            scheduler.invoke(llm, "hello")
+        assert time.monotonic() - started < 1
+        assert scheduler.active == 0
+    finally:
+        llm.release.set()
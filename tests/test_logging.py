@@ -0,0 +1,99 @@
+import io
+import json
+import logging
+import sys
+
+import pytest
+
+from utils import logging_config
+from utils.logging_config import JsonFormatter, configure_logging, parse_levels
+
+
+@pytest.fixture
+def log_stream():
+    """JSON log lines written through the queue, as a list of dicts"""
+    stream = io.StringIO()
+
+    def lines():
+        logging_config.flush()
+        return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+    yield stream, lines
+    logging.getLogger("tests.module").setLevel(logging.NOTSET)
+    configure_logging()
+
+
+def make_app(fake_llm, stream, **config):
+    from app import create_app
+
+    app = create_app({"TESTING": True, "CHAT_REAPER": False, "RATE_LIMITS": False, **config}, llm=fake_llm)
+    configure_logging(app.config["LOG_LEVEL"], stream_handler=logging.StreamHandler(stream))
+    return app
+
+
+def test_json_formatter_includes_extras_and_exception():
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = logging.getLogger("tests").makeRecord(
+            "tests", logging.ERROR, __file__, 1, "failed for %s", ("chat-1",), sys.exc_info(),
+            extra={"chat_id": "chat-1"})
+
+    entry = json.loads(JsonFormatter().format(record))
+
+    assert entry["severity"] == "ERROR"
+    assert entry["logger"] == "tests"
+    assert entry["message"] == "failed for chat-1"
+    assert entry["chat_id"] == "chat-1"
+    assert "ValueError: boom" in entry["exception"]
+
+
+def test_parse_levels():
+    assert parse_levels("controllers.ChatController=debug, sqlalchemy.engine=WARNING,bad") == {
+        "controllers.ChatController": "DEBUG", "sqlalchemy.engine": "WARNING"}
+    assert parse_levels({"a": "info"}) == {"a": "INFO"}
+    assert parse_levels("") == {}
+
+
+def test_per_module_levels(log_stream):
+    stream, lines = log_stream
+    configure_logging("WARNING", "tests.module=DEBUG", stream_handler=logging.StreamHandler(stream))
+
+    logging.getLogger("tests.module").debug("kept")
+    logging.getLogger("tests.other").info("dropped")
+
+    assert [line["message"] for line in lines()] == ["kept"]
+
+
+def test_records_carry_the_request_id(fake_llm, make_user, log_stream):
+    stream, lines = log_stream
+    client = make_app(fake_llm, stream).test_client()
+    user, headers = make_user()
+
+    chat = {'creator_id': user.id, 'chat_name': 'Trip', 'agenda': 'Plan'}
+
+    response = client.post('/api/chats/create', json=chat, headers={**headers, "X-Request-ID": "req-123"})
+    assert response.headers["X-Request-ID"] == "req-123"
+    created = [line for line in lines() if line["message"].startswith("Chat created successfully")]
+    assert created[0]["request_id"] == "req-123"
+
+    # Ids are generated when missing or malformed
+    response = client.post('/api/chats/create', json=chat, headers={**headers, "X-Request-ID": "not an id"})
+    assert response.headers["X-Request-ID"] != "not an id"
+    assert len(response.headers["X-Request-ID"]) == 32
+
+
+@pytest.mark.parametrize("rate, expected", [(0.0, False), (1.0, True)])
+def test_debug_records_are_sampled_on_hot_endpoints(fake_llm, make_user, log_stream, rate, expected):
+    stream, lines = log_stream
+    client = make_app(fake_llm, stream, LOG_LEVEL="DEBUG", LOG_DEBUG_SAMPLE_RATE=rate,
+                      LOG_SAMPLED_ENDPOINTS=("chat_controller.create_chat",)).test_client()
+    user, headers = make_user()
+
+    assert client.post('/api/chats/create', json={'creator_id': user.id, 'chat_name': 'Trip', 'agenda': 'Plan'},
+                       headers=headers).status_code == 201
+
+    messages = [line["message"] for line in lines() if line["logger"] == "controllers.ChatController"]
+    assert ("Request received to create a chat" in messages) is expected
+    # Sampling only applies to debug records
+    assert any(message.startswith("Chat created successfully") for message in messages)
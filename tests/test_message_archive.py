@@ -0,0 +1,94 @@
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from repositories.ChatRepository import ChatRepository
+from services.ChatReaper import ChatReaper
+from services.MessageArchiver import MessageArchiver
+from storage.archive import decode_block
+
+
+def hot_messages(database, chat_id):
+    with database.connect() as conn:
+        return conn.execute(text("SELECT COUNT(*) FROM messages WHERE chat_id = :chat_id"),
+                            {"chat_id": chat_id}).scalar()
+
+
+def test_old_messages_move_to_archive_blocks_and_reads_fall_back(client, make_user, create_chat, send_message,
+                                                                 clean_database):
+    user, headers = make_user()
+    reader, reader_headers = make_user('Bob')
+    chat_id = create_chat(user, headers)
+    client.post(f'/api/chats/{chat_id}/join', json={'user_id': reader.id}, headers=reader_headers)
+    contents = [f'coorg plan {i}' for i in range(5)]
+    for content in contents:
+        send_message(chat_id, user, headers, content)
+    ids = [m['id'] for m in client.get(f'/api/chats/{chat_id}/messages', headers=headers).json['messages']]
+    stats_before = client.get(f'/api/chats/{chat_id}/stats', headers=headers).json
+
+    archiver = MessageArchiver(ChatRepository(), max_age_days=1, block_size=2, pause=0)
+    assert archiver.run_once() == 0
+    # Two full blocks move; the fifth message stays hot until a block fills up
+    assert archiver.run_once(now=datetime.utcnow() + timedelta(days=2)) == 4
+    assert hot_messages(clean_database, chat_id) == 1
+
+    chat = client.get(f'/api/chats/{chat_id}', headers=headers).json
+    assert [m['content'] for m in chat['messages']] == contents
+    export = client.get(f'/api/chats/{chat_id}/export', headers=headers).get_data(as_text=True)
+    assert [json.loads(line)['content'] for line in export.splitlines()[1:]] == contents
+    assert client.get(f'/api/chats/{chat_id}/stats', headers=headers).json == stats_before
+
+    delta = client.get(f'/api/chats/{chat_id}/messages?after={ids[0]}&limit=3', headers=headers).json['messages']
+    assert [m['content'] for m in delta] == contents[1:4]
+    assert [m['sender_name'] for m in delta] == [user.name] * 3
+    response = client.post(f'/api/chats/{chat_id}/read', json={'message_id': ids[2]}, headers=reader_headers)
+    assert response.json['unread_count'] == 2
+
+    assert client.delete(f'/api/chats/{chat_id}', json={'user_id': user.id}, headers=headers).status_code == 200
+    ChatReaper(ChatRepository(), batch_size=2, pause=0).run_once()
+    with clean_database.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM message_archive_blocks")).scalar() == 0
+
+
+def test_feed_search_and_chat_reads_reach_into_the_archive(client, make_user, create_chat, send_message, clean_database,
+                                                           monkeypatch):
+    user, headers = make_user()
+    chat_id = create_chat(user, headers)
+    contents = [f'coorg plan {i}' for i in range(5)]
+    for content in contents:
+        send_message(chat_id, user, headers, content)
+    repository = ChatRepository()
+    for _ in range(2):
+        assert repository.archive_messages(chat_id, datetime.utcnow() + timedelta(days=1), block_size=2) == 2
+
+    # The feed pages from the hot row into the blocks, with archived messages as cursors
+    pages, before = [], None
+    while True:
+        url = f'/api/chats/user/{user.id}/feed?limit=2' + (f'&before={before}' if before else '')
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200
+        pages.append([m['content'] for m in response.json['messages']])
+        assert {m['chat_name'] for m in response.json['messages']} == {'Trip'}
+        before = response.json['next_before']
+        if before is None:
+            break
+    assert pages == [contents[4:2:-1], contents[2:0:-1], contents[:1]]
+
+    results = client.get(f'/api/chats/{chat_id}/search?q=coorg&limit=10', headers=headers).json['results']
+    assert [r['content'] for r in results] == contents[::-1]
+    assert {r['sender_name'] for r in results} == {user.name}
+
+    # Only the newest block is decompressed for the three newest messages
+    decoded = []
+    monkeypatch.setattr("repositories.ChatRepository.decode_block",
+                        lambda payload: decoded.append(payload) or decode_block(payload))
+    assert [m.content for m in repository.get_chat_by_id(chat_id, message_limit=3).messages] == contents[2:]
+    assert len(decoded) == 1
+    messages = client.get(f'/api/chats/{chat_id}/messages?limit=2', headers=headers).json['messages']
+    assert [m['content'] for m in messages] == contents[3:]
+
+    assert client.delete(f'/api/chats/{chat_id}', json={'user_id': user.id}, headers=headers).status_code == 200
+    ChatReaper(repository, batch_size=2, pause=0).run_once()
+    with clean_database.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM message_terms")).scalar() == 0
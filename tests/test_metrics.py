@@ -0,0 +1,90 @@
+import re
+
+from utils.metrics import MetricsRegistry, db_queries, db_rows, request_duration
+
+MESSAGES_ROUTE = '/api/chats/<chat_id>/messages'
+
+
+def test_server_timing_reports_db_llm_serialize_and_total(client, make_user, create_chat):
+    user, headers = make_user()
+    create_chat(user, headers)
+
+    response = client.get(f'/api/chats/user/{user.id}/chats', headers=headers)
+
+    timing = dict(part.split(";", 1) for part in response.headers["Server-Timing"].split(", "))
+    assert list(timing) == ["db", "llm", "serialize", "total"]
+    assert re.fullmatch(r'dur=[\d.]+;desc="2 queries"', timing["db"])
+    assert re.fullmatch(r'dur=[\d.]+;desc="0 calls"', timing["llm"])
+    assert re.fullmatch(r'dur=[\d.]+', timing["total"])
+
+
+def test_queries_and_rows_are_counted_per_request_and_route(make_user, create_chat, send_message):
+    user, headers = make_user()
+    chat_id = create_chat(user, headers)
+    queries, rows = db_queries.value(route=MESSAGES_ROUTE), db_rows.value(route=MESSAGES_ROUTE)
+    requests = request_duration.count(route=MESSAGES_ROUTE, method="POST")
+
+    response = send_message(chat_id, user, headers, 'coorg road trip')
+
+    assert 'desc="4 queries"' in response.headers["Server-Timing"]
+    assert db_queries.value(route=MESSAGES_ROUTE) - queries == 4
+    # At least the message row and its three search postings (SQLite reports no count for UPDATE ... RETURNING)
+    assert db_rows.value(route=MESSAGES_ROUTE) - rows >= 4
+    assert request_duration.count(route=MESSAGES_ROUTE, method="POST") - requests == 1
+
+
+def test_rows_fetched_by_selects_are_counted(client, make_user, create_chat, send_message):
+    user, headers = make_user()
+    chat_id = create_chat(user, headers)
+    for content in ('one', 'two', 'three'):
+        send_message(chat_id, user, headers, content)
+    rows = db_rows.value(route=MESSAGES_ROUTE)
+
+    response = client.get(f'/api/chats/{chat_id}/messages?limit=2', headers=headers)
+
+    assert len(response.json['messages']) == 2
+    # SQLite reports no row count for a SELECT; the two message rows are counted as they are fetched
+    assert db_rows.value(route=MESSAGES_ROUTE) - rows >= 2
+
+
+def test_registry_renders_prometheus_text_format():
+    registry = MetricsRegistry()
+    counter = registry.counter("test_requests_total", "Requests")
+    gauge = registry.gauge("test_in_flight", "In flight")
+    histogram = registry.histogram("test_latency_seconds", "Latency", buckets=(0.1, 1.0))
+    counter.inc(route='/a"b')
+    counter.inc(2, route='/a"b')
+    gauge.set(3)
+    histogram.observe(0.05, route="/x")
+    histogram.observe(0.5, route="/x")
+    histogram.observe(5, route="/x")
+
+    assert registry.render().splitlines() == [
+        "# HELP test_requests_total Requests",
+        "# TYPE test_requests_total counter",
+        'test_requests_total{route="/a\\"b"} 3.0',
+        "# HELP test_in_flight In flight",
+        "# TYPE test_in_flight gauge",
+        "test_in_flight 3",
+        "# HELP test_latency_seconds Latency",
+        "# TYPE test_latency_seconds histogram",
+        'test_latency_seconds_bucket{route="/x",le="0.1"} 1',
+        'test_latency_seconds_bucket{route="/x",le="1.0"} 2',
+        'test_latency_seconds_bucket{route="/x",le="+Inf"} 3',
+        'test_latency_seconds_sum{route="/x"} 5.55',
+        'test_latency_seconds_count{route="/x"} 3',
+    ]
+
+
+def test_metrics_endpoint_serves_the_process_registry(client, make_user):
+    user, headers = make_user()
+    client.get(f'/api/chats/user/{user.id}/chats', headers=headers)
+
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    assert "version=0.0.4" in response.headers["Content-Type"]
+    body = response.get_data(as_text=True)
+    assert "# TYPE gatherly_request_duration_seconds histogram" in body
+    assert 'gatherly_db_queries_total{route="/api/chats/user/<user_id>/chats"}' in body
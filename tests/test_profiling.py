@@ -0,0 +1,45 @@
+import os
+import pstats
+
+from utils import profiling
+from utils.profiling import PROFILE_HEADER, RequestProfiler
+
+
+def profiled_client(app, tmp_path, **options):
+    profiling.init_app(app, RequestProfiler(str(tmp_path), secret='s3cret', **options))
+    return app.test_client()
+
+
+def test_secret_header_writes_pstats_tagged_with_route_and_chat(app, tmp_path, make_user):
+    client = profiled_client(app, tmp_path)
+    user, headers = make_user()
+
+    response = client.get('/api/chats/abc123/messages', headers={**headers, PROFILE_HEADER: 's3cret'})
+
+    name = response.headers['X-Profile-Id']
+    assert 'messages' in name and name.endswith('-abc123.pstats')
+    assert pstats.Stats(os.path.join(tmp_path, name)).total_calls > 0
+
+
+def test_requests_without_secret_are_not_profiled(app, tmp_path, make_user):
+    client = profiled_client(app, tmp_path)
+    user, headers = make_user()
+
+    response = client.get('/api/chats/abc123/messages', headers={**headers, PROFILE_HEADER: 'wrong'})
+
+    assert 'X-Profile-Id' not in response.headers
+    assert os.listdir(tmp_path) == []
+
+
+def test_collapsed_stack_output(app, tmp_path):
+    client = profiled_client(app, tmp_path, output_format='collapsed', interval=0.001)
+
+    response = client.get('/', headers={PROFILE_HEADER: 's3cret'})
+
+    assert response.headers['X-Profile-Id'].endswith('.collapsed')
+
+
+def test_disabled_by_default(monkeypatch):
+    monkeypatch.delenv('PROFILE_SECRET', raising=False)
+    monkeypatch.delenv('PROFILE_SAMPLE_RATE', raising=False)
+    assert RequestProfiler.from_env() is None
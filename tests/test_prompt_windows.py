@@ -0,0 +1,98 @@
+from datetime import datetime
+
+import pytest
+import tiktoken
+
+from entities.Chat import Chat
+from entities.ChatStats import ChatStats
+from entities.Message import Message
+from services.SummaryService import SummaryService
+from utils import tokens
+from utils.tokens import DEFAULT_MODEL, prompt_line_tokens, window_start
+
+
+def test_window_start_keeps_the_longest_suffix_within_budget():
+    assert window_start([], 10) == 0
+    assert window_start([3, 3, 3], 10) == 0
+    assert window_start([5, 3, 3], 8) == 1
+    # The newest message is kept even when it alone is over budget
+    assert window_start([1, 50], 10) == 1
+
+
+class WordEncoding:
+    """Stands in for tiktoken (which downloads its BPE files): one token per word"""
+
+    def encode(self, text, disallowed_special=()):
+        return text.split()
+
+
+@pytest.fixture
+def encoding(monkeypatch):
+    """tiktoken's loader, swappable by the test; starts out returning WordEncoding"""
+    loader = {"load": lambda model: WordEncoding()}
+    monkeypatch.setattr(tokens, "_encodings", {})
+    monkeypatch.setattr(tokens, "_failed_at", {})
+    monkeypatch.setattr(tokens, "_content_counts", tokens._CountCache(10))
+    monkeypatch.setattr(tiktoken, "encoding_for_model", lambda model: loader["load"](model))
+    return loader
+
+
+def test_token_counts_are_stored_when_messages_are_written(make_user, encoding, make_chat):
+    user, _ = make_user()
+    repository, chat_id = make_chat(user=user)
+    repository.add_message(chat_id, Message(sender_id=user.id, content="Coorg road trip budget"))
+
+    message = repository.get_chat_by_id(chat_id).messages[0]
+    assert message.token_count == 4
+
+
+def test_estimates_are_not_stored_and_the_encoding_is_retried(make_user, encoding, make_chat):
+    load = encoding["load"]
+    encoding["load"] = lambda model: 1 / 0
+    user, _ = make_user()
+    repository, chat_id = make_chat(user=user)
+    content = "Coorg road trip budget, " * 10
+
+    repository.add_message(chat_id, Message(sender_id=user.id, content=content))
+    message = repository.get_chat_by_id(chat_id).messages[0]
+    assert message.token_count is None
+    estimate = prompt_line_tokens("Alice", message)
+
+    # The failed load is not retried before the backoff has passed
+    encoding["load"] = load
+    assert prompt_line_tokens("Alice", message) == estimate
+    tokens._failed_at[DEFAULT_MODEL] -= tokens.TIKTOKEN_RETRY_SECONDS
+    # "Alice:", the newline and one token per word
+    assert prompt_line_tokens("Alice", message) == 1 + 1 + 40 != estimate
+    # Counts are cached by message id and content hash, not by the content itself
+    assert list(tokens._content_counts._counts) == [(message.id, hash(content))]
+
+
+def test_summary_prompt_holds_the_most_recent_messages_within_budget(monkeypatch):
+    messages = [Message(sender_id="u", sender_name="Alice", content=f"message number {i} " + "word " * 40,
+                        id=i, token_count=None if i % 2 else 45) for i in range(200)]
+    chat = Chat(id="c", admin_id="u", chat_name="Trip", agenda="Plan", created_at=datetime.now(), messages=messages)
+    monkeypatch.setattr("services.SummaryService.SUMMARY_PROMPT_TOKENS", 500)
+
+    prompt = SummaryService(None, None, llm=object())._summary_prompt(chat, ChatStats(chat_id="c"))
+
+    included = [i for i in range(200) if f"message number {i} " in prompt]
+    assert included == list(range(included[0], 200))
+    assert sum(prompt_line_tokens("Alice", messages[i]) for i in included) <= 500
+    assert included[0] > 150
+
+
+def test_summary_counts_every_message_not_just_the_loaded_window(client, services, make_user, create_chat,
+                                                                  send_message, monkeypatch):
+    user, headers = make_user()
+    chat_id = create_chat(user, headers)
+    for i in range(5):
+        send_message(chat_id, user, headers, f'message {i}')
+    repository = services.summary_service.chat_repository
+    get_chat_by_id = repository.get_chat_by_id
+    monkeypatch.setattr(repository, "get_chat_by_id",
+                        lambda chat_id, **kwargs: get_chat_by_id(chat_id, **{"message_limit": 2, **kwargs}))
+
+    response = client.get(f'/api/chats/{chat_id}/summary', headers=headers)
+    assert response.status_code == 200
+    assert response.json['summary']['message_count'] == 5
@@ -0,0 +1,128 @@
+"""Pinned SQL query budgets per endpoint.
+
+A failure here usually means an N+1 or a redundant lookup crept into a request path.
+Raise a budget only together with a note on why the extra query is needed.
+"""
+
+
+def test_send_message_budget(make_user, max_queries, create_chat, send_message):
+    user, headers = make_user()
+    chat_id = create_chat(user, headers)
+
+    # Counter bump (also the existence check), message insert, sender's read cursor, search postings
+    with max_queries(4):
+        response = send_message(chat_id, user, headers)
+    assert response.status_code == 201
+
+
+def test_get_user_chats_is_constant_in_chat_count(client, make_user, max_queries, create_chat, send_message):
+    user, headers = make_user()
+    chat_id = create_chat(user, headers)
+    send_message(chat_id, user, headers)
+
+    with max_queries(2) as one_chat:
+        client.get(f'/api/chats/user/{user.id}/chats', headers=headers)
+
+    for _ in range(5):
+        chat_id = create_chat(user, headers)
+        send_message(chat_id, user, headers)
+
+    with max_queries(2) as six_chats:
+        response = client.get(f'/api/chats/user/{user.id}/chats', headers=headers)
+    assert len(response.json['chats']) == 6
+    assert len(six_chats) == len(one_chat)
+
+
+def test_create_chat_budget(make_user, max_queries, create_chat):
+    user, headers = make_user()
+    # Id check, creator check, upsert, participant reset, participant insert
+    with max_queries(5):
+        create_chat(user, headers)
+
+
+def test_join_and_leave_budget(client, make_user, max_queries, create_chat):
+    admin, admin_headers = make_user()
+    chat_id = create_chat(admin, admin_headers)
+    member, member_headers = make_user('Bob')
+
+    with max_queries(6):
+        response = client.post(f'/api/chats/{chat_id}/join', json={'user_id': member.id}, headers=member_headers)
+    assert response.status_code == 200
+
+    with max_queries(5):
+        response = client.post(f'/api/chats/{chat_id}/leave', json={'user_id': member.id}, headers=member_headers)
+    assert response.status_code == 200
+
+
+def test_read_endpoints_budget(client, make_user, max_queries, create_chat, send_message):
+    user, headers = make_user()
+    chat_id = create_chat(user, headers)
+    for _ in range(3):
+        send_message(chat_id, user, headers)
+
+    with max_queries(3):
+        assert client.get(f'/api/chats/{chat_id}', headers=headers).status_code == 200
+    with max_queries(3):
+        assert client.get(f'/api/chats/{chat_id}/messages?limit=2', headers=headers).status_code == 200
+    with max_queries(3):
+        assert client.get(f'/api/chats/{chat_id}/export', headers=headers).status_code == 200
+    with max_queries(2):
+        assert client.get(f'/api/chats/{chat_id}/search?q=coorg', headers=headers).status_code == 200
+    with max_queries(5):
+        assert client.get(f'/api/chats/{chat_id}/stats', headers=headers).status_code == 200
+    # Chat ids, then one UNION ALL over the per-chat cursors
+    with max_queries(2):
+        assert client.get(f'/api/chats/user/{user.id}/feed', headers=headers).status_code == 200
+
+    last_id = client.get(f'/api/chats/{chat_id}/messages', headers=headers).json['messages'][-1]['id']
+    with max_queries(3):
+        assert client.get(f'/api/chats/{chat_id}/messages?after={last_id}', headers=headers).status_code == 200
+    with max_queries(4):
+        assert client.post(f'/api/chats/{chat_id}/read', json={'message_id': last_id},
+                           headers=headers).status_code == 200
+
+
+def test_feed_reads_a_chunk_per_chat_and_refills_only_drained_chats(client, make_user, create_chat, send_message,
+                                                                   max_queries):
+    user, headers = make_user()
+    quiet = [create_chat(user, headers) for _ in range(5)]
+    busy = create_chat(user, headers)
+    for chat_id in quiet:
+        send_message(chat_id, user, headers, 'quiet')
+    for i in range(30):
+        send_message(busy, user, headers, f'busy {i}')
+
+    # Chat ids, one UNION ALL taking a few rows from every chat, one refill of the busy chat
+    with max_queries(3) as statements:
+        response = client.get(f'/api/chats/user/{user.id}/feed?limit=12', headers=headers)
+    assert [m['content'] for m in response.json['messages']] == [f'busy {i}' for i in range(29, 17, -1)]
+    # Each branch ends in LIMIT ? OFFSET ?
+    limits = [parameters[-2] for _, parameters in statements[1:]]
+    assert limits == [8, 12]
+
+    before = response.json['next_before']
+    # Plus the cursor lookup
+    with max_queries(4):
+        response = client.get(f'/api/chats/user/{user.id}/feed?limit=12&before={before}', headers=headers)
+    assert [m['content'] for m in response.json['messages']] == [f'busy {i}' for i in range(17, 5, -1)]
+
+
+def test_llm_endpoints_budget(client, make_user, max_queries, create_chat, send_message):
+    user, headers = make_user()
+    chat_id = create_chat(user, headers)
+    send_message(chat_id, user, headers)
+
+    # Chat and messages, plus the stats aggregates (hot and archived) fed into the prompt
+    with max_queries(6):
+        assert client.get(f'/api/chats/{chat_id}/summary', headers=headers).status_code == 200
+    with max_queries(3):
+        assert client.get(f'/api/chats/{chat_id}/validate', headers=headers).status_code == 200
+
+
+def test_delete_chat_budget(client, make_user, max_queries, create_chat):
+    user, headers = make_user()
+    chat_id = create_chat(user, headers)
+
+    with max_queries(3):
+        response = client.delete(f'/api/chats/{chat_id}', json={'user_id': user.id}, headers=headers)
+    assert response.status_code == 200
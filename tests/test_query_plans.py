@@ -0,0 +1,89 @@
+import uuid
+from datetime import datetime
+
+import pytest
+
+from entities.Chat import Chat
+from entities.Message import Message
+from entities.User import User
+from repositories.ChatRepository import ChatRepository
+from repositories.UserRepository import UserRepository
+from storage.database import pool
+from storage.migrations import migrate
+from storage.query_plan import capture_statements, full_table_scans
+
+# Methods whose whole purpose is reading every row of a table
+FULL_SCAN_ALLOWED = {"UserRepository.get_all_users", "UserRepository.iter_users",
+                     "ChatRepository.get_archive_candidates"}
+
+
+@pytest.fixture(scope="module")
+def repositories():
+    migrate(pool)
+    chat_repo, user_repo = ChatRepository(), UserRepository()
+    user = User(id=str(uuid.uuid4()), email=f"{uuid.uuid4()}@example.com", name="Alice", password_hash="x")
+    user_repo.save_user(user)
+    chat = Chat(id=str(uuid.uuid4()), admin_id=user.id, chat_name="Trip", agenda="Plan the trip",
+                created_at=None, participants=[user.id])
+    chat_repo.save_chat(chat)
+    chat_repo.add_message(chat.id, Message(sender_id=user.id, content="Coorg road trip budget"))
+    return chat_repo, user_repo, user, chat
+
+
+def repository_calls(chat_repo, user_repo, user, chat):
+    """One representative call per public repository method"""
+    other_chat = Chat(id=str(uuid.uuid4()), admin_id=user.id, chat_name="Other", agenda="",
+                      created_at=None, participants=[user.id])
+    return {
+        "ChatRepository.get_chat_by_id": lambda: chat_repo.get_chat_by_id(chat.id),
+        "ChatRepository.iter_messages": lambda: list(chat_repo.iter_messages(chat.id)),
+        "ChatRepository.get_messages_after": lambda: chat_repo.get_messages_after(chat.id, 0, 10),
+        "ChatRepository.mark_read": lambda: chat_repo.mark_read(chat.id, user.id, 1),
+        "ChatRepository.save_chat": lambda: chat_repo.save_chat(chat),
+        "ChatRepository.add_participant": lambda: chat_repo.add_participant(chat.id, user.id),
+        "ChatRepository.add_message": lambda: chat_repo.add_message(chat.id, Message(sender_id=user.id, content="hello")),
+        "ChatRepository.rebuild_search_index": lambda: chat_repo.rebuild_search_index(chat.id),
+        "ChatRepository.search_messages": lambda: chat_repo.search_messages(["coorg", "budget"], user.id),
+        "ChatRepository.get_user_feed": lambda: chat_repo.get_user_feed(
+            user.id, 10, before=chat_repo.get_chat_by_id(chat.id).messages[0].id),
+        "ChatRepository.get_chat_stats": lambda: chat_repo.get_chat_stats(chat.id),
+        "ChatRepository.get_user_chats": lambda: chat_repo.get_user_chats(user.id),
+        "ChatRepository.is_participant": lambda: chat_repo.is_participant(chat.id, user.id),
+        "ChatRepository.remove_participant": lambda: chat_repo.remove_participant(other_chat.id, user.id),
+        "ChatRepository.delete_chat": lambda: (chat_repo.save_chat(other_chat), chat_repo.delete_chat(other_chat.id)),
+        "ChatRepository.get_archive_candidates": lambda: chat_repo.get_archive_candidates(),
+        "ChatRepository.archive_messages": lambda: chat_repo.archive_messages(chat.id, datetime.utcnow(), 1),
+        "ChatRepository.get_deleted_chat_ids": lambda: chat_repo.get_deleted_chat_ids(),
+        "ChatRepository.purge_deleted_chat": lambda: [chat_repo.purge_deleted_chat(other_chat.id) for _ in range(3)],
+        "UserRepository.get_user_by_id": lambda: user_repo.get_user_by_id(user.id),
+        "UserRepository.get_user_by_email": lambda: user_repo.get_user_by_email(user.email),
+        "UserRepository.save_user": lambda: user_repo.save_user(
+            User(id=str(uuid.uuid4()), email=f"{uuid.uuid4()}@example.com", name="Bob")),
+        "UserRepository.update_password_hash": lambda: user_repo.update_password_hash(user.id, "y"),
+        "UserRepository.delete_user": lambda: user_repo.delete_user(str(uuid.uuid4())),
+        "UserRepository.get_all_users": lambda: user_repo.get_all_users(),
+        "UserRepository.iter_users": lambda: list(user_repo.iter_users()),
+    }
+
+
+def public_methods(cls):
+    return {f"{cls.__name__}.{name}" for name in vars(cls) if not name.startswith("_") and callable(getattr(cls, name))}
+
+
+def test_every_repository_method_is_plan_checked(repositories):
+    calls = repository_calls(*repositories)
+    assert public_methods(ChatRepository) | public_methods(UserRepository) == set(calls)
+
+
+def test_repository_queries_do_not_scan_full_tables(repositories):
+    failures = {}
+    for name, call in repository_calls(*repositories).items():
+        if name in FULL_SCAN_ALLOWED:
+            continue
+        with capture_statements(pool) as statements:
+            call()
+        for statement, parameters in statements:
+            scans = full_table_scans(pool, statement, parameters)
+            if scans:
+                failures.setdefault(name, []).append((" ".join(statement.split()), scans))
+    assert not failures, failures
@@ -0,0 +1,140 @@
+import pytest
+
+from utils import rate_limit
+from utils.concurrency import shed_requests
+from utils.rate_limit import Limit, MemoryBackend, rate_limited_requests
+
+
+@pytest.fixture
+def limited_app(app, monkeypatch):
+    app.config["RATE_LIMITS"] = True
+    monkeypatch.setitem(rate_limit.LIMITS, "user", Limit("user", 60, 3))
+    monkeypatch.setitem(rate_limit.LIMITS, "chat", Limit("chat", 60, 4))
+    monkeypatch.setattr(rate_limit.rate_limiter, "backend", MemoryBackend())
+    return app
+
+
+def test_token_bucket_refills_over_time():
+    now = [0.0]
+    backend = MemoryBackend(clock=lambda: now[0])
+    limit = Limit("user", 60, 2)
+
+    assert backend.take("user:a", limit) == 0
+    assert backend.take("user:a", limit) == 0
+    assert backend.take("user:a", limit) == pytest.approx(1.0)
+    # Separate keys have separate buckets
+    assert backend.take("user:b", limit) == 0
+
+    now[0] = 0.5
+    assert backend.take("user:a", limit) == pytest.approx(0.5)
+    now[0] = 1.0
+    assert backend.take("user:a", limit) == 0
+
+
+def test_memory_backend_drops_least_recently_used_buckets():
+    backend = MemoryBackend(max_keys=2, clock=lambda: 0.0)
+    limit = Limit("user", 60, 1)
+    backend.take("user:a", limit)
+    backend.take("user:b", limit)
+    backend.take("user:c", limit)
+
+    # "a" was evicted, so it starts with a full bucket again
+    assert backend.take("user:a", limit) == 0
+    assert backend.take("user:c", limit) > 0
+
+
+def test_user_limit_returns_429_with_retry_after(limited_app, client, make_user, create_chat, send_message):
+    user, headers = make_user()
+    chat_id = create_chat(user, headers)
+    before = rate_limited_requests.value(limit="user")
+
+    assert send_message(chat_id, user, headers).status_code == 201
+    assert send_message(chat_id, user, headers).status_code == 201
+    response = send_message(chat_id, user, headers)
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
+    assert rate_limited_requests.value(limit="user") - before == 1
+    # Unlimited reads still go through
+    assert client.get(f'/api/chats/{chat_id}', headers=headers).status_code == 200
+
+
+def test_chat_limit_is_shared_by_participants(limited_app, client, make_user, create_chat, send_message):
+    admin, admin_headers = make_user()
+    chat_id = create_chat(admin, admin_headers)
+    member, member_headers = make_user('Bob')
+    # The join takes the chat's first token
+    client.post(f'/api/chats/{chat_id}/join', json={'user_id': member.id}, headers=member_headers)
+
+    assert send_message(chat_id, admin, admin_headers).status_code == 201
+    assert send_message(chat_id, member, member_headers).status_code == 201
+    assert send_message(chat_id, admin, admin_headers).status_code == 201
+    response = send_message(chat_id, member, member_headers)
+
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
+
+
+def test_concurrency_cap_sheds_with_503(app, make_user):
+    limiter = app.extensions["concurrency_limiter"]
+    client = app.test_client()
+    user, headers = make_user()
+    before = shed_requests.value()
+
+    for _ in range(limiter.limit):
+        assert limiter.acquire()
+    try:
+        response = client.get(f'/api/chats/user/{user.id}/chats', headers=headers)
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+        assert shed_requests.value() - before == 1
+        # Health checks and metrics scrapes are never shed
+        assert client.get('/api/chats/health').status_code == 200
+        assert client.get('/metrics').status_code == 200
+    finally:
+        for _ in range(limiter.limit):
+            limiter.release()
+
+    assert client.get(f'/api/chats/user/{user.id}/chats', headers=headers).status_code == 200
+    assert limiter.in_flight == 0
+
+
+def test_waits_on_the_llm_do_not_hold_a_concurrency_slot(app, client, services, make_user, create_chat, send_message,
+                                                        monkeypatch):
+    limiter = app.extensions["concurrency_limiter"]
+    user, headers = make_user()
+    chat_id = create_chat(user, headers)
+    for _ in range(9):
+        assert send_message(chat_id, user, headers).status_code == 201
+
+    # The tenth message triggers validation after giving its slot back
+    in_flight = []
+    validate_chat_context = services.summary_service.validate_chat_context
+    monkeypatch.setattr(services.summary_service, "validate_chat_context",
+                        lambda chat_id, priority: in_flight.append(limiter.in_flight) or (None, ""))
+    assert send_message(chat_id, user, headers).json["validation_triggered"]
+    assert in_flight == [0]
+    monkeypatch.setattr(services.summary_service, "validate_chat_context", validate_chat_context)
+
+    # The summary holds a slot for its reads and gives it back before the LLM call
+    in_flight.clear()
+    summary_prompt = services.summary_service._summary_prompt
+    monkeypatch.setattr(services.summary_service, "_summary_prompt",
+                        lambda chat, stats: in_flight.append(limiter.in_flight) or summary_prompt(chat, stats))
+    assert client.get(f'/api/chats/{chat_id}/summary', headers=headers).status_code == 200
+    assert in_flight == [0]
+
+    # With every slot taken the reads are shed before anything reaches the LLM
+    for _ in range(limiter.limit):
+        assert limiter.acquire()
+    try:
+        for url in (f'/api/chats/{chat_id}/summary', f'/api/chats/{chat_id}/validate'):
+            response = client.get(url, headers=headers)
+            assert response.status_code == 503
+            assert response.headers["Retry-After"] == "1"
+        assert in_flight == [0]
+    finally:
+        for _ in range(limiter.limit):
+            limiter.release()
+    assert client.get(f'/api/chats/{chat_id}/validate', headers=headers).status_code == 200
+    assert limiter.in_flight == 0
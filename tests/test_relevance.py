@@ -0,0 +1,121 @@
+from datetime import datetime
+
+from entities.Chat import Chat
+from entities.Message import Message
+from services.SummaryService import SummaryService
+from utils.relevance import RelevanceIndex
+
+ON_TOPIC = [
+    "Should we drive to Coorg or take the bus?",
+    "Driving to Coorg is cheaper if we split fuel",
+    "What budget are we looking at for the Coorg trip?",
+    "I'd keep the trip budget under 10k each",
+    "Homestay in Coorg near Madikeri looks good for the trip",
+    "Let's fix the trip dates and the budget this week",
+]
+OFF_TOPIC = [
+    "Did anyone watch the match last night?",
+    "That last over was unbelievable",
+    "My cat knocked over the plant again",
+    "New phone arrived, the camera is great",
+    "Anyone tried the new burger place downtown?",
+    "The match replay is on tonight",
+]
+
+
+def make_chat(contents, agenda="Plan the Coorg trip: route, budget and dates", chat_id="chat-1"):
+    messages = [Message(sender_id="user", content=content, id=str(i)) for i, content in enumerate(contents)]
+    return Chat(id=chat_id, admin_id="user", chat_name="Trip", agenda=agenda, created_at=datetime.now(),
+                messages=messages)
+
+
+class CountingLLM:
+    def __init__(self):
+        self.calls = 0
+
+    def invoke(self, prompt, **kwargs):
+        self.calls += 1
+        return "1. Is_On_Topic: Yes\n2. Confidence: 70%"
+
+
+class StubRepository:
+    def __init__(self, chat):
+        self.chat = chat
+
+    def get_chat_by_id(self, chat_id):
+        return self.chat
+
+
+def test_on_topic_windows_score_above_off_topic_windows():
+    index = RelevanceIndex()
+    on_topic, _ = index.score(make_chat(ON_TOPIC, chat_id="a"))
+    off_topic, _ = index.score(make_chat(OFF_TOPIC, chat_id="b"))
+    assert on_topic >= index.on_topic
+    assert off_topic < 0.05
+
+
+def test_windows_are_updated_incrementally():
+    index = RelevanceIndex(window=4)
+    chat = make_chat(OFF_TOPIC)
+    index.score(chat)
+    state = index._chats[chat.id]
+    assert state.documents == len(OFF_TOPIC)
+
+    chat.messages.extend(Message(sender_id="user", content=c, id=f"new-{i}") for i, c in enumerate(ON_TOPIC[:4]))
+    score, window = index.score(chat)
+    assert index._chats[chat.id] is state
+    assert state.documents == len(OFF_TOPIC) + 4
+    assert window == 4
+    # The off-topic messages have slid out of the window
+    assert score >= index.on_topic
+
+
+def test_a_sliding_message_window_only_hashes_newer_messages(monkeypatch):
+    index = RelevanceIndex(window=4)
+    chat = make_chat(OFF_TOPIC)
+    index.score(chat)
+    state = index._chats[chat.id]
+
+    # Chats load only their newest messages, so older ones drop off the front
+    hashed = []
+    monkeypatch.setattr(state, "add", lambda content: hashed.append(content))
+    new = [Message(sender_id="user", content=c, id=f"new-{i}") for i, c in enumerate(ON_TOPIC[:2])]
+    chat.messages = chat.messages[2:] + new
+    index.score(chat)
+    assert index._chats[chat.id] is state
+    assert hashed == ON_TOPIC[:2]
+
+    # When the last counted message is gone the window is rebuilt
+    chat.messages = chat.messages[:-1]
+    index.score(chat)
+    assert index._chats[chat.id] is not state
+
+
+def test_short_and_ambiguous_windows_are_escalated():
+    index = RelevanceIndex(min_messages=5)
+    assert index.decide(make_chat(ON_TOPIC[:2]))[0] is None
+    assert index.decide(make_chat(OFF_TOPIC, chat_id="b"))[0] is None
+    assert index.decide(make_chat(ON_TOPIC, chat_id="c"))[0] is True
+
+
+def test_ai_reminders_do_not_count_towards_relevance():
+    index = RelevanceIndex(min_messages=1)
+    chat = make_chat(OFF_TOPIC)
+    chat.messages.append(Message(sender_id="ai", content=f"Let's stay focused on our agenda: '{chat.agenda}'", id="r"))
+    assert index.decide(chat, skip_senders={"ai"})[0] is None
+
+
+def test_validation_skips_the_llm_for_clearly_on_topic_chats():
+    llm = CountingLLM()
+    chat = make_chat(ON_TOPIC)
+    service = SummaryService(StubRepository(chat), chat_service=None, llm=llm, relevance=RelevanceIndex())
+
+    result, _ = service.validate_chat_context(chat.id)
+    assert result["is_on_topic"] is True
+    assert "Decided locally" in result["validation_details"]
+    assert llm.calls == 0
+
+    chat.messages.extend(Message(sender_id="user", content=c, id=f"off-{i}") for i, c in enumerate(OFF_TOPIC * 4))
+    result, _ = service.validate_chat_context(chat.id)
+    assert result["is_on_topic"] is True
+    assert llm.calls == 1
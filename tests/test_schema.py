@@ -0,0 +1,64 @@
+from contextlib import contextmanager
+from datetime import datetime
+
+import sqlalchemy
+from sqlalchemy import event
+
+from entities.Chat import Chat
+from entities.Message import Message
+from repositories.ChatRepository import ChatRepository
+from storage.schema import metadata
+
+
+def describe(engine):
+    """Tables as {name: (columns, primary key, indexes)} as reflected from the database"""
+    inspector = sqlalchemy.inspect(engine)
+    tables = {}
+    for table in metadata.tables:
+        primary_key = tuple(inspector.get_pk_constraint(table)["constrained_columns"])
+        # SQLite reports an INTEGER PRIMARY KEY as nullable unless declared NOT NULL; it never holds NULL either way
+        columns = {column["name"]: (str(column["type"]), column["nullable"] and column["name"] not in primary_key)
+                   for column in inspector.get_columns(table)}
+        indexes = {index["name"]: (tuple(index["column_names"]), bool(index["unique"]))
+                   for index in inspector.get_indexes(table)}
+        tables[table] = (columns, primary_key, indexes)
+    return tables
+
+
+@contextmanager
+def cache_hits(engine):
+    """Collect whether each statement executed in the block came from the compiled cache"""
+    hits = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        hits.append(context.cache_hit == context.dialect.CACHE_HIT)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield hits
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+
+def test_table_metadata_matches_the_migrated_schema(database):
+    fresh = sqlalchemy.create_engine("sqlite://")
+    metadata.create_all(fresh)
+
+    assert describe(fresh) == describe(database)
+
+
+def test_repeated_queries_reuse_compiled_statements(clean_database, make_user):
+    user, _ = make_user()
+    repository = ChatRepository()
+    repository.save_chat(Chat("cache-chat", user.id, "Trip", "Plan", datetime.now(), [user.id]))
+    repository.add_message("cache-chat", Message(user.id, "hello"))
+
+    def read():
+        repository.get_chat_by_id("cache-chat")
+        repository.get_user_chats(user.id)
+
+    read()
+    with cache_hits(clean_database) as hits:
+        read()
+
+    assert hits and all(hits)
@@ -0,0 +1,62 @@
+def search(client, url, headers):
+    response = client.get(url, headers=headers)
+    assert response.status_code == 200, response.json
+    return response.json
+
+
+def test_results_rank_by_terms_matched_then_frequency(client, make_user, create_chat, send_message):
+    user, headers = make_user()
+    chat_id = create_chat(user, headers)
+    for content in ('coorg', 'budget for the coorg trip', 'coorg coorg coorg', 'unrelated', 'Budget!'):
+        send_message(chat_id, user, headers, content)
+
+    results = search(client, f'/api/chats/{chat_id}/search?q=Coorg budget', headers)['results']
+
+    assert [r['content'] for r in results] == ['budget for the coorg trip', 'coorg coorg coorg', 'Budget!', 'coorg']
+    assert [(r['matched_terms'], r['score']) for r in results] == [(2, 2), (1, 3), (1, 1), (1, 1)]
+    assert {r['chat_id'] for r in results} == {chat_id}
+
+
+def test_results_are_paginated(client, make_user, create_chat, send_message):
+    user, headers = make_user()
+    chat_id = create_chat(user, headers)
+    for i in range(5):
+        send_message(chat_id, user, headers, f'coorg plan {i}')
+
+    pages, offset = [], 0
+    while offset is not None:
+        page = search(client, f'/api/chats/{chat_id}/search?q=coorg&limit=2&offset={offset}', headers)
+        pages.append([r['content'] for r in page['results']])
+        offset = page['next_offset']
+
+    # Ties are broken newest first
+    assert pages == [['coorg plan 4', 'coorg plan 3'], ['coorg plan 2', 'coorg plan 1'], ['coorg plan 0']]
+
+
+def test_search_only_covers_the_callers_chats(client, make_user, create_chat, send_message):
+    alice, alice_headers = make_user('Alice')
+    bob, bob_headers = make_user('Bob')
+    shared = create_chat(alice, alice_headers)
+    client.post(f'/api/chats/{shared}/join', json={'user_id': bob.id}, headers=bob_headers)
+    private = create_chat(alice, alice_headers)
+    send_message(shared, alice, alice_headers, 'coorg in the shared chat')
+    send_message(private, alice, alice_headers, 'coorg in the private chat')
+
+    results = search(client, f'/api/chats/user/{bob.id}/search?q=coorg', bob_headers)['results']
+    assert [(r['chat_id'], r['content']) for r in results] == [(shared, 'coorg in the shared chat')]
+
+    results = search(client, f'/api/chats/user/{alice.id}/search?q=coorg', alice_headers)['results']
+    assert {r['chat_id'] for r in results} == {shared, private}
+
+
+def test_non_members_are_refused(client, make_user, create_chat, send_message):
+    alice, alice_headers = make_user('Alice')
+    mallory, mallory_headers = make_user('Mallory')
+    chat_id = create_chat(alice, alice_headers)
+    send_message(chat_id, alice, alice_headers, 'coorg')
+
+    assert client.get(f'/api/chats/{chat_id}/search?q=coorg', headers=mallory_headers).status_code == 403
+    assert client.get(f'/api/chats/user/{alice.id}/search?q=coorg', headers=mallory_headers).status_code == 403
+    # Queries without searchable terms are rejected before touching the index
+    assert client.get(f'/api/chats/{chat_id}/search?q=the', headers=alice_headers).status_code == 400
+    assert client.get(f'/api/chats/{chat_id}/search', headers=alice_headers).status_code == 400
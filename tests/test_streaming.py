@@ -0,0 +1,164 @@
+import gzip
+import json
+import sqlite3
+import zlib
+from datetime import datetime, timedelta
+
+import pytest
+import sqlalchemy
+
+from repositories.ChatRepository import ChatRepository
+from repositories.UserRepository import UserRepository
+from utils.streaming import gzip_stream, ndjson_batches
+
+
+@pytest.fixture
+def recording_engine(clean_database):
+    """An engine on the test database that counts the rows read from DBAPI cursors;
+    yields ``(engine, fetched)`` where ``fetched[0]`` is the running count"""
+    fetched = [0]
+
+    class RecordingCursor(sqlite3.Cursor):
+        def fetchone(self):
+            row = super().fetchone()
+            fetched[0] += row is not None
+            return row
+
+        def fetchmany(self, *args):
+            rows = super().fetchmany(*args)
+            fetched[0] += len(rows)
+            return rows
+
+        def fetchall(self):
+            rows = super().fetchall()
+            fetched[0] += len(rows)
+            return rows
+
+    class RecordingConnection(sqlite3.Connection):
+        def cursor(self, factory=RecordingCursor):
+            return super().cursor(factory)
+
+    path = clean_database.url.database
+    engine = sqlalchemy.create_engine("sqlite://", creator=lambda: sqlite3.connect(
+        path, factory=RecordingConnection, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False
+    ), native_datetime=True)
+    yield engine, fetched
+    engine.dispose()
+
+
+def assert_reads_ahead_at_most(stream, fetched, batch_size):
+    """Consume ``stream``; the cursor may never run more than ``batch_size`` rows ahead"""
+    items = []
+    for item in stream:
+        items.append(item)
+        assert fetched[0] - len(items) <= batch_size
+    return items
+
+
+def test_iter_messages_streams_archived_then_hot_messages_in_order(make_chat):
+    contents = [f"message {i}" for i in range(7)]
+    repository, chat_id = make_chat(contents)
+    # Same-second timestamps are ordered by id
+    assert [m.content for m in repository.iter_messages(chat_id, batch_size=2)] == contents
+
+    repository.archive_messages(chat_id, datetime.utcnow() + timedelta(days=1), block_size=4)
+    messages = list(repository.iter_messages(chat_id, batch_size=2))
+    assert [m.content for m in messages] == contents
+    assert [m.id for m in messages] == sorted(m.id for m in messages)
+
+
+def test_iter_messages_reads_batch_size_rows_at_a_time(recording_engine, make_chat):
+    engine, fetched = recording_engine
+    repository, chat_id = make_chat([f"message {i}" for i in range(9)], repository=ChatRepository(engine))
+
+    fetched[0] = 0
+    messages = assert_reads_ahead_at_most(repository.iter_messages(chat_id, batch_size=2), fetched, 2)
+    assert len(messages) == 9
+
+
+def test_iter_users_streams_every_user_in_id_order(make_user, recording_engine):
+    engine, fetched = recording_engine
+    ids = [make_user(f"User {i}")[0].id for i in range(6)]
+
+    fetched[0] = 0
+    users = assert_reads_ahead_at_most(UserRepository(engine).iter_users(batch_size=2), fetched, 2)
+    assert [user.id for user in users] == sorted(ids)
+    assert [user.name for user in UserRepository().get_all_users()] == [user.name for user in users]
+
+
+def test_ndjson_batches_frame_one_chunk_per_batch():
+    chunks = list(ndjson_batches(({"n": i} for i in range(5)), 2))
+
+    assert [chunk.count(b"\n") for chunk in chunks] == [2, 2, 1]
+    assert all(chunk.endswith(b"\n") for chunk in chunks)
+    assert [json.loads(line) for chunk in chunks for line in chunk.splitlines()] == [{"n": i} for i in range(5)]
+
+
+def test_gzip_stream_flushes_every_chunk():
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    stream = gzip_stream(iter([b"first\n", b"second\n"]))
+
+    # Each chunk can be decoded as soon as it arrives
+    assert decompressor.decompress(next(stream)) == b"first\n"
+    assert decompressor.decompress(b"".join(stream)) == b"second\n"
+
+
+@pytest.fixture
+def exported_chat(make_user, create_chat, send_message):
+    user, headers = make_user()
+    chat_id = create_chat(user, headers)
+    for i in range(5):
+        send_message(chat_id, user, headers, f'message {i}')
+    return chat_id, headers
+
+
+def test_export_streams_ndjson_read_in_batches(client, services, exported_chat, monkeypatch):
+    chat_repo = services.chat_repository
+    chat_id, headers = exported_chat
+    batch_sizes = []
+    iter_messages = chat_repo.iter_messages
+    monkeypatch.setattr(chat_repo, "iter_messages",
+                        lambda chat_id, batch_size: batch_sizes.append(batch_size) or iter_messages(chat_id, batch_size))
+
+    response = client.get(f'/api/chats/{chat_id}/export?batch_size=2', headers=headers, buffered=False)
+    assert response.mimetype == "application/x-ndjson"
+    assert "Content-Encoding" not in response.headers
+    chunks = list(response.response)
+    response.close()
+
+    assert batch_sizes == [2]
+    # The header goes out on its own, then one chunk per batch of messages
+    assert [chunk.count(b"\n") for chunk in chunks] == [1, 2, 2, 1]
+    records = [json.loads(line) for chunk in chunks for line in chunk.splitlines()]
+    assert records[0]["type"] == "chat" and records[0]["id"] == chat_id
+    assert [record["content"] for record in records[1:]] == [f"message {i}" for i in range(5)]
+
+
+def test_export_is_gzip_encoded_when_the_client_accepts_it(client, exported_chat):
+    chat_id, headers = exported_chat
+    plain = client.get(f'/api/chats/{chat_id}/export', headers=headers).data
+
+    response = client.get(f'/api/chats/{chat_id}/export', headers={**headers, "Accept-Encoding": "br, gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.mimetype == "application/x-ndjson"
+    assert gzip.decompress(response.data) == plain
+
+    response = client.get(f'/api/chats/{chat_id}/export', headers={**headers, "Accept-Encoding": "gzip;q=0"})
+    assert "Content-Encoding" not in response.headers
+    assert response.data == plain
+
+    # An explicit .gz download is compressed whatever the client accepts
+    response = client.get(f'/api/chats/{chat_id}/export?compress=gzip', headers=headers)
+    assert "Content-Encoding" not in response.headers
+    assert response.mimetype == "application/gzip"
+    assert response.headers["Content-Disposition"].endswith('.ndjson.gz"')
+    assert gzip.decompress(response.data) == plain
+
+
+def test_export_is_for_participants_only(client, make_user, exported_chat):
+    chat_id, headers = exported_chat
+    _, outsider_headers = make_user()
+
+    response = client.get(f'/api/chats/{chat_id}/export', headers=outsider_headers)
+    assert response.status_code == 403
+    assert client.get('/api/chats/missing/export', headers=headers).status_code == 404
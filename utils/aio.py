@@ -0,0 +1,83 @@
+"""A long-lived asyncio event loop for outbound async I/O.
+
+Flask runs each async view on a fresh event loop, so an async HTTP client cached across
+requests would hold connections bound to loops that are already closed. Coroutines that
+use such clients (the async LLM path) are submitted to this shared loop instead, which
+keeps their connection pool alive. Under a WSGI server the calling request thread still
+blocks until the coroutine finishes, so concurrency stays bounded by the request threads.
+
+Under the ASGI server (utils/asgi.py) the server's own loop lives as long as the worker;
+it is adopted as the shared loop, and async views await the LLM on it directly.
+
+The loop thread is started lazily in the process that first uses it, so each gunicorn
+worker gets its own after fork.
+"""
+from concurrent.futures import Future
+from typing import Awaitable, Optional, TypeVar
+import asyncio
+import contextvars
+import os
+import threading
+
+T = TypeVar("T")
+
+
+class BackgroundLoop:
+    def __init__(self, name: str = "background-loop"):
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_pid = None
+        self._lock = threading.Lock()
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None or self._loop_pid != os.getpid() or self._loop.is_closed():
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name=self.name, daemon=True).start()
+                self._loop = loop
+                self._loop_pid = os.getpid()
+            return self._loop
+
+    def adopt(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Use ``loop``, running for the life of the process, instead of starting a thread"""
+        with self._lock:
+            self._loop = loop
+            self._loop_pid = os.getpid()
+
+    def submit(self, coro: Awaitable[T]) -> "Future[T]":
+        """Schedule ``coro`` on the loop from any thread, keeping the caller's contextvars
+
+        The context matters: it carries the Flask request, so per-request metrics recorded
+        by callbacks inside ``coro`` land on the right request.
+        """
+        loop = self._get_loop()
+        context = contextvars.copy_context()
+        future: Future = Future()
+
+        def start():
+            task = context.run(loop.create_task, coro)
+
+            def done(task: asyncio.Task):
+                if future.cancelled():
+                    return
+                if task.cancelled():
+                    future.cancel()
+                elif task.exception() is not None:
+                    future.set_exception(task.exception())
+                else:
+                    future.set_result(task.result())
+
+            task.add_done_callback(done)
+            future.add_done_callback(lambda f: f.cancelled() and loop.call_soon_threadsafe(task.cancel))
+
+        loop.call_soon_threadsafe(start)
+        return future
+
+    async def run(self, coro: Awaitable[T]) -> T:
+        """Await ``coro`` on the background loop, from another event loop or the loop itself"""
+        if asyncio.get_running_loop() is self._loop:
+            return await coro
+        return await asyncio.wrap_future(self.submit(coro))
+
+
+background_loop = BackgroundLoop("llm-loop")
@@ -0,0 +1,211 @@
+"""Serve the Flask app over ASGI so async views don't hold a thread while they wait.
+
+Under a WSGI server Flask runs an async view to completion inside the request thread,
+so every LLM call in flight pins a thread. ``AsgiApp`` runs those views as coroutines on
+the server's event loop instead: their database reads go to the thread pool for the
+length of the read (``asyncio.to_thread``) and the LLM call is awaited without a thread,
+so one worker keeps as many calls in flight as the LLM scheduler admits. Sync views run
+unchanged on a bounded thread pool.
+
+Both paths go through Flask's own request handling (before/after request hooks, error
+handlers, teardown), so auth, rate limits, metrics and logging behave as under WSGI.
+
+Run it with an ASGI worker, e.g. ``gunicorn -k uvicorn_worker.UvicornWorker asgi:app``
+(the default in ``gunicorn.conf.py``).
+"""
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Optional
+import asyncio
+import contextvars
+import inspect
+import os
+import sys
+from flask import Flask
+from flask.signals import request_started
+from werkzeug.exceptions import HTTPException
+from utils.aio import background_loop
+
+# Threads for sync views and for the database reads of async views
+ASGI_THREADS = int(os.getenv("GUNICORN_THREADS", "32"))
+
+
+class AsgiApp:
+    def __init__(self, app: Flask, threads: int = ASGI_THREADS):
+        self.app = app
+        self.threads = threads
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        # Created on first use, in the worker process
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.threads, thread_name_prefix="asgi")
+        return self._executor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+
+        body = await _read_body(receive)
+        environ = _environ(scope, body)
+        if self._is_async(environ):
+            await self._dispatch_async(environ, send)
+        else:
+            await self._dispatch_sync(environ, send)
+
+    async def _lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                loop = asyncio.get_running_loop()
+                # asyncio.to_thread (the async views' database reads) shares the bounded pool
+                loop.set_default_executor(self.executor)
+                # The LLM client's connections can live on this loop; no hop to another thread
+                background_loop.adopt(loop)
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def _is_async(self, environ) -> bool:
+        """Whether the request routes to a coroutine view"""
+        try:
+            endpoint, _ = self.app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            return False
+        return inspect.iscoroutinefunction(self.app.view_functions.get(endpoint))
+
+    async def _dispatch_async(self, environ, send) -> None:
+        """Flask's request handling with the view awaited on this event loop.
+
+        Each ASGI call runs in its own task, so the contexts pushed here (contextvars)
+        are this request's alone, and threads started with ``asyncio.to_thread`` see
+        them too. The app context is pushed explicitly: Flask would otherwise reuse one
+        already active in the enclosing scope, and concurrent requests would share ``g``.
+        """
+        app = self.app
+        app_ctx = app.app_context()
+        ctx = app.request_context(environ)
+        error = None
+        app_ctx.push()
+        try:
+            try:
+                ctx.push()
+                response = await self._full_dispatch(ctx.request)
+            except Exception as e:
+                error = e
+                response = app.handle_exception(e)
+            status, headers, body = response.status_code, response.headers.to_wsgi_list(), response.get_data()
+            response.close()
+        finally:
+            if app.should_ignore_error(error):
+                error = None
+            ctx.pop(error)
+            app_ctx.pop(error)
+        await send({"type": "http.response.start", "status": status, "headers": _encode_headers(headers)})
+        await send({"type": "http.response.body", "body": body})
+
+    async def _full_dispatch(self, request):
+        """``Flask.full_dispatch_request`` with the view awaited instead of run through ``async_to_sync``"""
+        app = self.app
+        try:
+            request_started.send(app, _async_wrapper=app.ensure_sync)
+            rv = app.preprocess_request()
+            if rv is None:
+                if request.routing_exception is not None:
+                    app.raise_routing_exception(request)
+                rv = await app.view_functions[request.url_rule.endpoint](**request.view_args)
+        except Exception as e:
+            rv = app.handle_user_exception(e)
+        return app.finalize_request(rv)
+
+    async def _dispatch_sync(self, environ, send) -> None:
+        """Run the WSGI app on the thread pool, streaming its output back through ``send``"""
+        loop = asyncio.get_running_loop()
+
+        def send_from_thread(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def run():
+            started, pending = [], []
+
+            def start_response(status, headers, exc_info=None):
+                if exc_info and started:
+                    raise exc_info[1].with_traceback(exc_info[2])
+                pending[:] = [{"type": "http.response.start", "status": int(status.split(" ", 1)[0]),
+                               "headers": _encode_headers(headers)}]
+
+            def flush_start():
+                if not started:
+                    started.append(True)
+                    send_from_thread(pending.pop())
+
+            with self.app.app_context():
+                result = self.app(environ, start_response)
+                try:
+                    for chunk in result:
+                        flush_start()
+                        if chunk:
+                            send_from_thread({"type": "http.response.body", "body": chunk, "more_body": True})
+                    flush_start()
+                finally:
+                    if hasattr(result, "close"):
+                        result.close()
+            send_from_thread({"type": "http.response.body"})
+
+        await loop.run_in_executor(self.executor, contextvars.copy_context().run, run)
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    return b"".join(chunks)
+
+
+def _environ(scope, body: bytes) -> dict:
+    """A WSGI environ for an ASGI HTTP scope"""
+    script_name = scope.get("root_path", "").encode("utf8").decode("latin1")
+    path_info = scope["path"].encode("utf8").decode("latin1")
+    if path_info.startswith(script_name):
+        path_info = path_info[len(script_name):]
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": script_name,
+        "PATH_INFO": path_info,
+        "QUERY_STRING": scope["query_string"].decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+    for name, value in scope.get("headers", []):
+        name, value = name.decode("latin1"), value.decode("latin1")
+        if name == "content-length":
+            continue
+        key = "CONTENT_TYPE" if name == "content-type" else "HTTP_" + name.upper().replace("-", "_")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _encode_headers(headers):
+    return [(name.lower().encode("latin1"), value.encode("latin1")) for name, value in headers]
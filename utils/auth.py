@@ -1,15 +1,97 @@
+from concurrent.futures import ProcessPoolExecutor
 from passlib.hash import bcrypt
 import jwt
+import multiprocessing
 import os
+import threading
 from datetime import datetime, timedelta
 
 JWT_SECRET = os.getenv('JWT_SECRET', 'dev-secret')
 
+# bcrypt work factor for new hashes; stored hashes with a different cost are upgraded on login
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
+# Worker processes dedicated to bcrypt; 0 hashes inline in the calling thread
+HASH_POOL_WORKERS = int(os.getenv('HASH_POOL_WORKERS', str(min(4, os.cpu_count() or 1))))
+# Hash jobs allowed to be running or queued before new ones are rejected
+HASH_QUEUE_LIMIT = int(os.getenv('HASH_QUEUE_LIMIT', '32'))
+
+
+class HashPoolBusy(Exception):
+    """Raised when the password hashing queue is full and the caller should retry later."""
+
+
+def _bcrypt_hash(password: str, rounds: int) -> str:
+    return bcrypt.using(rounds=rounds).hash(password)
+
+
+def _bcrypt_verify(password: str, hashed: str) -> bool:
+    return bcrypt.verify(password, hashed)
+
+
+class PasswordHasher:
+    """Runs bcrypt in a bounded process pool so request threads don't hold the GIL while hashing.
+
+    The pool is created lazily in the process that first uses it, which keeps it out of the
+    gunicorn master and gives each worker its own pool after fork.
+    """
+
+    def __init__(self, rounds: int = BCRYPT_ROUNDS, max_workers: int = HASH_POOL_WORKERS,
+                 max_pending: int = HASH_QUEUE_LIMIT):
+        self.rounds = rounds
+        self.max_workers = max_workers
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashPoolBusy("Too many password hashing requests in flight")
+        try:
+            if self.max_workers <= 0:
+                return fn(*args)
+            return self._get_executor().submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password: str) -> str:
+        return self._run(_bcrypt_hash, password, self.rounds)
+
+    def verify(self, password: str, hashed: str) -> bool:
+        return self._run(_bcrypt_verify, password, hashed)
+
+    def needs_rehash(self, hashed: str) -> bool:
+        """True when the stored hash was made with a different work factor (no hashing involved)."""
+        return bcrypt.using(rounds=self.rounds).needs_update(hashed)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+password_hasher = PasswordHasher()
+
+
 def hash_password(password: str) -> str:
-    return bcrypt.hash(password)
+    return password_hasher.hash(password)
 
 def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.verify(password, hashed)
+    return password_hasher.verify(password, hashed)
+
+def password_needs_rehash(hashed: str) -> bool:
+    return password_hasher.needs_rehash(hashed)
 
 def create_token(user_id: str) -> str:
     payload = {
@@ -19,4 +101,4 @@ def create_token(user_id: str) -> str:
     return jwt.encode(payload, JWT_SECRET, algorithm='HS256')
 
 def verify_token(token: str) -> dict:
-    return jwt.decode(token, JWT_SECRET, algorithms=['HS256'])
\ No newline at end of file
+    return jwt.decode(token, JWT_SECRET, algorithms=['HS256'])
@@ -0,0 +1,75 @@
+"""Circuit breaker for calls to a degraded dependency.
+
+Closed: calls pass. After ``failure_threshold`` consecutive failures, where a call slower
+than ``slow_call_threshold`` also counts as a failure, the breaker opens. Calls then fail
+immediately with ``CircuitOpen`` for ``reset_timeout`` seconds. After that one probe call is
+let through (half-open): success closes the breaker, failure opens it again.
+"""
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    """The breaker is open; ``retry_after`` is the time until it lets a probe through"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, slow_call_threshold: float = 15.0,
+                 reset_timeout: float = 30.0, clock=time.monotonic, on_open=None):
+        self.failure_threshold = failure_threshold
+        self.slow_call_threshold = slow_call_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.on_open = on_open
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        """Raise CircuitOpen unless a call may go ahead now"""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            remaining = self.opened_at + self.reset_timeout - self.clock()
+            if self.state == OPEN and remaining <= 0:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            raise CircuitOpen("Circuit open, failing fast", retry_after=max(remaining, 1.0))
+
+    def record_success(self, duration: float) -> None:
+        if duration >= self.slow_call_threshold:
+            self.record_failure()
+            return
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self) -> None:
+        opened = False
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                opened = self.state != OPEN
+                self.state = OPEN
+                self.opened_at = self.clock()
+            self._probing = False
+        if opened and self.on_open is not None:
+            self.on_open()
+
+    def record_cancelled(self) -> None:
+        """The call was abandoned (e.g. a losing hedge); it says nothing about the provider"""
+        with self._lock:
+            self._probing = False
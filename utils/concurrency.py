@@ -0,0 +1,66 @@
+"""Concurrency slots: the process-wide cap on database work in flight.
+
+``utils.rate_limit`` installs the cap and holds a slot for a whole request. The LLM
+endpoints spend most of their time waiting on the model rather than on a connection, so
+they are not capped per request; their services take a slot with ``database_slot`` only
+around each read and write, and give it back before calling the LLM.
+
+Kept apart from ``utils.rate_limit``, which imports the auth middleware and through it
+the services, so that the services can import it.
+"""
+from contextlib import contextmanager
+from flask import current_app, has_request_context, request
+from utils.metrics import registry
+
+_SLOT_KEY = "gatherly.request_slot"
+
+shed_requests = registry.counter(
+    "gatherly_shed_requests_total", "Requests rejected with 503 by the concurrency cap")
+
+
+class ServerBusy(Exception):
+    """Every concurrency slot is taken; the chat blueprint turns it into a 503"""
+
+    retry_after = 1
+
+    def __init__(self, message: str = "Server is busy, please retry shortly"):
+        super().__init__(message)
+
+
+def take_request_slot() -> bool:
+    """Take a concurrency slot for the current request; False (and counted as shed) if none is free"""
+    limiter = current_app.extensions.get("concurrency_limiter")
+    if limiter is None or request.environ.get(_SLOT_KEY):
+        return True
+    if not limiter.acquire():
+        shed_requests.inc()
+        return False
+    request.environ[_SLOT_KEY] = True
+    return True
+
+
+def release_request_slot() -> None:
+    """Give back the current request's concurrency slot, once it is done with the database"""
+    if request.environ.pop(_SLOT_KEY, False):
+        current_app.extensions["concurrency_limiter"].release()
+
+
+@contextmanager
+def database_slot():
+    """Hold a concurrency slot for the database work in the block.
+
+    A no-op outside a request, without a cap, or when the request already holds a slot.
+    Works in ``asyncio.to_thread`` threads, which see the request context.
+
+    Raises:
+        ServerBusy: Every slot is taken
+    """
+    if not has_request_context() or request.environ.get(_SLOT_KEY):
+        yield
+        return
+    if not take_request_slot():
+        raise ServerBusy()
+    try:
+        yield
+    finally:
+        release_request_slot()
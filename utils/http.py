@@ -0,0 +1,37 @@
+from requests.adapters import HTTPAdapter
+import os
+import requests
+import threading
+
+# Default (connect, read) timeout in seconds for outbound calls
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', '5'))
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '20'))
+
+
+class TimeoutSession(requests.Session):
+    """A keep-alive session that applies a default timeout to every request."""
+
+    def __init__(self, timeout: float = HTTP_TIMEOUT, pool_size: int = HTTP_POOL_SIZE):
+        super().__init__()
+        self.timeout = timeout
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> TimeoutSession:
+    """Return the process-wide shared session, creating it on first use."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = TimeoutSession()
+    return _session
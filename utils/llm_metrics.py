@@ -0,0 +1,58 @@
+"""LangChain callback feeding LLM latency and token usage into ``utils.metrics``.
+
+Kept apart from ``utils.metrics`` so that importing the web app does not import LangChain;
+only the code that builds an LLM client needs it.
+"""
+from typing import Dict, Tuple
+import threading
+import time
+from langchain_core.callbacks import BaseCallbackHandler
+from utils.metrics import current_stats, llm_duration, llm_tokens
+
+
+class LLMMetricsCallback(BaseCallbackHandler):
+    """Times every LLM run and records token usage; the operation label comes from the first run tag"""
+
+    # Run in the caller's thread/context so the current request's stats are reachable
+    run_inline = True
+
+    def __init__(self):
+        self._runs: Dict[object, Tuple[float, str]] = {}
+        self._lock = threading.Lock()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, tags=None, **kwargs):
+        operation = tags[0] if tags else "llm"
+        with self._lock:
+            self._runs[run_id] = (time.perf_counter(), operation)
+
+    def _finish(self, run_id, response=None):
+        with self._lock:
+            started, operation = self._runs.pop(run_id, (None, "llm"))
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        llm_duration.observe(elapsed, operation=operation)
+
+        usage = ((response.llm_output or {}).get("token_usage") or {}) if response is not None else {}
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+        if prompt_tokens:
+            llm_tokens.inc(prompt_tokens, operation=operation, kind="prompt")
+        if completion_tokens:
+            llm_tokens.inc(completion_tokens, operation=operation, kind="completion")
+
+        stats = current_stats()
+        if stats is not None:
+            stats.llm_calls += 1
+            stats.llm_time += elapsed
+            stats.prompt_tokens += prompt_tokens
+            stats.completion_tokens += completion_tokens
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._finish(run_id, response)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id)
+
+
+llm_metrics_callback = LLMMetricsCallback()
@@ -0,0 +1,513 @@
+"""Process-wide scheduler for LLM calls: priorities, rate budgets, retries and load shedding.
+
+Every LLM call takes a ticket before it runs. Tickets are granted strictly by priority
+(``INTERACTIVE`` summaries, then ``ON_DEMAND`` validations, then ``BACKGROUND`` validations
+triggered by sending a message) and only while the request-per-minute and token-per-minute
+buckets, the concurrency limit and any provider-requested pause allow it. Prompt tokens are
+counted with tiktoken; the completion is charged at the client's ``max_tokens``.
+
+Under pressure the lowest-priority work goes first: when the queue is full the newest
+lowest-priority ticket is shed, and tickets that wait longer than their priority's
+``max_wait`` are shed too. Shed calls raise ``LLMOverloaded``.
+
+Failed calls are retried with tenacity (jittered exponential backoff). A 429 with
+``Retry-After`` pauses all dispatching for that long, so the whole process backs off
+together instead of hammering the provider.
+
+Tail latency is bounded even when the provider degrades. Each attempt has a timeout
+(``LLM_TIMEOUT``) and all attempts of a call share a deadline (``LLM_DEADLINE``), on the sync
+path too: sync attempts run on a worker thread the caller stops waiting for. A circuit
+breaker opens after consecutive failed or slow calls and then fails fast with
+``LLMOverloaded``. Idempotent async calls can be hedged (``LLM_HEDGING=1``).
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Dict, List, Optional
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from tenacity import (AsyncRetrying, Retrying, retry_if_exception, stop_after_attempt, stop_before_delay,
+                      wait_random_exponential)
+from utils.circuit_breaker import CLOSED, CircuitBreaker, CircuitOpen
+from utils.metrics import registry
+from utils.tokens import count_tokens
+
+INTERACTIVE = 0
+ON_DEMAND = 1
+BACKGROUND = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", ON_DEMAND: "on_demand", BACKGROUND: "background"}
+
+LLM_RPM = int(os.getenv("LLM_RPM", "3500"))
+LLM_TPM = int(os.getenv("LLM_TPM", "90000"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "4"))
+LLM_MAX_WAIT = {
+    INTERACTIVE: float(os.getenv("LLM_INTERACTIVE_MAX_WAIT", "30")),
+    ON_DEMAND: float(os.getenv("LLM_ON_DEMAND_MAX_WAIT", "30")),
+    BACKGROUND: float(os.getenv("LLM_BACKGROUND_MAX_WAIT", "5")),
+}
+# Per-attempt timeout, and the budget for all attempts of one call together
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "20"))
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "45"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_SLOW_CALL = float(os.getenv("LLM_BREAKER_SLOW_CALL", "15"))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))
+LLM_HEDGING = os.getenv("LLM_HEDGING", "0") == "1"
+# Hedge delay until enough latencies are recorded to compute the percentile
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "5"))
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+DEFAULT_COMPLETION_TOKENS = 256
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+logger = logging.getLogger(__name__)
+
+llm_queue_seconds = registry.histogram(
+    "gatherly_llm_queue_seconds", "Time LLM calls waited for the scheduler, by priority")
+llm_shed = registry.counter(
+    "gatherly_llm_shed_total", "LLM calls rejected by the scheduler, by priority and reason")
+llm_retries = registry.counter(
+    "gatherly_llm_retries_total", "LLM call retries, by priority")
+llm_circuit_opened = registry.counter(
+    "gatherly_llm_circuit_opened_total", "Times the LLM circuit breaker opened")
+llm_hedges = registry.counter(
+    "gatherly_llm_hedges_total", "Hedged (duplicate) LLM calls started, by operation")
+llm_hedges_won = registry.counter(
+    "gatherly_llm_hedges_won_total", "Hedged LLM calls that finished before the original, by operation")
+
+
+class LLMOverloaded(Exception):
+    """The scheduler shed this call; ``retry_after`` is a hint in seconds"""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """``per_minute`` units, refilled continuously"""
+
+    def __init__(self, per_minute: float, clock=time.monotonic):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = float(per_minute)
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount: float, now: float) -> float:
+        """Seconds until ``amount`` is available (requests larger than the bucket wait for a full one)"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float) -> None:
+        self.level -= min(amount, self.capacity)
+
+
+class LatencyWindow:
+    """Recent successful call latencies per operation, for hedge delays"""
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.size = size
+        self.min_samples = min_samples
+        self._samples: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def record(self, operation: str, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault(operation, deque(maxlen=self.size)).append(seconds)
+
+    def percentile(self, operation: str, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get(operation, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * q / 100))]
+
+
+class Ticket:
+    __slots__ = ("priority", "sequence", "tokens", "submitted", "deadline", "state", "event", "loop", "async_event")
+
+    def __init__(self, priority: int, sequence: int, tokens: int, submitted: float, deadline: float):
+        self.priority = priority
+        self.sequence = sequence
+        self.tokens = tokens
+        self.submitted = submitted
+        self.deadline = deadline
+        self.state = "waiting"  # -> granted | shed
+        self.event = threading.Event()
+        self.loop = None
+        self.async_event = None
+
+    def __lt__(self, other: "Ticket") -> bool:
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+    def notify(self) -> None:
+        self.event.set()
+        if self.async_event is not None:
+            self.loop.call_soon_threadsafe(self.async_event.set)
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _is_retryable(error: BaseException) -> bool:
+    if isinstance(error, LLMOverloaded):
+        return False
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError)):
+        return True
+    # openai.APIConnectionError / APITimeoutError carry no status code
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+
+
+class wait_retry_after:
+    """Jittered exponential backoff, but never shorter than the provider's Retry-After"""
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+
+    def __call__(self, retry_state) -> float:
+        backoff = self.fallback(retry_state)
+        error = retry_state.outcome.exception() if retry_state.outcome else None
+        retry_after = _retry_after(error) if error is not None else None
+        return max(backoff, retry_after or 0.0)
+
+
+class LLMScheduler:
+    def __init__(self, rpm: int = LLM_RPM, tpm: int = LLM_TPM, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 max_queue: int = LLM_MAX_QUEUE, max_wait: Optional[Dict[int, float]] = None,
+                 max_attempts: int = LLM_MAX_ATTEMPTS, deadline: float = LLM_DEADLINE,
+                 call_timeout: float = LLM_TIMEOUT, breaker: Optional[CircuitBreaker] = None,
+                 hedging: bool = LLM_HEDGING, hedge_delay: float = LLM_HEDGE_DELAY,
+                 hedge_percentile: float = LLM_HEDGE_PERCENTILE, clock=time.monotonic):
+        self.requests = TokenBucket(rpm, clock)
+        self.tokens = TokenBucket(tpm, clock)
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = {**LLM_MAX_WAIT, **(max_wait or {})}
+        self.max_attempts = max_attempts
+        self.deadline = deadline
+        self.call_timeout = call_timeout
+        self.breaker = breaker or CircuitBreaker(
+            failure_threshold=LLM_BREAKER_FAILURES,
+            slow_call_threshold=LLM_BREAKER_SLOW_CALL,
+            reset_timeout=LLM_BREAKER_RESET,
+            on_open=lambda: llm_circuit_opened.inc()
+        )
+        self.hedging = hedging
+        self.hedge_delay = hedge_delay
+        self.hedge_percentile = hedge_percentile
+        self.latencies = LatencyWindow()
+        self.clock = clock
+        self.active = 0
+        self.paused_until = 0.0
+        self._queue: List[Ticket] = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    # -- admission ---------------------------------------------------------------------
+
+    def _shed(self, ticket: Ticket, reason: str) -> None:
+        ticket.state = "shed"
+        llm_shed.inc(priority=PRIORITY_NAMES.get(ticket.priority, str(ticket.priority)), reason=reason)
+        ticket.notify()
+
+    def _submit(self, priority: int, tokens: int) -> Ticket:
+        now = self.clock()
+        with self._lock:
+            ticket = Ticket(priority, next(self._sequence), tokens, now, now + self.max_wait.get(priority, 30.0))
+            waiting = [t for t in self._queue if t.state == "waiting"]
+            if len(waiting) >= self.max_queue:
+                # Queue is full: drop the newest of the lowest-priority work, possibly this ticket
+                victim = max(waiting + [ticket], key=lambda t: (t.priority, t.sequence))
+                self._shed(victim, "queue_full")
+                if victim is ticket:
+                    return ticket
+            heapq.heappush(self._queue, ticket)
+            self._dispatch(now)
+            return ticket
+
+    def _dispatch(self, now: float) -> None:
+        """Grant waiting tickets in priority order while budgets allow; call with the lock held"""
+        for ticket in self._queue:
+            if ticket.state == "waiting" and ticket.deadline <= now:
+                self._shed(ticket, "deadline")
+        while self._queue:
+            ticket = self._queue[0]
+            if ticket.state != "waiting":
+                heapq.heappop(self._queue)
+                continue
+            if self.active >= self.max_concurrency or now < self.paused_until:
+                return
+            if self.requests.time_until(1, now) > 0 or self.tokens.time_until(ticket.tokens, now) > 0:
+                return
+            heapq.heappop(self._queue)
+            self.requests.take(1)
+            self.tokens.take(ticket.tokens)
+            self.active += 1
+            ticket.state = "granted"
+            llm_queue_seconds.observe(now - ticket.submitted, priority=PRIORITY_NAMES.get(ticket.priority))
+            ticket.notify()
+
+    def _poll(self, ticket: Ticket) -> Optional[float]:
+        """Re-run dispatch; None once ``ticket`` is settled, else seconds until it is worth checking again"""
+        now = self.clock()
+        with self._lock:
+            self._dispatch(now)
+            if ticket.state == "granted":
+                return None
+            if ticket.state == "shed":
+                raise LLMOverloaded("LLM capacity exhausted, please retry shortly",
+                                    retry_after=max(1.0, self.paused_until - now))
+            budget_wait = max(self.paused_until - now, self.requests.time_until(1, now),
+                              self.tokens.time_until(ticket.tokens, now))
+            # Waiting on budgets needs a timer; waiting behind other calls is woken by their release
+            delay = min(ticket.deadline - now, budget_wait if budget_wait > 0 else 1.0)
+            return min(max(delay, 0.005), 1.0)
+
+    def acquire(self, priority: int, tokens: int) -> Ticket:
+        ticket = self._submit(priority, tokens)
+        while True:
+            delay = self._poll(ticket)
+            if delay is None:
+                return ticket
+            ticket.event.wait(delay)
+            ticket.event.clear()
+
+    async def aacquire(self, priority: int, tokens: int) -> Ticket:
+        ticket = self._submit(priority, tokens)
+        ticket.loop = asyncio.get_running_loop()
+        ticket.async_event = asyncio.Event()
+        try:
+            while True:
+                delay = self._poll(ticket)
+                if delay is None:
+                    return ticket
+                try:
+                    await asyncio.wait_for(ticket.async_event.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                ticket.async_event.clear()
+        except asyncio.CancelledError:
+            self._abandon(ticket)
+            raise
+
+    def _abandon(self, ticket: Ticket) -> None:
+        """The waiter went away (e.g. a losing hedge was cancelled): give back its slot"""
+        with self._lock:
+            state, ticket.state = ticket.state, "abandoned"
+        if state == "granted":
+            self.release(ticket)
+
+    def release(self, ticket: Ticket) -> None:
+        with self._lock:
+            self.active -= 1
+            self._dispatch(self.clock())
+
+    def pause(self, seconds: float) -> None:
+        """Stop granting tickets for ``seconds`` (the provider asked us to back off)"""
+        with self._lock:
+            self.paused_until = max(self.paused_until, self.clock() + seconds)
+
+    # -- calls -------------------------------------------------------------------------
+
+    def _cost(self, llm, prompt: str) -> int:
+        completion = getattr(llm, "max_tokens", None)
+        if not isinstance(completion, int) or completion < 0:
+            completion = DEFAULT_COMPLETION_TOKENS
+        return count_tokens(prompt) + completion
+
+    def _retrying_kwargs(self, priority: int, deadline: float) -> dict:
+        def before_sleep(retry_state):
+            error = retry_state.outcome.exception()
+            llm_retries.inc(priority=PRIORITY_NAMES.get(priority))
+            retry_after = _retry_after(error)
+            if retry_after:
+                self.pause(retry_after)
+            logger.warning("LLM call failed (%s), retrying in %.1fs", error, retry_state.next_action.sleep)
+
+        return dict(
+            retry=retry_if_exception(_is_retryable),
+            wait=wait_retry_after(wait_random_exponential(multiplier=0.5, max=20)),
+            # Never start an attempt (or sleep towards one) past the caller's deadline
+            stop=stop_after_attempt(self.max_attempts) | stop_before_delay(deadline),
+            before_sleep=before_sleep,
+            reraise=True,
+        )
+
+    def _check_breaker(self, priority: int) -> None:
+        try:
+            self.breaker.before_call()
+        except CircuitOpen as e:
+            llm_shed.inc(priority=PRIORITY_NAMES.get(priority), reason="circuit_open")
+            raise LLMOverloaded("LLM provider is failing, please retry shortly", retry_after=e.retry_after) from e
+
+    def _acquire_checked(self, priority: int, cost: int) -> Ticket:
+        """Check the breaker, then wait for a ticket.
+
+        The breaker goes first so an open circuit fails fast instead of queueing. If the
+        call never reaches the provider (shed, or cancelled while waiting) it is reported
+        as cancelled, so a half-open probe does not stay claimed forever.
+        """
+        self._check_breaker(priority)
+        try:
+            return self.acquire(priority, cost)
+        except BaseException:
+            self.breaker.record_cancelled()
+            raise
+
+    async def _aacquire_checked(self, priority: int, cost: int) -> Ticket:
+        self._check_breaker(priority)
+        try:
+            return await self.aacquire(priority, cost)
+        except BaseException:
+            self.breaker.record_cancelled()
+            raise
+
+    def _invoke_with_timeout(self, llm, prompt: str, timeout: float, kwargs):
+        """``llm.invoke`` on a worker thread; the caller gives up after ``timeout``.
+
+        A sync client cannot be interrupted. An abandoned call keeps its worker thread until
+        the client's own timeout (LLM_TIMEOUT) ends it, but the caller does not wait for it.
+        """
+        with self._lock:
+            if self._executor is None:
+                # Room for abandoned calls still running next to a full set of granted ones
+                self._executor = ThreadPoolExecutor(self.max_concurrency * 2, thread_name_prefix="llm-call")
+        future = self._executor.submit(contextvars.copy_context().run, llm.invoke, prompt, **kwargs)
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            if future.done():
+                raise
+            future.cancel()
+            raise TimeoutError(f"LLM call timed out after {timeout:.1f}s") from None
+
+    def invoke(self, llm, prompt: str, priority: int = INTERACTIVE, deadline: Optional[float] = None, **kwargs):
+        """``llm.invoke(prompt, **kwargs)`` under the scheduler's budgets, breaker and retry policy.
+
+        ``deadline`` (seconds, default LLM_DEADLINE) bounds all attempts together; each
+        attempt is also cut off at LLM_TIMEOUT or the deadline, whichever comes first.
+        """
+        deadline = deadline or self.deadline
+        expires = time.monotonic() + deadline
+        cost = self._cost(llm, prompt)
+        for attempt in Retrying(**self._retrying_kwargs(priority, deadline)):
+            with attempt:
+                ticket = self._acquire_checked(priority, cost)
+                started = time.monotonic()
+                try:
+                    timeout = max(min(self.call_timeout, expires - started), 0.001)
+                    result = self._invoke_with_timeout(llm, prompt, timeout, kwargs)
+                except Exception:
+                    self.breaker.record_failure()
+                    raise
+                finally:
+                    self.release(ticket)
+                self.breaker.record_success(time.monotonic() - started)
+                return result
+
+    async def _ainvoke_once(self, llm, prompt: str, priority: int, cost: int, expires: float, kwargs):
+        ticket = await self._aacquire_checked(priority, cost)
+        started = time.monotonic()
+        try:
+            timeout = max(min(self.call_timeout, expires - started), 0.001)
+            result = await asyncio.wait_for(llm.ainvoke(prompt, **kwargs), timeout)
+        except asyncio.CancelledError:
+            self.breaker.record_cancelled()
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        finally:
+            self.release(ticket)
+        self.breaker.record_success(time.monotonic() - started)
+        return result
+
+    async def ainvoke(self, llm, prompt: str, priority: int = INTERACTIVE, deadline: Optional[float] = None,
+                      hedge: bool = False, **kwargs):
+        """Async ``invoke``; each attempt is also cut off at LLM_TIMEOUT or the deadline.
+
+        With ``hedge=True`` (for idempotent calls, and only when LLM_HEDGING is on) a second
+        identical call is started once the first has run longer than the recent p95 latency
+        for this operation, and whichever finishes first wins.
+        """
+        deadline = deadline or self.deadline
+        expires = time.monotonic() + deadline
+        cost = self._cost(llm, prompt)
+
+        async def call(call_priority: int):
+            async for attempt in AsyncRetrying(**self._retrying_kwargs(call_priority, expires - time.monotonic())):
+                with attempt:
+                    return await self._ainvoke_once(llm, prompt, call_priority, cost, expires, kwargs)
+
+        operation = _operation(kwargs)
+        started = time.monotonic()
+        if hedge and self.hedging:
+            result = await self._hedged(call, priority, operation)
+        else:
+            result = await call(priority)
+        self.latencies.record(operation, time.monotonic() - started)
+        return result
+
+    async def _hedged(self, call, priority: int, operation: str):
+        primary = asyncio.ensure_future(call(priority))
+        delay = self.latencies.percentile(operation, self.hedge_percentile)
+        done, _ = await asyncio.wait({primary}, timeout=delay if delay is not None else self.hedge_delay)
+        if done or self.breaker.state != CLOSED:
+            # Finished in time, or the provider is struggling and an extra call would only add load
+            return await primary
+
+        llm_hedges.inc(operation=operation)
+        # The hedge is optional work: it queues as background so it is the first thing shed
+        hedge = asyncio.ensure_future(call(BACKGROUND))
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            llm_hedges_won.inc(operation=operation)
+                        return task.result()
+                    if task is primary or error is None:
+                        error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+def _operation(kwargs) -> str:
+    tags = (kwargs.get("config") or {}).get("tags") or ["llm"]
+    return tags[0]
+
+
+llm_scheduler = LLMScheduler()
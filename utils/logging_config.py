@@ -0,0 +1,199 @@
+"""Structured, non-blocking application logging.
+
+Request threads only put records on a queue (``QueueHandler``); a ``QueueListener`` thread
+formats them as one JSON object per line and writes them to stderr, so a slow or busy
+stream never stalls a request. Each line carries the request's id (the incoming
+``X-Request-ID`` header or a generated one, echoed on the response), and ``severity``
+and ``message`` fields that Cloud Logging picks up as is.
+
+Levels: ``LOG_LEVEL`` for the root logger, and ``LOG_LEVELS`` per module, e.g.
+``LOG_LEVELS=controllers.ChatController=DEBUG,sqlalchemy.engine=WARNING``.
+
+Debug sampling: on the endpoints in ``LOG_SAMPLED_ENDPOINTS`` only one request in
+``1 / LOG_DEBUG_SAMPLE_RATE`` keeps its debug records. The choice is made per request,
+so a sampled request keeps all of them; the others are dropped before formatting.
+"""
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Mapping, Optional, Union
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import re
+import uuid
+from datetime import datetime, timezone
+from flask import Flask, g, has_request_context, request
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.01"))
+# The message write and read paths, which run far more often than anything else
+LOG_SAMPLED_ENDPOINTS = tuple(os.getenv(
+    "LOG_SAMPLED_ENDPOINTS",
+    "chat_controller.send_message,chat_controller.get_messages,chat_controller.get_chat,"
+    "chat_controller.get_user_chats,chat_controller.mark_read,chat_controller.get_user_feed"
+).split(","))
+REQUEST_ID_HEADER = "X-Request-ID"
+# Incoming request ids are reused only when they look like an id, not arbitrary text
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+# Attributes every LogRecord has; anything else was passed with ``extra=`` and is logged too
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "request_id"}
+
+
+def parse_levels(levels: Union[str, Mapping[str, str], None]) -> Dict[str, str]:
+    """``"a=DEBUG,b.c=WARNING"`` (or a mapping) as ``{logger name: level}``"""
+    if not levels:
+        return {}
+    if isinstance(levels, Mapping):
+        return {name: str(level).upper() for name, level in levels.items()}
+    parsed = {}
+    for entry in levels.split(","):
+        name, _, level = entry.partition("=")
+        if name.strip() and level.strip():
+            parsed[name.strip()] = level.strip().upper()
+    return parsed
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "severity": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id is not None:
+            entry["request_id"] = request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestQueueHandler(QueueHandler):
+    """Queues records with the request id attached and the traceback already rendered.
+
+    Both need the request thread: the id lives in the request context, and a traceback
+    keeps its frames alive until it is formatted. Everything else happens on the listener.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self._traceback_formatter = logging.Formatter()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno <= logging.DEBUG and has_request_context() and not g.get("log_debug", True):
+            return False
+        return super().filter(record)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._traceback_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        if has_request_context():
+            record.request_id = g.get("request_id")
+        return record
+
+
+class _LogPipeline:
+    """The process's queue handler and its listener thread"""
+
+    def __init__(self):
+        self.handler: Optional[RequestQueueHandler] = None
+        self.listener: Optional[QueueListener] = None
+        self.stream_handler: Optional[logging.Handler] = None
+
+    def start(self, handler: RequestQueueHandler, stream_handler: logging.Handler) -> None:
+        self.stop()
+        self.handler = handler
+        self.stream_handler = stream_handler
+        self._start_listener()
+        logging.getLogger().addHandler(handler)
+
+    def _start_listener(self) -> None:
+        self.listener = QueueListener(self.handler.queue, self.stream_handler, respect_handler_level=True)
+        self.listener.start()
+
+    def flush(self) -> None:
+        """Wait until every queued record has been written"""
+        if self.listener is not None:
+            self.listener.stop()
+            self._start_listener()
+
+    def stop(self) -> None:
+        """Flush queued records and remove the handler"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        if self.handler is not None:
+            logging.getLogger().removeHandler(self.handler)
+            self.handler = None
+
+    def after_fork(self) -> None:
+        # The listener thread does not survive a fork, and the parent's queue may have been
+        # locked mid-put; the child starts over with a fresh queue and listener
+        if self.handler is not None:
+            self.handler.queue = queue.Queue(-1)
+            self._start_listener()
+
+
+_pipeline = _LogPipeline()
+atexit.register(_pipeline.stop)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_pipeline.after_fork)
+
+
+def configure_logging(level: str = LOG_LEVEL, levels: Union[str, Mapping[str, str], None] = LOG_LEVELS,
+                      stream_handler: Optional[logging.Handler] = None) -> None:
+    """Route all logging through the queue to a JSON stream handler (stderr by default)
+
+    Calling it again replaces the previous setup; handlers installed by others are kept.
+    """
+    if stream_handler is None:
+        stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter())
+    _pipeline.start(RequestQueueHandler(queue.Queue(-1)), stream_handler)
+
+    logging.getLogger().setLevel(level.upper() if isinstance(level, str) else level)
+    for name, module_level in parse_levels(levels).items():
+        logging.getLogger(name).setLevel(module_level)
+
+
+def flush() -> None:
+    """Wait until every queued record has been written"""
+    _pipeline.flush()
+
+
+def init_app(app: Flask) -> None:
+    """Configure logging from the app config and tag every request with an id"""
+    configure_logging(app.config["LOG_LEVEL"], app.config["LOG_LEVELS"])
+    sample_rate = app.config["LOG_DEBUG_SAMPLE_RATE"]
+    sampled_endpoints = frozenset(app.config["LOG_SAMPLED_ENDPOINTS"])
+
+    @app.before_request
+    def start_request_log():
+        incoming = request.headers.get(REQUEST_ID_HEADER, "")
+        g.request_id = incoming if _REQUEST_ID.match(incoming) else uuid.uuid4().hex
+        if request.endpoint in sampled_endpoints:
+            g.log_debug = random.random() < sample_rate
+
+    @app.after_request
+    def add_request_id(response):
+        request_id = g.get("request_id")
+        if request_id is not None:
+            response.headers[REQUEST_ID_HEADER] = request_id
+        return response
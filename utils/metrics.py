@@ -0,0 +1,283 @@
+"""Per-request SQL/LLM instrumentation exported in Prometheus text format.
+
+Every request gets a RequestStats object on ``flask.g``. SQLAlchemy engine events add
+query count, rows and DB time to it, and the LLM callback in
+``utils.llm_metrics`` adds LLM time and token usage. After the request finishes the totals go into the
+process-wide registry served at ``/metrics``, and a ``Server-Timing`` header
+(db, llm, serialize, total) is added to the response.
+
+Rows are the driver's row count where it reports one, and otherwise the rows actually
+fetched: DB-API drivers may report -1 (or 0, as SQLite does) for a SELECT, so its rows
+are counted as the result is consumed.
+
+Each gunicorn worker keeps its own registry, so a scrape shows one worker's numbers.
+"""
+from bisect import bisect_left
+from typing import Dict, Iterable, Optional, Tuple
+import threading
+import time
+from flask import Flask, Response, g, has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import event
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value: float = 1.0, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0.0)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_format_labels(labels)} {value}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._values: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, **labels) -> int:
+        entry = self._values.get(tuple(sorted(labels.items())))
+        return entry[2] if entry else 0
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = [(labels, (list(entry[0]), entry[1], entry[2])) for labels, entry in self._values.items()]
+        for labels, (bucket_counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield f"{self.name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(labels)} {total}"
+            yield f"{self.name}_count{_format_labels(labels)} {count}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        metric = Counter(name, documentation)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        metric = Gauge(name, documentation)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self._metrics for line in metric.render()) + "\n"
+
+
+registry = MetricsRegistry()
+request_duration = registry.histogram(
+    "gatherly_request_duration_seconds", "HTTP request latency by route")
+request_db_duration = registry.histogram(
+    "gatherly_request_db_seconds", "Database time spent per HTTP request by route")
+db_queries = registry.counter(
+    "gatherly_db_queries_total", "SQL statements executed, by route")
+db_rows = registry.counter(
+    "gatherly_db_rows_total", "Rows written or fetched by SQL statements, by route")
+llm_duration = registry.histogram(
+    "gatherly_llm_duration_seconds", "LLM call latency by operation")
+llm_tokens = registry.counter(
+    "gatherly_llm_tokens_total", "LLM tokens by operation and kind (prompt/completion)")
+
+
+class RequestStats:
+    __slots__ = ("started", "db_queries", "db_rows", "db_time", "llm_calls", "llm_time",
+                 "prompt_tokens", "completion_tokens", "serialize_time")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_queries = 0
+        self.db_rows = 0
+        self.db_time = 0.0
+        self.llm_calls = 0
+        self.llm_time = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.serialize_time = 0.0
+
+
+def current_stats() -> Optional[RequestStats]:
+    if not has_request_context():
+        return None
+    return g.get("request_stats")
+
+
+def _route_label() -> str:
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """JSON provider that charges serialization time to the current request"""
+
+    def dumps(self, obj, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            stats = current_stats()
+            if stats is not None:
+                stats.serialize_time += time.perf_counter() - started
+
+
+class _RowCountingCursor:
+    """DB-API cursor proxy that adds the rows fetched through it to a request's stats"""
+
+    __slots__ = ("_cursor", "_stats")
+
+    def __init__(self, cursor, stats: RequestStats):
+        self._cursor = cursor
+        self._stats = stats
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._stats.db_rows += 1
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        self._stats.db_rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._stats.db_rows += len(rows)
+        return rows
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def instrument_engine(engine) -> None:
+    """Attach query/row/time counters for the current request to ``engine``"""
+    if getattr(engine, "_gatherly_instrumented", False):
+        return
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_start"].pop()
+        stats = current_stats()
+        if stats is None:
+            return
+        stats.db_queries += 1
+        stats.db_time += time.perf_counter() - started
+        if cursor.rowcount and cursor.rowcount > 0:
+            stats.db_rows += cursor.rowcount
+        elif context is not None and cursor.description is not None:
+            # The result reads from context.cursor, so rows are counted as they are fetched
+            context.cursor = _RowCountingCursor(cursor, stats)
+
+    engine._gatherly_instrumented = True
+
+
+def _server_timing(stats: RequestStats, total: float) -> str:
+    return ", ".join([
+        f'db;dur={stats.db_time * 1000:.1f};desc="{stats.db_queries} queries"',
+        f'llm;dur={stats.llm_time * 1000:.1f};desc="{stats.llm_calls} calls"',
+        f"serialize;dur={stats.serialize_time * 1000:.1f}",
+        f"total;dur={total * 1000:.1f}",
+    ])
+
+
+def init_app(app: Flask, database) -> None:
+    """Install request instrumentation, the JSON timing provider and the /metrics route.
+
+    ``database`` is the app's engine. A lazy one (``storage.database.LazyEngine``) is
+    instrumented once created; instrumenting is idempotent, so apps may share an engine.
+    """
+    if hasattr(database, "on_create"):
+        database.on_create(instrument_engine)
+    else:
+        instrument_engine(database)
+    app.json = TimedJSONProvider(app)
+
+    @app.before_request
+    def start_request_stats():
+        g.request_stats = RequestStats()
+
+    @app.after_request
+    def record_request_stats(response):
+        stats = g.pop("request_stats", None)
+        if stats is None:
+            return response
+        total = time.perf_counter() - stats.started
+        route = _route_label()
+        request_duration.observe(total, route=route, method=request.method)
+        request_db_duration.observe(stats.db_time, route=route, method=request.method)
+        db_queries.inc(stats.db_queries, route=route)
+        db_rows.inc(stats.db_rows, route=route)
+        response.headers["Server-Timing"] = _server_timing(stats, total)
+        return response
+
+    @app.route("/metrics")
+    def metrics():
+        """Prometheus scrape endpoint"""
+        return Response(registry.render(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,111 @@
+from typing import Optional, Dict
+from utils.http import get_session
+import jwt
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class OIDCProvider:
+    """Cached view of an OpenID Connect provider: discovery document, JWKS and id_token checks.
+
+    The discovery document is fetched once and kept for ``ttl`` seconds. After that the
+    stale copy keeps being served while a background thread refreshes it, so requests
+    never wait on the provider once the first fetch has succeeded. Signing keys are
+    cached the same way and refetched when a token names a key id we haven't seen.
+    """
+
+    def __init__(self, discovery_url: str, client_id: str, session=None, ttl: float = 3600,
+                 jwks_refetch_interval: float = 60, leeway: float = 30):
+        self.discovery_url = discovery_url
+        self.client_id = client_id
+        self.session = session
+        self.ttl = ttl
+        self.jwks_refetch_interval = jwks_refetch_interval
+        self.leeway = leeway
+        self._config: Optional[Dict] = None
+        self._config_fetched_at = 0.0
+        self._keys: Dict[str, jwt.PyJWK] = {}
+        self._jwks_fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def _http(self):
+        return self.session or get_session()
+
+    def _fetch_config(self) -> Dict:
+        response = self._http().get(self.discovery_url)
+        response.raise_for_status()
+        config = response.json()
+        with self._lock:
+            self._config = config
+            self._config_fetched_at = time.monotonic()
+        return config
+
+    def _background_refresh(self) -> None:
+        try:
+            self._fetch_config()
+        except Exception as e:
+            logger.warning("OIDC discovery refresh failed, keeping cached document: %s", e)
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def config(self) -> Dict:
+        """Return the discovery document, refreshing it in the background once it's stale."""
+        with self._lock:
+            config = self._config
+            stale = time.monotonic() - self._config_fetched_at > self.ttl
+            start_refresh = config is not None and stale and not self._refreshing
+            if start_refresh:
+                self._refreshing = True
+        if config is None:
+            return self._fetch_config()
+        if start_refresh:
+            threading.Thread(target=self._background_refresh, daemon=True).start()
+        return config
+
+    def _fetch_jwks(self) -> None:
+        response = self._http().get(self.config()["jwks_uri"])
+        response.raise_for_status()
+        keys = {}
+        for key_data in response.json().get("keys", []):
+            try:
+                keys[key_data.get("kid")] = jwt.PyJWK(key_data)
+            except jwt.PyJWKError:
+                continue
+        with self._lock:
+            self._keys = keys
+            self._jwks_fetched_at = time.monotonic()
+
+    def signing_key(self, kid: Optional[str]) -> jwt.PyJWK:
+        key = self._keys.get(kid)
+        if key is not None:
+            return key
+        # Unknown kid usually means the provider rotated keys; refetch, but not on every bad token
+        if not self._keys or time.monotonic() - self._jwks_fetched_at > self.jwks_refetch_interval:
+            self._fetch_jwks()
+            key = self._keys.get(kid)
+        if key is None:
+            raise jwt.InvalidTokenError(f"Unknown signing key: {kid}")
+        return key
+
+    def verify_id_token(self, id_token: str) -> Dict:
+        """Verify signature, audience, issuer and expiry of an id_token and return its claims."""
+        header = jwt.get_unverified_header(id_token)
+        key = self.signing_key(header.get("kid"))
+        issuer = self.config()["issuer"]
+        issuers = [issuer]
+        # Google issues tokens with and without the scheme
+        if issuer.startswith("https://"):
+            issuers.append(issuer[len("https://"):])
+        return jwt.decode(
+            id_token,
+            key,
+            algorithms=[key.algorithm_name],
+            audience=self.client_id,
+            issuer=issuers,
+            leeway=self.leeway
+        )
@@ -0,0 +1,168 @@
+"""Opt-in per-request profiling.
+
+Profiling is off unless ``PROFILE_SECRET`` or ``PROFILE_SAMPLE_RATE`` is set; when both are
+unset no hooks are installed at all. A request is profiled when it carries
+``X-Gatherly-Profile: <PROFILE_SECRET>`` or is picked by the sampling rate. The profile is
+written to ``PROFILE_DIR`` as ``<time>-<pid>-<method>-<route>[-<chat_id>].<ext>`` and the
+file name is returned in the ``X-Profile-Id`` response header.
+
+``PROFILE_FORMAT`` selects the output:
+
+* ``pstats`` (default): deterministic ``cProfile`` data, load with ``python -m pstats``
+  or snakeviz.
+* ``collapsed``: a sampling thread records the request thread's stack every
+  ``PROFILE_INTERVAL_MS`` milliseconds; the ``stack count`` lines feed straight into
+  flamegraph.pl or speedscope.
+
+Only one request per process is profiled at a time (cProfile cannot nest); requests
+that arrive while a profile is running are served unprofiled.
+"""
+from collections import Counter
+from typing import Optional
+import cProfile
+import hmac
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from flask import Flask, g, request
+
+PROFILE_HEADER = "X-Gatherly-Profile"
+FORMATS = ("pstats", "collapsed")
+
+
+class StackSampler:
+    """Samples one thread's Python stack from a background thread into collapsed-stack counts"""
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def dump(self, path: str) -> None:
+        with open(path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class RequestProfiler:
+    def __init__(self, directory: str, secret: Optional[str] = None, sample_rate: float = 0.0,
+                 output_format: str = "pstats", interval: float = 0.005):
+        if output_format not in FORMATS:
+            raise ValueError(f"PROFILE_FORMAT must be one of {', '.join(FORMATS)}")
+        self.directory = directory
+        self.secret = secret
+        self.sample_rate = sample_rate
+        self.output_format = output_format
+        self.interval = interval
+        self._busy = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> Optional["RequestProfiler"]:
+        """Build a profiler from the PROFILE_* settings, or None when profiling is disabled"""
+        secret = os.getenv("PROFILE_SECRET") or None
+        sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+        if not secret and sample_rate <= 0:
+            return None
+        return cls(
+            directory=os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "gatherly-profiles")),
+            secret=secret,
+            sample_rate=sample_rate,
+            output_format=os.getenv("PROFILE_FORMAT", "pstats"),
+            interval=float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000,
+        )
+
+    def wants_profile(self) -> bool:
+        header = request.headers.get(PROFILE_HEADER)
+        if self.secret and header and hmac.compare_digest(header, self.secret):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self):
+        if not self._busy.acquire(blocking=False):
+            return None
+        if self.output_format == "collapsed":
+            profiler = StackSampler(threading.get_ident(), self.interval)
+            profiler.start()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        return profiler
+
+    def stop(self, profiler) -> str:
+        """Stop ``profiler``, write its output and return the file name"""
+        try:
+            if isinstance(profiler, StackSampler):
+                profiler.stop()
+            else:
+                profiler.disable()
+        finally:
+            self._busy.release()
+
+        os.makedirs(self.directory, exist_ok=True)
+        name = self._file_name()
+        path = os.path.join(self.directory, name)
+        if isinstance(profiler, StackSampler):
+            profiler.dump(path)
+        else:
+            profiler.dump_stats(path)
+        return name
+
+    def _file_name(self) -> str:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        parts = [time.strftime("%Y%m%dT%H%M%S"), str(os.getpid()), request.method, route]
+        chat_id = (request.view_args or {}).get("chat_id")
+        if chat_id:
+            parts.append(chat_id)
+        slug = "-".join(re.sub(r"[^A-Za-z0-9]+", "_", part).strip("_") for part in parts)
+        extension = "collapsed" if self.output_format == "collapsed" else "pstats"
+        return f"{slug}.{extension}"
+
+
+def init_app(app: Flask, profiler: Optional[RequestProfiler] = None) -> None:
+    """Install the profiling hooks if ``profiler`` (default: from the environment) is enabled"""
+    profiler = profiler or RequestProfiler.from_env()
+    if profiler is None:
+        return
+
+    @app.before_request
+    def start_profile():
+        if profiler.wants_profile():
+            g.profiler = profiler.start()
+
+    @app.after_request
+    def write_profile(response):
+        active = g.pop("profiler", None)
+        if active is not None:
+            response.headers["X-Profile-Id"] = profiler.stop(active)
+        return response
+
+    @app.teardown_request
+    def discard_profile(exc):
+        # after_request is skipped when the request errors out; never leave the profiler running
+        active = g.pop("profiler", None)
+        if active is not None:
+            profiler.stop(active)
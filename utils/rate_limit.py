@@ -0,0 +1,255 @@
+"""Per-user and per-chat rate limits, and a process-wide cap on requests in flight.
+
+Rate limits are token buckets: each key (``user:<id>``, ``chat:<id>``) refills at
+``per_minute`` tokens a minute up to ``burst``, and each limited request takes one token.
+An empty bucket raises ``RateLimited``, which the chat blueprint turns into a 429 with
+``Retry-After``. Buckets live in process memory by default, so with several gunicorn
+workers each worker enforces the limit on its own; set ``RATE_LIMIT_REDIS_URL`` to share
+them between workers and hosts through Redis.
+
+The concurrency cap sheds load before the database pool runs dry. gthread workers run
+``GUNICORN_THREADS`` requests at once, far more than the pool's connections, so without
+the cap excess requests queue on the pool for its whole checkout timeout. Requests over
+``MAX_IN_FLIGHT_REQUESTS`` get a 503 with ``Retry-After`` straight away instead.
+
+A slot stands for a database connection, so it is not held while waiting on the LLM:
+the summary and validation endpoints are not capped per request but take a slot around
+each database read and write (``utils.concurrency.database_slot``), and a send that goes
+on to validate the chat gives its slot back first (``release_request_slot``).
+"""
+from collections import OrderedDict
+from functools import wraps
+from typing import Dict, NamedTuple, Optional
+import inspect
+import os
+import threading
+import time
+from flask import Flask, current_app, jsonify, request
+from middleware.auth import current_identity
+from utils.concurrency import release_request_slot, take_request_slot
+from utils.metrics import registry
+
+RATE_LIMIT_USER_PER_MINUTE = float(os.getenv("RATE_LIMIT_USER_PER_MINUTE", "120"))
+RATE_LIMIT_USER_BURST = float(os.getenv("RATE_LIMIT_USER_BURST", "30"))
+RATE_LIMIT_CHAT_PER_MINUTE = float(os.getenv("RATE_LIMIT_CHAT_PER_MINUTE", "600"))
+RATE_LIMIT_CHAT_BURST = float(os.getenv("RATE_LIMIT_CHAT_BURST", "100"))
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL")
+# In-memory buckets kept per process; the least recently used are dropped first, which
+# only forgets buckets that have (nearly) refilled anyway
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# SQLAlchemy's default pool holds 15 connections (5 + 10 overflow); stay below it so the
+# chat reaper and the archiver still get one. 0 disables the cap.
+MAX_IN_FLIGHT_REQUESTS = int(os.getenv("MAX_IN_FLIGHT_REQUESTS", "12"))
+# Endpoints that never touch the database stay reachable while requests are shed, and
+# the LLM endpoints take a slot only around their database work (``database_slot``)
+UNCAPPED_ENDPOINTS = {"metrics", "health_check", "chat_controller.health_check", "static",
+                      "chat_controller.get_chat_summary", "chat_controller.validate_chat_context"}
+
+rate_limited_requests = registry.counter(
+    "gatherly_rate_limited_total", "Requests rejected with 429, by limit")
+requests_in_flight = registry.gauge(
+    "gatherly_requests_in_flight", "Requests currently holding a concurrency slot")
+
+
+class RateLimited(Exception):
+    """A rate limit is exhausted; ``retry_after`` is the time until a token is available"""
+
+    def __init__(self, message: str, limit: str, retry_after: float):
+        super().__init__(message)
+        self.limit = limit
+        self.retry_after = retry_after
+
+
+class Limit(NamedTuple):
+    name: str
+    per_minute: float
+    burst: float
+
+
+LIMITS: Dict[str, Limit] = {
+    "user": Limit("user", RATE_LIMIT_USER_PER_MINUTE, RATE_LIMIT_USER_BURST),
+    "chat": Limit("chat", RATE_LIMIT_CHAT_PER_MINUTE, RATE_LIMIT_CHAT_BURST),
+}
+
+
+class MemoryBackend:
+    """Token buckets in this process, as ``key -> [level, updated]``"""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS, clock=time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, limit: Limit) -> float:
+        """Take a token from ``key``'s bucket; 0 on success, else seconds until one is available"""
+        rate = limit.per_minute / 60.0
+        now = self.clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [limit.burst, now]
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(limit.burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0.0
+            return (1 - bucket[0]) / rate
+
+    def clear(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+
+
+# Refill and take atomically on the server, using the server's clock so that workers on
+# different hosts agree. Returns the wait as a string: Redis truncates Lua numbers.
+_TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'level', 'updated')
+local level = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+level = math.min(burst, level + math.max(0, now - updated) * rate)
+local wait = 0
+if level >= 1 then
+    level = level - 1
+else
+    wait = (1 - level) / rate
+end
+redis.call('HSET', KEYS[1], 'level', tostring(level), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+class RedisBackend:
+    """Token buckets shared by all workers through Redis (needs the ``redis`` package)"""
+
+    prefix = "gatherly:ratelimit:"
+
+    def __init__(self, url: str):
+        # Optional dependency: only deployments that share limits install it
+        import redis
+
+        self._client = redis.Redis.from_url(url)
+        self._take = self._client.register_script(_TAKE_SCRIPT)
+
+    def take(self, key: str, limit: Limit) -> float:
+        return float(self._take(keys=[self.prefix + key], args=[limit.per_minute / 60.0, limit.burst]))
+
+    def clear(self) -> None:
+        for key in self._client.scan_iter(self.prefix + "*"):
+            self._client.delete(key)
+
+
+class RateLimiter:
+    """Checks requests against ``LIMITS``; the backend is created on first use"""
+
+    def __init__(self, backend=None, redis_url: Optional[str] = RATE_LIMIT_REDIS_URL):
+        self._backend = backend
+        self.redis_url = redis_url
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    self._backend = RedisBackend(self.redis_url) if self.redis_url else MemoryBackend()
+        return self._backend
+
+    @backend.setter
+    def backend(self, backend) -> None:
+        self._backend = backend
+
+    def check(self, name: str, key: str) -> None:
+        """Take a token for ``key`` under limit ``name``, or raise RateLimited"""
+        limit = LIMITS[name]
+        wait = self.backend.take(f"{name}:{key}", limit)
+        if wait > 0:
+            rate_limited_requests.inc(limit=name)
+            raise RateLimited(f"Too many requests, retry in {wait:.0f}s", name, wait)
+
+
+rate_limiter = RateLimiter()
+
+
+def _check_limits(names) -> None:
+    if not current_app.config["RATE_LIMITS"]:
+        return
+    for name in names:
+        if name == "user":
+            identity = current_identity()
+            key = identity.user_id if identity is not None else request.remote_addr
+        else:
+            key = request.view_args.get(f"{name}_id")
+        if key is not None:
+            rate_limiter.check(name, key)
+
+
+def rate_limit(*names: str):
+    """Take a token from each named limit before the view runs; goes below ``require_auth``.
+
+    ``"user"`` is keyed by the authenticated user, any other name by the ``<name>_id``
+    URL argument (``"chat"`` by ``chat_id``).
+    """
+    def decorator(f):
+        if inspect.iscoroutinefunction(f):
+            @wraps(f)
+            async def async_limited(*args, **kwargs):
+                _check_limits(names)
+                return await f(*args, **kwargs)
+            return async_limited
+
+        @wraps(f)
+        def limited(*args, **kwargs):
+            _check_limits(names)
+            return f(*args, **kwargs)
+        return limited
+    return decorator
+
+
+class ConcurrencyLimiter:
+    """Non-blocking cap on requests in flight in this process"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        with self._lock:
+            if self.in_flight >= self.limit:
+                return False
+            self.in_flight += 1
+            requests_in_flight.set(self.in_flight)
+            return True
+
+    def release(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            requests_in_flight.set(self.in_flight)
+
+
+def init_app(app: Flask) -> None:
+    """Install the concurrency cap (``MAX_IN_FLIGHT_REQUESTS`` config, 0 disables it)"""
+    limit = app.config["MAX_IN_FLIGHT_REQUESTS"]
+    if not limit:
+        return
+    app.extensions["concurrency_limiter"] = ConcurrencyLimiter(limit)
+
+    @app.before_request
+    def acquire_request_slot():
+        if request.endpoint in UNCAPPED_ENDPOINTS or take_request_slot():
+            return None
+        return jsonify({"error": "Server is busy, please retry shortly"}), 503, {"Retry-After": "1"}
+
+    @app.teardown_request
+    def release_slot_on_teardown(exc=None):
+        release_request_slot()
@@ -0,0 +1,176 @@
+"""Local agenda-relevance scoring, so clearly on-topic chats skip the LLM validation call.
+
+Messages and the agenda are turned into hashed bag-of-words vectors (``tokenize`` terms
+hashed into ``dim`` buckets). Each chat keeps, per process, the summed term counts of its
+recent message window and the document frequency of every bucket over the messages seen so
+far. Both are updated incrementally: a validation only hashes the messages after the last
+one it counted (found by message id, not position), and the oldest message's counts are
+subtracted as it leaves the window.
+
+The score is the cosine similarity of the TF-IDF weighted agenda and window vectors. A
+score of at least ``on_topic`` is decided locally as on topic; a score at or below
+``off_topic`` (disabled by default) locally as off topic. Everything in between, and
+windows shorter than ``min_messages``, is escalated to the LLM. Decisions are counted in
+``gatherly_relevance_decisions_total`` so the skip rate can be read off ``/metrics``.
+"""
+from collections import OrderedDict, deque
+from typing import Iterable, List, Optional, Tuple
+import os
+import threading
+import zlib
+import numpy as np
+from utils.metrics import registry
+from utils.text import tokenize
+
+RELEVANCE_ON_TOPIC = float(os.getenv("RELEVANCE_ON_TOPIC", "0.3"))
+RELEVANCE_OFF_TOPIC = float(os.getenv("RELEVANCE_OFF_TOPIC", "-1"))
+RELEVANCE_MIN_MESSAGES = int(os.getenv("RELEVANCE_MIN_MESSAGES", "5"))
+# Matches the number of recent messages the validation prompt shows the LLM
+RELEVANCE_WINDOW = int(os.getenv("RELEVANCE_WINDOW", "25"))
+RELEVANCE_DIM = int(os.getenv("RELEVANCE_DIM", "2048"))
+RELEVANCE_MAX_CHATS = int(os.getenv("RELEVANCE_MAX_CHATS", "1024"))
+
+relevance_decisions = registry.counter(
+    "gatherly_relevance_decisions_total",
+    "Context validations by who decided them (local or llm) and the outcome")
+relevance_scores = registry.histogram(
+    "gatherly_relevance_score", "Agenda relevance scores of validated message windows",
+    buckets=(0.05, 0.1, 0.15, 0.2, 0.3, 0.4, 0.5, 0.6, 0.8, 1.0))
+
+
+def hash_terms(content: str, dim: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Distinct hashed term buckets of ``content`` and their counts"""
+    buckets = np.fromiter((zlib.crc32(term.encode()) % dim for term in tokenize(content)), dtype=np.int64)
+    indices, counts = np.unique(buckets, return_counts=True)
+    return indices, counts.astype(np.float32)
+
+
+def _messages_after(messages: List, message_id) -> Optional[List]:
+    """The messages after the one with ``message_id`` (all of them for None), or None if it is not there"""
+    if message_id is None:
+        return messages
+    for position in range(len(messages) - 1, -1, -1):
+        if messages[position].id == message_id:
+            return messages[position + 1:]
+    return None
+
+
+class ChatWindow:
+    """Incrementally maintained term statistics of one chat"""
+
+    def __init__(self, dim: int, window: int):
+        self.dim = dim
+        self.window = window
+        self.window_tf = np.zeros(dim, dtype=np.float32)
+        self.doc_freq = np.zeros(dim, dtype=np.float32)
+        self.documents = 0
+        self.messages = deque()
+        self.last_message_id = None
+        self.agenda = None
+        self.agenda_tf = np.zeros(dim, dtype=np.float32)
+
+    def add(self, content: str) -> None:
+        indices, counts = hash_terms(content, self.dim)
+        self.doc_freq[indices] += 1
+        self.documents += 1
+        self.window_tf[indices] += counts
+        self.messages.append((indices, counts))
+        if len(self.messages) > self.window:
+            old_indices, old_counts = self.messages.popleft()
+            self.window_tf[old_indices] -= old_counts
+
+    def set_agenda(self, agenda: str) -> None:
+        self.agenda = agenda
+        self.agenda_tf = np.zeros(self.dim, dtype=np.float32)
+        indices, counts = hash_terms(agenda or "", self.dim)
+        self.agenda_tf[indices] = counts
+
+    def score(self) -> float:
+        idf = np.log((1.0 + self.documents) / (1.0 + self.doc_freq)) + 1.0
+        agenda = self.agenda_tf * idf
+        window = self.window_tf * idf
+        norm = float(np.linalg.norm(agenda) * np.linalg.norm(window))
+        if norm == 0.0:
+            return 0.0
+        return float(np.dot(agenda, window) / norm)
+
+
+class RelevanceIndex:
+    def __init__(self, on_topic: float = RELEVANCE_ON_TOPIC, off_topic: float = RELEVANCE_OFF_TOPIC,
+                 min_messages: int = RELEVANCE_MIN_MESSAGES, window: int = RELEVANCE_WINDOW,
+                 dim: int = RELEVANCE_DIM, max_chats: int = RELEVANCE_MAX_CHATS):
+        self.on_topic = on_topic
+        self.off_topic = off_topic
+        self.min_messages = min_messages
+        self.window = window
+        self.dim = dim
+        self.max_chats = max_chats
+        self._chats: "OrderedDict[str, ChatWindow]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _window_for(self, chat) -> Tuple[ChatWindow, List]:
+        """The chat's window state and the messages it has not counted yet"""
+        state = self._chats.get(chat.id)
+        unseen = _messages_after(chat.messages, state.last_message_id) if state is not None else None
+        if unseen is None:
+            # New chat, or the last message we counted is no longer loaded; start over
+            state = ChatWindow(self.dim, self.window)
+            self._chats[chat.id] = state
+            unseen = chat.messages
+            while len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        self._chats.move_to_end(chat.id)
+        return state, unseen
+
+    def score(self, chat, skip_senders: Iterable[str] = ()) -> Tuple[float, int]:
+        """The agenda relevance of ``chat``'s recent window and the number of messages in it
+
+        Only messages newer than the last one seen by a previous call are hashed, so
+        the loaded messages may slide forward between calls. Messages from
+        ``skip_senders`` (such as the AI's own reminders, which quote the agenda) are
+        not counted.
+        """
+        with self._lock:
+            state, unseen = self._window_for(chat)
+            for message in unseen:
+                if message.sender_id not in skip_senders:
+                    state.add(message.content)
+            if chat.messages:
+                state.last_message_id = chat.messages[-1].id
+            if state.agenda != chat.agenda:
+                state.set_agenda(chat.agenda)
+            return state.score(), len(state.messages)
+
+    def decide(self, chat, skip_senders: Iterable[str] = ()) -> Tuple[Optional[bool], float]:
+        """(True/False when the score settles whether ``chat`` is on topic, else None; score)"""
+        score, window = self.score(chat, skip_senders)
+        relevance_scores.observe(score)
+        if window < self.min_messages:
+            return None, score
+        if score >= self.on_topic:
+            relevance_decisions.inc(decided_by="local", outcome="on_topic")
+            return True, score
+        if score <= self.off_topic:
+            relevance_decisions.inc(decided_by="local", outcome="off_topic")
+            return False, score
+        return None, score
+
+    @staticmethod
+    def record_escalation(is_on_topic: bool) -> None:
+        relevance_decisions.inc(decided_by="llm", outcome="on_topic" if is_on_topic else "off_topic")
+
+    @staticmethod
+    def skip_rate() -> float:
+        """Share of validations decided without the LLM since the process started"""
+        local = sum(relevance_decisions.value(decided_by="local", outcome=outcome)
+                    for outcome in ("on_topic", "off_topic"))
+        total = local + sum(relevance_decisions.value(decided_by="llm", outcome=outcome)
+                            for outcome in ("on_topic", "off_topic"))
+        return local / total if total else 0.0
+
+    def clear(self) -> None:
+        with self._lock:
+            self._chats.clear()
+
+
+relevance_index = RelevanceIndex()
@@ -0,0 +1,25 @@
+from typing import Iterable, Iterator
+import json
+import zlib
+
+
+def ndjson_batches(records: Iterable[dict], batch_size: int) -> Iterator[bytes]:
+    """Serialize records as newline-delimited JSON, yielding one chunk per ``batch_size`` records"""
+    lines = []
+    for record in records:
+        lines.append(json.dumps(record, default=str))
+        if len(lines) >= batch_size:
+            yield ("\n".join(lines) + "\n").encode()
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode()
+
+
+def gzip_stream(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """Gzip a byte stream on the fly, flushing after every chunk so the client sees progress"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,27 @@
+from collections import Counter
+from typing import Dict, List
+import re
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# Longest term stored in the search index; longer tokens are truncated
+MAX_TERM_LENGTH = 64
+
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have i if in into is it its me my no not of on or our
+so that the their them then there these they this to was we were what when which who will with
+you your
+""".split())
+
+
+def tokenize(content: str) -> List[str]:
+    """Lowercase word tokens with stopwords and single characters removed"""
+    return [
+        token[:MAX_TERM_LENGTH]
+        for token in _WORD_RE.findall(content.lower())
+        if len(token) > 1 and token not in STOPWORDS
+    ]
+
+
+def term_frequencies(content: str) -> Dict[str, int]:
+    return dict(Counter(tokenize(content)))
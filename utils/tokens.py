@@ -0,0 +1,128 @@
+"""Token counting for LLM budgets.
+
+Uses the model's tiktoken encoding. tiktoken downloads its BPE files on first use (set
+``TIKTOKEN_CACHE_DIR`` to ship them with the image); if the encoding cannot be loaded we
+fall back to a ~4 characters per token estimate rather than failing the request, and try
+loading it again after ``TIKTOKEN_RETRY_SECONDS``. Estimates are never stored or cached:
+``exact_token_count`` returns None instead, so a message written meanwhile keeps a NULL
+``token_count`` and is counted properly once the encoding is back.
+"""
+from collections import OrderedDict
+from typing import Hashable, Optional, Sequence
+import logging
+import os
+import threading
+import time
+
+DEFAULT_MODEL = "gpt-3.5-turbo-instruct"
+CHARS_PER_TOKEN = 4
+TIKTOKEN_RETRY_SECONDS = float(os.getenv("TIKTOKEN_RETRY_SECONDS", "300"))
+
+logger = logging.getLogger(__name__)
+
+_encodings = {}
+# model -> time.monotonic() of the last failed load
+_failed_at = {}
+_lock = threading.Lock()
+
+
+def get_encoding(model: str = DEFAULT_MODEL):
+    """The tiktoken encoding for ``model``, or None while it is unavailable.
+
+    A loaded encoding is cached for good; a failed load is retried once
+    TIKTOKEN_RETRY_SECONDS have passed.
+    """
+    encoding = _encodings.get(model)
+    if encoding is not None:
+        return encoding
+    failed_at = _failed_at.get(model)
+    if failed_at is not None and time.monotonic() - failed_at < TIKTOKEN_RETRY_SECONDS:
+        return None
+    with _lock:
+        if model not in _encodings:
+            failed_at = _failed_at.get(model)
+            if failed_at is not None and time.monotonic() - failed_at < TIKTOKEN_RETRY_SECONDS:
+                return None
+            try:
+                import tiktoken
+                _encodings[model] = tiktoken.encoding_for_model(model)
+                _failed_at.pop(model, None)
+            except Exception as e:
+                logger.warning("tiktoken encoding for %s unavailable, estimating token counts: %s", model, e)
+                _failed_at[model] = time.monotonic()
+                return None
+        return _encodings[model]
+
+
+def exact_token_count(text: str, model: str = DEFAULT_MODEL) -> Optional[int]:
+    """Tokens in ``text``, or None when the encoding is unavailable and only an estimate would do"""
+    encoding = get_encoding(model)
+    if encoding is None:
+        return None
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_tokens(text: str, model: str = DEFAULT_MODEL, encoding: Optional[object] = None) -> int:
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    count = exact_token_count(text, model)
+    if count is None:
+        return len(text) // CHARS_PER_TOKEN + 1
+    return count
+
+
+class _CountCache:
+    """Bounded LRU of exact token counts; estimates are not cached"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._counts: "OrderedDict[Hashable, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, text: str) -> int:
+        with self._lock:
+            count = self._counts.get(key)
+            if count is not None:
+                self._counts.move_to_end(key)
+                return count
+        count = exact_token_count(text)
+        if count is None:
+            return len(text) // CHARS_PER_TOKEN + 1
+        with self._lock:
+            self._counts[key] = count
+            self._counts.move_to_end(key)
+            if len(self._counts) > self.maxsize:
+                self._counts.popitem(last=False)
+        return count
+
+
+_prefix_counts = _CountCache(4096)
+# Keyed on the message id and a hash of the content, so message bodies are not kept alive
+_content_counts = _CountCache(65536)
+
+
+def prompt_line_tokens(sender: str, message) -> int:
+    """Tokens of a ``sender: content`` prompt line, from the message's stored count
+
+    Messages without a stored count (written before counts were stored, or while the
+    encoding was unavailable) are counted once and cached.
+    """
+    content_tokens = message.token_count
+    if content_tokens is None:
+        content_tokens = _content_counts.get((message.id, hash(message.content)), message.content)
+    # "sender: " before the content and the newline joining it to the next line
+    prefix = f"{sender or ''}: "
+    return _prefix_counts.get(prefix, prefix) + 1 + content_tokens
+
+
+def window_start(token_counts: Sequence[int], budget: int) -> int:
+    """Start of the longest suffix of ``token_counts`` that fits in ``budget``
+
+    The last item is always kept, even when it alone is over budget.
+    """
+    total = 0
+    for start in range(len(token_counts) - 1, -1, -1):
+        total += token_counts[start]
+        if total > budget:
+            return min(start + 1, len(token_counts) - 1)
+    return 0
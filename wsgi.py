@@ -0,0 +1,8 @@
+"""WSGI entry point for gunicorn (``gunicorn wsgi:app``).
+
+Kept apart from ``app.py`` so that importing the factory loads no configuration and
+sets up no logging; only the server process builds the application.
+"""
+from app import create_app
+
+app = create_app()